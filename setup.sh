@@ -1,5 +1,5 @@
 pip3 install setuptools 
-pip3 install pyside2 psycopg2-binary pyserial matplotlib requests
+pip3 install pyside2 psycopg2-binary pyserial matplotlib numpy requests
 
 echo "Downloading and extracting PostgreSQL binaries. This may take a while..."
 
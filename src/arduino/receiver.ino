@@ -2,10 +2,24 @@
 #include <SPI.h>
 #include <RH_RF95.h>
 #include <LiquidCrystal.h>
+#include <util/crc16.h>
 
 #define RADIO_FREQUENCY 905.5
 #define TIMEOUT_MS 5000
 
+// 1 forwards each radio packet as a binary frame (see protocol.py), 0 as a line of comma-separated
+// text. Must match transmitter.ino and SerialProtocol/SerialBaudRate in settings.txt
+#define BINARY_PROTOCOL 1
+#if BINARY_PROTOCOL
+#define SERIAL_BAUD 115200
+#else
+#define SERIAL_BAUD 9600
+#endif
+
+#define PROTOCOL_VERSION 1
+// Field id of the RSSI, see the Packet section of Parameters.xml
+#define RSSI_ID 6
+
 struct SerialData
 {
     float main_battery_voltage;
@@ -25,13 +39,48 @@ enum Pins
 char serialBuffer[RH_RF95_MAX_MESSAGE_LEN];
 RH_RF95 rf95(Pins::rfm95_cs, Pins::rfm95_int);
 
+// Writes a byte to the serial port and adds it to the running CRC-16/CCITT-FALSE
+void writeFrameByte(uint8_t value, uint16_t *crc)
+{
+    Serial.write(value);
+    *crc = _crc_xmodem_update(*crc, value);
+}
+
+// Frame layout: 0xAA 0x55, version, payload length, payload, CRC-16 (little-endian) of everything
+// after the sync bytes. The payload is the transmitter's records followed by an RSSI record
+void writeFrame(uint8_t *payload, uint8_t length, float rssi)
+{
+    uint16_t crc = 0xFFFF;
+    Serial.write(0xAA);
+    Serial.write(0x55);
+    writeFrameByte(PROTOCOL_VERSION, &crc);
+    writeFrameByte(length + 1 + sizeof(rssi), &crc);
+
+    for (uint8_t i = 0; i < length; i++)
+        writeFrameByte(payload[i], &crc);
+
+    writeFrameByte(RSSI_ID, &crc);
+    uint8_t *rssiBytes = (uint8_t *)&rssi;
+    for (uint8_t i = 0; i < sizeof(rssi); i++)
+        writeFrameByte(rssiBytes[i], &crc);
+
+    Serial.write(crc & 0xFF);
+    Serial.write(crc >> 8);
+}
+
 void receiveData()
 {
     Serial.println("Waiting for packet..."); delay(10);
     if (rf95.waitAvailableTimeout(TIMEOUT_MS))
     {
-        if (rf95.recv(serialBuffer, RH_RF95_MAX_MESSAGE_LEN))
+        uint8_t length = RH_RF95_MAX_MESSAGE_LEN;
+        if (rf95.recv((uint8_t *)serialBuffer, &length))
         {
+#if BINARY_PROTOCOL
+            // The visualizer checks the records against the packet layout in Parameters.xml
+            if (length > 0)
+                writeFrame((uint8_t *)serialBuffer, length, rf95.lastRssi());
+#else
             // Append RSSI to data packet to be sent
             char rssi[10];
             dtostrf(rf95.lastRssi(), 7, 3, rssi);
@@ -40,6 +89,7 @@ void receiveData()
 
             // Write data packet over serial port, where it will be parsed
             Serial.println(serialBuffer);
+#endif
         }
 
         else
@@ -58,7 +108,7 @@ void setup()
     pinMode(Pins::rfm95_rst, OUTPUT);
     digitalWrite(Pins::rfm95_rst, HIGH);
     while (!Serial);
-    Serial.begin(9600);
+    Serial.begin(SERIAL_BAUD);
     delay(100);
 
     // Setup radio
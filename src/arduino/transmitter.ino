@@ -8,6 +8,20 @@
 #define RADIO_FREQUENCY 905.0
 #define TRANSMIT_DELAY_MS 3000
 
+// 1 sends binary (sensor id, little-endian float) records, which receiver.ino wraps into a framed
+// packet. 0 sends the old comma-separated text. Must match the receiver and SerialProtocol in settings.txt
+#define BINARY_PROTOCOL 1
+
+// Field ids of the binary records, must match the Packet section of Parameters.xml
+enum SensorIds
+{
+    main_battery_voltage_id = 1,
+    main_battery_amperage_id = 2,
+    aux_battery_voltage_id = 3,
+    temperature_id = 4,
+    uptime_id = 5,
+};
+
 struct RadioPacket
 {
     float main_battery_voltage;
@@ -30,6 +44,7 @@ enum Pins
 
 int starttime = millis();
 char formattedPacket[RH_RF95_MAX_MESSAGE_LEN];
+uint8_t formattedPacketLength = 0;
 RH_RF95 rf95(Pins::rfm95_cs, Pins::rfm95_int);
 OneWire oneWire(Pins::ds18b20_data);
 DallasTemperature ds18b20(&oneWire);
@@ -55,6 +70,14 @@ void readAnalogData()
     packet.main_battery_amperage = shunt_voltage / 0.0001;
 }
 
+// Appends one 5 byte record to the binary packet. AVR floats are already little-endian IEEE 754
+void appendRecord(uint8_t id, float value)
+{
+    formattedPacket[formattedPacketLength++] = id;
+    memcpy(formattedPacket + formattedPacketLength, &value, sizeof(value));
+    formattedPacketLength += sizeof(value);
+}
+
 void readAllData()
 {
     //readDS18B20();
@@ -65,6 +88,14 @@ void readAllData()
     packet.main_battery_voltage = 48.0;
     packet.main_battery_amperage = 100.0;
 
+#if BINARY_PROTOCOL
+    formattedPacketLength = 0;
+    appendRecord(SensorIds::main_battery_voltage_id, packet.main_battery_voltage);
+    appendRecord(SensorIds::main_battery_amperage_id, packet.main_battery_amperage);
+    appendRecord(SensorIds::aux_battery_voltage_id, packet.aux_battery_voltage);
+    appendRecord(SensorIds::temperature_id, packet.ds18b20_temperature);
+    appendRecord(SensorIds::uptime_id, (millis()-starttime)/1000);
+#else
     char main_battery_voltage[10];
     char main_battery_amperage[10];
     char aux_battery_voltage[10];
@@ -77,13 +108,17 @@ void readAllData()
 
     memset(formattedPacket, 0, RH_RF95_MAX_MESSAGE_LEN);
     sprintf((char*)formattedPacket, "%s,%s,%s,%s,%d", main_battery_voltage, main_battery_amperage, aux_battery_voltage, ds18b20_temperature, (millis()-starttime)/1000);
+    formattedPacketLength = strlen(formattedPacket) + 1;
+#endif
 }
 
 void transmitData()
 {
+#if !BINARY_PROTOCOL
     Serial.println(formattedPacket);
     Serial.print("Sending "); Serial.println(formattedPacket); delay(10);
-    rf95.send((uint8_t *)formattedPacket, sizeof(formattedPacket));
+#endif
+    rf95.send((uint8_t *)formattedPacket, formattedPacketLength);
 
     Serial.println("Waiting for packet to complete..."); delay(10);
     rf95.waitPacketSent();
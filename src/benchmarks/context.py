@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The visualizer loads settings.txt and Parameters.xml relative to the working directory and
+# imports its modules by name, so the benchmarks run from inside its directory
+VISUALIZER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "visualizer")
+# For resolving paths given on the command line
+STARTING_PATH = os.getcwd()
+sys.path.append(VISUALIZER_PATH)
+os.chdir(VISUALIZER_PATH)
@@ -0,0 +1,130 @@
+import argparse
+import datetime
+import tempfile
+import time
+
+import context
+import psycopg2.sql as sql
+
+from database import DatabaseConnection
+from ingest import IngestPipeline
+from spool import Spool
+from storage import StorageManager
+
+"""
+Compares the rows/sec of the original one-commit-per-value ingest path against the batched one,
+where packets are appended to the spool and replayed into the database by IngestPipeline.write_packets
+(see spool.py), both with one table per sensor and with the wide one-row-per-packet table. Runs
+against the local Postgres instance from settings.txt, using a scratch schema that is dropped
+afterwards.
+
+    python3 ingest_benchmark.py --packets 5000 --replay-batch 600
+"""
+
+SCHEMA = "ingest_benchmark"
+
+
+def create_tables(db_conn, sensors):
+    with db_conn.transaction() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+        cursor.execute(sql.SQL("CREATE SCHEMA {0}").format(sql.Identifier(SCHEMA)))
+        for sensor in range(sensors):
+            cursor.execute(sql.SQL(
+                "CREATE TABLE {0}.{1} (id serial PRIMARY KEY, timestamp timestamp with time zone, value numeric)"
+            ).format(sql.Identifier(SCHEMA), sql.Identifier("sensor_{0}".format(sensor))))
+
+
+def create_wide_table(db_conn, sensors):
+    columns = list(make_packet(0, sensors).keys())
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+
+    storage_manager = StorageManager(db_conn)
+    with db_conn.transaction() as cursor:
+        storage_manager.create_table(cursor, SCHEMA, "packets", [(column, "double precision") for column in columns])
+        storage_manager.create_partitions(cursor, SCHEMA, "packets", today, today + datetime.timedelta(days=1))
+
+    db_conn.storage_mode = "wide"
+    db_conn.wide_table = (SCHEMA, "packets")
+    db_conn.wide_columns = columns
+    db_conn.plan_inserts()
+
+
+def drop_tables(db_conn):
+    with db_conn.transaction() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+
+
+def make_packet(index, sensors):
+    return {"{0}.sensor_{1}".format(SCHEMA, sensor): float(index + sensor) for sensor in range(sensors)}
+
+
+# One INSERT and one commit per value, as SerialReader used to do
+def run_per_value(db_conn, packets, sensors):
+    start = time.perf_counter()
+    for index in range(packets):
+        for unique_tag, value in make_packet(index, sensors).items():
+            schema, table = unique_tag.split(".")
+            db_conn.append_value(schema, table, value)
+    return time.perf_counter() - start
+
+
+# Appends every packet to a scratch spool and replays it like IngestPipeline.write_loop does, a
+# transaction per replay_batch packets
+def run_batched(db_conn, packets, sensors, replay_batch):
+    with tempfile.TemporaryDirectory() as spool_path:
+        pipeline = IngestPipeline(db_conn, spool=Spool(spool_path, 64 * 1024 * 1024))
+        if replay_batch:
+            pipeline.replay_batch = replay_batch
+
+        start = time.perf_counter()
+        for index in range(packets):
+            pipeline.spool.append(time.time(), make_packet(index, sensors))
+
+        position = pipeline.spool.checkpoint
+        while True:
+            batch, next_position = pipeline.spool.read(position, pipeline.replay_batch)
+            if not batch:
+                break
+            if not pipeline.write_packets(batch):
+                raise RuntimeError("Could not write the spooled packets")
+            pipeline.spool.commit(next_position, len(batch))
+            position = next_position
+        elapsed = time.perf_counter() - start
+
+        pipeline.spool.close()
+        pipeline.serial_reader.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-value vs. batched database ingest")
+    parser.add_argument("--packets", type=int, default=2000)
+    parser.add_argument("--sensors", type=int, default=6)
+    parser.add_argument("--replay-batch", type=int, default=0, help="Override SpoolReplayBatch from settings.txt")
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+
+    db_conn.storage_mode = "per_sensor"
+    rows = args.packets * args.sensors
+    try:
+        for name, run in (("per-value commit", lambda: run_per_value(db_conn, args.packets, args.sensors)),
+                          ("batched", lambda: run_batched(db_conn, args.packets, args.sensors, args.replay_batch))):
+            create_tables(db_conn, args.sensors)
+            elapsed = run()
+            print("{0:>18}: {1} rows in {2:.3f} s, {3:.0f} rows/sec".format(name, rows, elapsed, rows / elapsed))
+
+        # Same values, stored as one row per packet
+        create_tables(db_conn, args.sensors)
+        create_wide_table(db_conn, args.sensors)
+        elapsed = run_batched(db_conn, args.packets, args.sensors, args.replay_batch)
+        print("{0:>18}: {1} values in {2:.3f} s, {3:.0f} values/sec".format("batched wide", rows, elapsed, rows / elapsed))
+    finally:
+        drop_tables(db_conn)
+
+
+if __name__ == "__main__":
+    main()
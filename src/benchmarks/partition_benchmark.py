@@ -0,0 +1,106 @@
+import argparse
+import datetime
+import random
+import statistics
+import time
+
+import context
+import psycopg2.sql as sql
+
+from database import DatabaseConnection
+from storage import StorageManager
+
+"""
+Compares time-range query latency on the old storage layout (one heap table per sensor, no index on
+the timestamp) against the partitioned layout created by StorageManager, using several days of
+synthetic 1 Hz data. Runs in a scratch schema that is dropped afterwards.
+
+    python3 partition_benchmark.py --days 7 --queries 50 --window-minutes 60
+"""
+
+SCHEMA = "partition_benchmark"
+
+
+def load_data(cursor, table, first_day, days):
+    cursor.execute(sql.SQL(
+        """
+        INSERT INTO {0}.{1} (timestamp, value)
+        SELECT %s + (second || ' seconds')::interval, random() * 50
+        FROM generate_series(0, %s) AS second
+        """
+    ).format(sql.Identifier(SCHEMA), sql.Identifier(table)),
+        (datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc), days * 86400 - 1))
+    cursor.execute(sql.SQL("ANALYZE {0}.{1}").format(sql.Identifier(SCHEMA), sql.Identifier(table)))
+
+
+def create_tables(db_conn, first_day, days):
+    with db_conn.transaction() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+        cursor.execute(sql.SQL("CREATE SCHEMA {0}").format(sql.Identifier(SCHEMA)))
+
+        # The layout described in database.py before partitioning
+        cursor.execute(sql.SQL(
+            "CREATE TABLE {0}.heap (id serial PRIMARY KEY, timestamp timestamp with time zone, value numeric)"
+        ).format(sql.Identifier(SCHEMA)))
+
+        storage_manager = StorageManager(db_conn)
+        storage_manager.create_table(cursor, SCHEMA, "partitioned")
+        storage_manager.create_partitions(cursor, SCHEMA, "partitioned", first_day,
+                                          first_day + datetime.timedelta(days=days - 1))
+
+    with db_conn.transaction() as cursor:
+        for table in ("heap", "partitioned"):
+            load_data(cursor, table, first_day, days)
+
+
+# Runs the same range query that dbtools issues for its "Date" retrieval mode
+def time_queries(db_conn, table, windows):
+    query = sql.SQL("SELECT * FROM {0}.{1} WHERE timestamp > (%s) AND timestamp < (%s)").format(
+        sql.Identifier(SCHEMA), sql.Identifier(table))
+
+    latencies = []
+    with db_conn.transaction() as cursor:
+        for lower, upper in windows:
+            start = time.perf_counter()
+            cursor.execute(query, (lower, upper))
+            cursor.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark range queries on heap vs. partitioned sensor tables")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--window-minutes", type=int, default=60)
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+
+    first_day = datetime.date(2020, 1, 1)
+    start_time = datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc)
+    window = datetime.timedelta(minutes=args.window_minutes)
+    windows = []
+    for _ in range(args.queries):
+        lower = start_time + datetime.timedelta(seconds=random.randrange(args.days * 86400 - int(window.total_seconds())))
+        windows.append((lower, lower + window))
+
+    try:
+        print(f"Loading {args.days * 86400} rows into each table...")
+        create_tables(db_conn, first_day, args.days)
+
+        for table in ("heap", "partitioned"):
+            latencies = time_queries(db_conn, table, windows)
+            print("{0:>12}: median {1:.2f} ms, p95 {2:.2f} ms over {3} queries of {4} minutes".format(
+                table, statistics.median(latencies), statistics.quantiles(latencies, n=20)[-1],
+                args.queries, args.window_minutes))
+    finally:
+        with db_conn.transaction() as cursor:
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import context
+import numpy as np
+import psycopg2.sql as sql
+
+import common
+from async_ingest import AsyncIngestPipeline
+from capture import CaptureWriter, read_capture
+from database import DatabaseConnection
+from ingest import IngestPipeline
+from protocol import FrameDecoder
+from serial_benchmark import open_pty
+from spool import Spool
+
+"""
+Replays a serial capture (see visualizer/capture.py) through a pseudo-terminal into either ingest engine,
+with the original timing scaled by --speed (or as fast as the engine reads with --speed max), and
+reports the sustained packet rate along with how long packets took from being written to the pty to
+being decoded, and to being committed to the database. Captures are taken by the visualizer when
+SerialCaptureFile is set, or synthesized at a fixed rate without the car. Packets go through a
+temporary spool into a wide table in a scratch schema, both removed afterwards.
+
+    python3 replay_benchmark.py synthesize capture.bin --rate 100 --seconds 60
+    python3 replay_benchmark.py replay capture.bin --speed 1
+    python3 replay_benchmark.py replay capture.bin --speed max --engine asyncio
+"""
+
+SCHEMA = "replay_benchmark"
+
+# Seconds between samples of the engine's packet counters
+POLL_INTERVAL = 0.001
+
+
+# A binary capture of packets arriving at a fixed rate, one frame per chunk as the receiver sends them
+def synthesize(path, rate, seconds):
+    capture = CaptureWriter(os.path.join(context.STARTING_PATH, path), "binary")
+    start = time.time()
+    for index in range(int(rate * seconds)):
+        capture.write(start + index / rate, common.packet_layout.encode_frame({
+            "main_battery.voltage": 48.0 + index % 100 / 100,
+            "main_battery.amperage": float(index % 250),
+            "aux_battery.voltage": 12.0,
+            "dht11.temperature": 20.0,
+            "uptime": index / rate,
+            "rfm95.rssi": -50.0,
+        }))
+    capture.close()
+
+
+# Number of packets each chunk completes, decoded the same way the engine will
+def count_packets(protocol, chunks):
+    decoder = FrameDecoder(common.packet_layout)
+    counts = []
+    for _, data in chunks:
+        if protocol == "binary":
+            packets = decoder.feed(data)
+        else:
+            packets = [common.packet_layout.decode_ascii(data)]
+        counts.append(sum(values is not None for values in packets))
+    return np.array(counts, dtype=np.int64)
+
+
+# Writes the chunks to the pty on their original schedule divided by speed (None for no delays), and
+# fills in the time each one went out
+def write_chunks(master, chunks, speed, send_times):
+    first_time = chunks[0][0]
+    start = time.perf_counter()
+    for index, (received_time, data) in enumerate(chunks):
+        if speed is not None:
+            delay = start + (received_time - first_time) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        send_times[index] = time.perf_counter()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(master, view):]
+
+
+# Seconds from each packet being written to the time the given counter first went past it, for the
+# packets the counter reached
+def latencies(packet_send_times, sample_times, counter):
+    reached = min(len(packet_send_times), int(counter[-1]))
+    crossings = np.searchsorted(counter, np.arange(reached), side="right")
+    return sample_times[crossings] - packet_send_times[:reached]
+
+
+def describe(label, seconds):
+    if not len(seconds):
+        return "{0:>15}: no packets".format(label)
+    p50, p95, p99 = np.percentile(seconds * 1000, [50, 95, 99])
+    return "{0:>15}: p50 {1:.2f} ms, p95 {2:.2f} ms, p99 {3:.2f} ms, max {4:.2f} ms".format(
+        label, p50, p95, p99, seconds.max() * 1000)
+
+
+def replay(args):
+    protocol, chunks = read_capture(os.path.join(context.STARTING_PATH, args.capture))
+    if not chunks:
+        print("The capture is empty")
+        return
+    common.SETTINGS["SerialProtocol"] = protocol
+    common.SETTINGS["SerialCaptureFile"] = ""
+
+    counts = count_packets(protocol, chunks)
+    packets = int(counts.sum())
+    capture_seconds = chunks[-1][0] - chunks[0][0]
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+    # The engine creates the scratch table itself through StorageManager
+    db_conn.storage_mode = "wide"
+    db_conn.wide_table = (SCHEMA, "packets")
+    db_conn.alarm_table = (SCHEMA, "alarms")
+    db_conn.rollups.schema = SCHEMA
+    db_conn.plan_inserts()
+
+    engine = AsyncIngestPipeline if args.engine == "asyncio" else IngestPipeline
+    master, slave, device = open_pty()
+    send_times = np.full(len(chunks), np.nan)
+    samples = []
+    try:
+        with tempfile.TemporaryDirectory() as spool_path:
+            pipeline = engine(db_conn, device, Spool(spool_path, 64 * 1024 * 1024))
+            pipeline.start()
+            writer = threading.Thread(target=write_chunks, args=(master, chunks, args.speed, send_times), daemon=True)
+
+            start = time.perf_counter()
+            writer.start()
+            while pipeline.packets_written() < packets and time.perf_counter() - start < args.timeout:
+                samples.append((time.perf_counter(), pipeline.packets_read, pipeline.packets_written()))
+                time.sleep(POLL_INTERVAL)
+            samples.append((time.perf_counter(), pipeline.packets_read, pipeline.packets_written()))
+            pipeline.stop()
+    finally:
+        os.close(master)
+        os.close(slave)
+        with db_conn.transaction() as cursor:
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+
+    sample_times, read, written = (np.array(column) for column in zip(*samples))
+    elapsed = sample_times[-1] - start
+    packet_send_times = np.repeat(send_times, counts)
+
+    print("{0}: {1} of {2} packets written in {3:.3f} s ({4:.3f} s of capture at {5})".format(
+        args.engine, int(written[-1]), packets, elapsed, capture_seconds,
+        "max speed" if args.speed is None else "{0:g}x".format(args.speed)))
+    print("{0:>15}: {1:.1f} packets/sec, capture rate {2:.1f} packets/sec".format(
+        "sustained", written[-1] / elapsed, packets / capture_seconds if capture_seconds else float("inf")))
+    print(describe("decode latency", latencies(packet_send_times, sample_times, read)))
+    print(describe("commit latency", latencies(packet_send_times, sample_times, written)))
+    print("Ingest stages, ms (p50 / p95 / p99):")
+    print(common.latency_monitor.report())
+
+
+def parse_speed(text):
+    return None if text == "max" else float(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay serial captures through the ingest engines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    synthesize_parser = commands.add_parser("synthesize", help="Write a capture of packets at a fixed rate")
+    synthesize_parser.add_argument("capture")
+    synthesize_parser.add_argument("--rate", type=float, default=100, help="Packets per second")
+    synthesize_parser.add_argument("--seconds", type=float, default=60)
+
+    replay_parser = commands.add_parser("replay", help="Replay a capture and report throughput and latency")
+    replay_parser.add_argument("capture")
+    replay_parser.add_argument("--speed", type=parse_speed, default=1.0,
+                               help="Multiple of the original rate, or \"max\" to send without delays")
+    replay_parser.add_argument("--engine", choices=("threaded", "asyncio"), default="threaded")
+    replay_parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for every packet")
+    args = parser.parse_args()
+
+    if args.command == "synthesize":
+        synthesize(args.capture, args.rate, args.seconds)
+    else:
+        replay(args)
+
+
+if __name__ == "__main__":
+    main()
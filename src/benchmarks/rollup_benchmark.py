@@ -0,0 +1,114 @@
+import argparse
+import datetime
+import statistics
+import time
+
+import context
+import psycopg2.sql as sql
+
+from database import DatabaseConnection
+from storage import StorageManager
+
+"""
+Measures the rollups (see shared/rollups.py) on several days of synthetic 1 Hz data of one sensor:
+how fast stored values are backfilled into them, how long rolling up a minute of new values takes,
+and the latency of bucketed queries over the whole range (like dbtools' Bucketed mode) from the raw
+table against the rollups. Runs in a scratch schema that is dropped afterwards.
+
+    python3 rollup_benchmark.py --days 30 --buckets 1000 --queries 20
+"""
+
+SCHEMA = "rollup_benchmark"
+SENSOR = SCHEMA + ".value"
+
+
+def create_table(db_conn, storage_manager, first_day, days):
+    with db_conn.transaction() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+        storage_manager.create_table(cursor, SCHEMA, "value")
+        storage_manager.create_partitions(cursor, SCHEMA, "value", first_day,
+                                          first_day + datetime.timedelta(days=days))
+        db_conn.rollups.create_tables(cursor)
+        insert_rows(cursor, datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc),
+                    days * 86400)
+
+
+def insert_rows(cursor, start_time, seconds):
+    cursor.execute(sql.SQL(
+        """
+        INSERT INTO {0}.value (timestamp, value)
+        SELECT %s + (second || ' seconds')::interval, random() * 50
+        FROM generate_series(0, %s) AS second
+        """
+    ).format(sql.Identifier(SCHEMA)), (start_time, seconds - 1))
+
+
+# Rolls up every row past the watermark, a chunk per transaction; returns the rows rolled up
+def roll_up(db_conn, source):
+    rows = 0
+    while True:
+        with db_conn.transaction() as cursor:
+            chunk_rows = db_conn.rollups.update_chunk(cursor, source)
+        if not chunk_rows:
+            return rows
+        rows += chunk_rows
+
+
+def time_queries(db_conn, source, lower, upper, buckets, queries, resolution):
+    latencies = []
+    with db_conn.transaction() as cursor:
+        for _ in range(queries):
+            start = time.perf_counter()
+            db_conn.rollups.query_resolution(cursor, source, SENSOR, lower, upper, buckets, resolution)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rollup backfill and bucketed queries on rollups")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--buckets", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+    db_conn.rollups.schema = SCHEMA
+
+    first_day = datetime.date(2020, 1, 1)
+    lower = datetime.datetime.combine(first_day, datetime.time(), datetime.timezone.utc)
+    upper = lower + datetime.timedelta(days=args.days)
+    source = (SENSOR, sql.SQL("{0}.value").format(sql.Identifier(SCHEMA)), [(SENSOR, sql.Identifier("value"))])
+
+    try:
+        print(f"Loading {args.days * 86400} rows...")
+        create_table(db_conn, StorageManager(db_conn), first_day, args.days)
+
+        start = time.perf_counter()
+        rows = roll_up(db_conn, source)
+        elapsed = time.perf_counter() - start
+        print(f"    backfill: {rows} rows in {elapsed:.2f} s ({rows / elapsed:.0f} rows/s, "
+              f"{db_conn.rollups.chunk_rows} rows per transaction)")
+
+        with db_conn.transaction() as cursor:
+            insert_rows(cursor, upper - datetime.timedelta(minutes=1), 60)
+        start = time.perf_counter()
+        roll_up(db_conn, source)
+        print(f"    1 minute of new rows rolled up in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        width = (upper - lower).total_seconds() / args.buckets
+        print(f"Bucketed queries of {args.days} days in {args.buckets} buckets of {width:g} s:")
+        for resolution in (None, db_conn.rollups.resolution_for(width)):
+            latencies = time_queries(db_conn, source, lower, upper, args.buckets, args.queries, resolution)
+            print("{0:>12}: median {1:.2f} ms, max {2:.2f} ms over {3} queries".format(
+                "raw" if resolution is None else "rollup " + resolution[0], statistics.median(latencies),
+                max(latencies), args.queries))
+    finally:
+        with db_conn.transaction() as cursor:
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tty
+
+import context
+import psycopg2.sql as sql
+
+import common
+from async_ingest import AsyncIngestPipeline, asyncpg
+from database import DatabaseConnection
+from ingest import IngestPipeline
+from spool import Spool
+
+"""
+Compares the threaded IngestPipeline against the asyncio AsyncIngestPipeline end to end. Binary
+frames are written into a pseudo-terminal, which each engine opens as its serial port, as fast as the
+engine reads them, and the clock stops once every packet has been committed. Packets go through a
+temporary spool into a wide table in a scratch schema, both removed afterwards.
+
+    python3 serial_benchmark.py --packets 20000
+"""
+
+SCHEMA = "serial_benchmark"
+
+
+# A pseudo-terminal in raw mode, so the line discipline passes the frames through untouched. Returns
+# the master end to write to and the path of the slave end, which stands in for the Arduino's port
+def open_pty():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def make_frames(packets):
+    return b"".join(common.packet_layout.encode_frame({
+        "main_battery.voltage": 48.0 + index % 100 / 100,
+        "main_battery.amperage": float(index % 250),
+        "aux_battery.voltage": 12.0,
+        "dht11.temperature": 20.0,
+        "uptime": float(index),
+        "rfm95.rssi": -50.0,
+    }) for index in range(packets))
+
+
+def write_frames(master, frames):
+    view = memoryview(frames)
+    while view:
+        written = os.write(master, view[:4096])
+        view = view[written:]
+
+
+def run_engine(engine, db_conn, device, master, frames, packets, timeout, spool_path):
+    pipeline = engine(db_conn, device, Spool(spool_path, 16 * 1024 * 1024))
+    pipeline.start()
+    writer = threading.Thread(target=write_frames, args=(master, frames), daemon=True)
+
+    start = time.perf_counter()
+    writer.start()
+    while pipeline.packets_written() < packets and time.perf_counter() - start < timeout:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    pipeline.stop()
+    return elapsed, pipeline.packets_written()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the threaded and asyncio ingest engines")
+    parser.add_argument("--packets", type=int, default=10000)
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for each engine")
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+
+    # The engines create the scratch table themselves through StorageManager
+    db_conn.storage_mode = "wide"
+    db_conn.wide_table = (SCHEMA, "packets")
+    db_conn.alarm_table = (SCHEMA, "alarms")
+    db_conn.rollups.schema = SCHEMA
+    db_conn.plan_inserts()
+    common.SETTINGS["SerialProtocol"] = "binary"
+    frames = make_frames(args.packets)
+
+    engines = [("threaded", IngestPipeline)]
+    if asyncpg is not None:
+        engines.append(("asyncio", AsyncIngestPipeline))
+    else:
+        print("asyncpg is not installed, skipping the asyncio engine")
+
+    try:
+        for name, engine in engines:
+            master, slave, device = open_pty()
+            try:
+                with tempfile.TemporaryDirectory() as spool_path:
+                    elapsed, written = run_engine(engine, db_conn, device, master, frames, args.packets,
+                                                  args.timeout, spool_path)
+            finally:
+                os.close(master)
+                os.close(slave)
+            print("{0:>9}: {1} of {2} packets written in {3:.3f} s, {4:.0f} packets/sec".format(
+                name, written, args.packets, elapsed, written / elapsed))
+    finally:
+        with db_conn.transaction() as cursor:
+            cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {0} CASCADE").format(sql.Identifier(SCHEMA)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+import context
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from startup import CACHE_DIRECTORY
+
+"""
+Measures how long the visualizer takes to come up, each run in a fresh interpreter, split into the
+phases of Client.__init__ (without connecting to the database or the Arduino):
+
+    config    loading Parameters.xml and settings.txt
+    imports   the modules client.py imports, including common setting up every sensor
+    window    building the main window from main_window.ui and showing it, up to the first paint
+    chart     the chart created after the window is shown, QtCharts import included
+
+Cold runs start without startup_cache (see shared/startup.py), so they include rebuilding it; warm
+runs use the cache the previous run left behind.
+
+    python3 startup_benchmark.py --runs 10
+"""
+
+# Runs in the child interpreter, from the visualizer's directory; prints the phase timings as JSON
+CHILD = """
+import json, time
+times = {}
+start = time.perf_counter()
+
+from utility import Parser
+Parser.load_config()
+times["config"] = time.perf_counter() - start
+
+phase = time.perf_counter()
+import common, ui, database, ingest
+from PySide2.QtWidgets import QApplication
+times["imports"] = time.perf_counter() - phase
+
+phase = time.perf_counter()
+qt_app = QApplication()
+main_window = ui.load_ui("main_window.ui")
+main_window.show()
+qt_app.processEvents()
+times["window"] = time.perf_counter() - phase
+
+phase = time.perf_counter()
+from charts import LineChart
+LineChart(main_window.findChild(ui.QFrame, "chart_frame"))
+qt_app.processEvents()
+times["chart"] = time.perf_counter() - phase
+
+times["total"] = time.perf_counter() - start
+print(json.dumps(times))
+"""
+
+PHASES = ("config", "imports", "window", "chart", "total")
+
+
+def run_child():
+    environment = dict(os.environ)
+    # No display is needed to build the window
+    if not environment.get("DISPLAY") and not environment.get("WAYLAND_DISPLAY"):
+        environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=context.VISUALIZER_PATH, env=environment,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs, cold):
+    results = []
+    for _ in range(runs):
+        if cold:
+            shutil.rmtree(os.path.join(context.VISUALIZER_PATH, CACHE_DIRECTORY), ignore_errors=True)
+        results.append(run_child())
+    return {phase: statistics.median(result[phase] for result in results) for phase in PHASES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the visualizer")
+    parser.add_argument("--runs", type=int, default=5, help="Runs of each kind, the median is reported")
+    args = parser.parse_args()
+
+    cold = measure(args.runs, cold=True)
+    # One run to leave a cache behind for the warm runs
+    run_child()
+    warm = measure(args.runs, cold=False)
+
+    print("{0:>8} {1:>10} {2:>10}".format("ms", "cold", "warm"))
+    for phase in PHASES:
+        print("{0:>8} {1:>10.1f} {2:>10.1f}".format(phase, cold[phase] * 1000, warm[phase] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,29 @@
+import gzip
 import subprocess
+import sys
 import time
 import os
 from sys import platform
+from xml.etree import ElementTree
+
+import numpy as np
 
 import psycopg2
 import psycopg2.sql as sql
 
-from PySide2.QtUiTools import QUiLoader
-from PySide2.QtWidgets import QLineEdit, QDateTimeEdit, QComboBox, QApplication, QPushButton, QMessageBox
+from PySide2.QtWidgets import QLineEdit, QDateTimeEdit, QComboBox, QApplication, QPushButton, QMessageBox, \
+    QProgressBar
+
+# The connection pool, query cache, rollups, packet alignment and the .ui cache are shared with the visualizer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from alignment import align_rows
+from pool import ConnectionPool
+from querycache import CachedResult, QueryCache
+from rollups import Rollups
+from startup import load_ui
 
-import matplotlib.pyplot as plt
+# File extension of each columnar export format
+COLUMNAR_FORMATS = {"Parquet": ".parquet", "Arrow IPC": ".arrow", "NumPy (npz)": ".npz"}
 
 
 class DBTools:
@@ -20,14 +34,16 @@ class DBTools:
 
         # ===== Input fields =====
 
-        loader = QUiLoader()
-        self.main_window = loader.load("dbtools.ui")
+        # Built by the compiled version of dbtools.ui, see shared/startup.py
+        self.main_window = load_ui("dbtools.ui")
         self.schema_input = self.main_window.findChild(QLineEdit, "schema")
         self.table_input = self.main_window.findChild(QLineEdit, "table")
         self.max_values_input = self.main_window.findChild(QLineEdit, "max_values")
         self.time_min_input = self.main_window.findChild(QDateTimeEdit, "time_min")
         self.time_max_input = self.main_window.findChild(QDateTimeEdit, "time_max")
         self.retrieve_by_input = self.main_window.findChild(QComboBox, "retrieve_by")
+        self.export_format_input = self.main_window.findChild(QComboBox, "export_format")
+        self.export_progress_bar = self.main_window.findChild(QProgressBar, "export_progress")
 
         # ===== Buttons =====
 
@@ -44,7 +60,7 @@ class DBTools:
         self.visualize_button.clicked.connect(self.create_graph)
 
         self.export_button = self.main_window.findChild(QPushButton, "export_2")
-        self.export_button.clicked.connect(self.export_as_csv)
+        self.export_button.clicked.connect(self.export)
 
         self.backup_button = self.main_window.findChild(QPushButton, "backup")
         self.backup_button.clicked.connect(self.backup_database)
@@ -67,6 +83,9 @@ class DBTools:
         self.db_conn.attempt_connection()
 
     def create_graph(self):
+        # Only imported when a graph is drawn, as it takes a while
+        import matplotlib.pyplot as plt
+
         schema = self.schema_input.text()
         table = self.table_input.text()
         max_values = self.max_values_input.text()
@@ -74,6 +93,19 @@ class DBTools:
         date_upper = self.time_max_input.dateTime().toPython()
         query_type = self.retrieve_by_input.currentText()
 
+        if query_type == "Bucketed":
+            # One bucket per horizontal pixel of the plot
+            buckets = int(plt.rcParams["figure.figsize"][0] * plt.rcParams["figure.dpi"])
+            results = self.db_conn.query_individual_table(schema, table, query_type, date_lower, date_upper,
+                                                          buckets=buckets)
+
+            timestamps = [result[0] for result in results]
+            plt.fill_between(timestamps, [result[1] for result in results], [result[3] for result in results],
+                             alpha=0.3)
+            plt.plot(timestamps, [result[2] for result in results])
+            plt.show()
+            return
+
         results = self.db_conn.query_individual_table(schema, table, query_type, date_lower, date_upper, max_values)
 
         timestamps = [result[1] for result in results]
@@ -81,24 +113,98 @@ class DBTools:
         plt.plot(timestamps, values)
         plt.show()
 
+    # Every sensor in Parameters.xml as (schema, table) pairs, in the order they are defined
+    def load_sensors(self):
+        modules = ElementTree.parse(self.settings["parameters_path"]).getroot().find("Modules")
+        return [(module.tag, sensor.tag) for module in modules for sensor in module]
+
+    # (schema, table) pairs to operate on. The table field takes a comma-separated list, where each entry
+    # is either a table name (looked up in every schema listed in the schema field) or a full schema.table
+    def selected_sensors(self):
+        schemas = [schema.strip() for schema in self.schema_input.text().split(",") if schema.strip()]
+        sensors = []
+        for entry in self.table_input.text().split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+
+            if "." in entry:
+                sensors.append(tuple(entry.split(".", 1)))
+            else:
+                sensors.extend((schema, entry) for schema in schemas)
+        return sensors
+
+    def export(self):
+        if self.export_format_input.currentText() in COLUMNAR_FORMATS:
+            self.export_columnar()
+        else:
+            self.export_as_csv()
+
+    # Streams the selected tables into the export file with COPY, so memory use stays the same however
+    # many rows are exported
     def export_as_csv(self):
-        schema = self.schema_input.text()
-        table = self.table_input.text()
+        sensors = self.selected_sensors()
         max_values = self.max_values_input.text()
         date_lower = self.time_min_input.dateTime().toPython()
         date_upper = self.time_max_input.dateTime().toPython()
         query_type = self.retrieve_by_input.currentText()
 
-        results = self.db_conn.query_individual_table(schema, table, query_type, date_lower, date_upper, max_values)
-        unique_key = [result[0] for result in results]
-        timestamps = [result[1] for result in results]
-        values = [result[2] for result in results]
+        export_path = self.settings["export_path"]
+        open_export_file = open
+        if self.export_format_input.currentText() == "CSV (gzip)":
+            export_path += ".gz"
+            open_export_file = gzip.open
 
-        with open(self.settings["export_path"], "w") as export_file:
-            export_file.write("unique_key, timestamp, value\n")
-            for idx, _ in enumerate(results):
-                line = "{0},{1},{2}\n".format(unique_key[idx], timestamps[idx], values[idx])
-                export_file.write(line)
+        self.export_button.setEnabled(False)
+        try:
+            with open_export_file(export_path, "wb") as export_file:
+                export_file.write(b"sensor,unique_key,timestamp,value\n")
+                progress = ExportProgress(export_file, self.export_progress_bar, len(sensors))
+
+                for index, (schema, table) in enumerate(sensors):
+                    query = self.db_conn.select_query(schema, table, query_type, date_lower, date_upper, max_values)
+                    progress.start_sensor(index, self.db_conn.estimate_rows(query))
+                    self.db_conn.copy_query(query, progress)
+                progress.finish()
+
+        except psycopg2.Error as error:
+            QMessageBox.warning(QMessageBox(), "Error", "Export failed: {0}".format(error))
+        finally:
+            self.export_button.setEnabled(True)
+
+    # Writes the selected sensors, or every sensor in Parameters.xml if none are selected, as one table
+    # with a timestamp column and one column per sensor, rows aligned on the timestamp
+    def export_columnar(self):
+        sensors = self.selected_sensors() or self.load_sensors()
+        export_format = self.export_format_input.currentText()
+        pyarrow = import_pyarrow() if export_format != "NumPy (npz)" else None
+        if export_format != "NumPy (npz)" and pyarrow is None:
+            QMessageBox.warning(QMessageBox(), "Attention", "pyarrow is not installed, exporting as .npz instead.")
+            export_format = "NumPy (npz)"
+
+        self.export_progress_bar.setValue(0)
+        self.export_button.setEnabled(False)
+        try:
+            timestamps, columns = self.db_conn.query_aligned_tables(
+                sensors, self.retrieve_by_input.currentText(), self.time_min_input.dateTime().toPython(),
+                self.time_max_input.dateTime().toPython(), self.max_values_input.text())
+        except psycopg2.Error as error:
+            QMessageBox.warning(QMessageBox(), "Error", "Export failed: {0}".format(error))
+            return
+        finally:
+            self.export_button.setEnabled(True)
+
+        export_path = os.path.splitext(self.settings["export_path"])[0] + COLUMNAR_FORMATS[export_format]
+        if export_format == "NumPy (npz)":
+            np.savez(export_path, timestamp=timestamps, **columns)
+        else:
+            table = pyarrow.table({"timestamp": pyarrow.array(timestamps, pyarrow.timestamp("us", tz="UTC")),
+                                   **columns})
+            if export_format == "Parquet":
+                pyarrow.parquet.write_table(table, export_path)
+            else:
+                pyarrow.feather.write_feather(table, export_path, compression="uncompressed")
+        self.export_progress_bar.setValue(100)
 
     def backup_database(self, force=False):
         if not force:
@@ -140,10 +246,7 @@ class DBTools:
             for file in files:
                 backup_file_name = file
 
-        try:
-            self.db_conn.connection.close()
-        except:
-            pass
+        self.db_conn.pool.close()
 
         command1 = os.path.join(self.settings["postgres_binary_path"], "dropdb") + " -U teleuser telemetry"
         command2 = os.path.join(self.settings["postgres_binary_path"], "createdb") + " -U teleuser telemetry"
@@ -175,53 +278,303 @@ class DatabaseConnection:
         self.role = "teleuser"
         self.password = "teleuser"
 
-        self.connection = None
-        self.cursor = None
-
+        # Exports, graphs and the visualizer's ingest each get a connection of their own
+        parameters = {"dbname": self.dbname, "user": self.role}
+        if platform == "linux":
+            parameters["host"] = "/tmp"
+        self.pool = ConnectionPool(parameters, int(context.settings["pool_size"]),
+                                   int(context.settings["pool_health_check_seconds"]),
+                                   int(context.settings["pool_max_backoff_seconds"]))
+        # The visualizer writes from another process, so every lookup checks for new rows
+        self.query_cache = QueryCache(int(context.settings["query_cache_rows"]), notified=False)
+        # Maintained by the visualizer, see shared/rollups.py
+        self.rollups = Rollups(context.settings["rollup_schema"])
+        self.attempt_connection()
+
+    # Connects right away; otherwise the pool reconnects by itself when a connection is needed
+    def attempt_connection(self):
         try:
-            self.attempt_connection()
-        except:
+            self.pool.check()
+        except psycopg2.Error:
             print("Connection failed. Please ensure the server is running")
 
-    def attempt_connection(self):
-        if platform == "linux":
-            self.connection = psycopg2.connect(dbname=self.dbname, user=self.role, host="/tmp")
+    # The table holding a sensor's values, the column they are in, and a filter that skips rows
+    # without a value. With storage_mode=wide every sensor is a column of the same packet table
+    def sensor_source(self, schema, table):
+        if self.context.settings["storage_mode"] == "wide":
+            wide_schema, wide_table = self.context.settings["wide_table"].split(".")
+            column = sql.Identifier(".".join([schema, table]))
+            return sql.SQL("{0}.{1}").format(sql.Identifier(wide_schema), sql.Identifier(wide_table)), column, \
+                sql.SQL("{0} IS NOT NULL").format(column)
+
+        return sql.SQL("{0}.{1}").format(sql.Identifier(schema), sql.Identifier(table)), sql.Identifier("value"), \
+            sql.SQL("TRUE")
+
+    # The source of a sensor's rollups: the table its values are stored in, named like the visualizer does
+    def rollup_source(self, schema, table):
+        source, column, _ = self.sensor_source(schema, table)
+        name = ".".join([schema, table])
+        if self.context.settings["storage_mode"] == "wide":
+            return self.context.settings["wide_table"], source, [(name, column)]
+        return name, source, [(name, column)]
+
+    # SELECT of the (sensor, id, timestamp, value) rows of one sensor with every parameter inlined, so that
+    # it can be wrapped in COPY or EXPLAIN. An empty values means no limit
+    def select_query(self, schema, table, type, date_lower, date_upper, values):
+        source, column, has_value = self.sensor_source(schema, table)
+        limit = sql.Literal(int(values)) if values else sql.SQL("ALL")
+
+        if type in ("Date", "Bucketed"):
+            condition = sql.SQL("timestamp > {0} AND timestamp < {1} AND {2}").format(
+                sql.Literal(date_lower), sql.Literal(date_upper), has_value)
+            order = sql.SQL("ORDER BY timestamp")
         else:
-            self.connection = psycopg2.connect(dbname=self.dbname, user=self.role)
-        self.cursor = self.connection.cursor()
+            condition = has_value
+            order = sql.SQL("ORDER BY id DESC")
+
+        return sql.SQL("SELECT {0} AS sensor, id, timestamp, {1} FROM {2} WHERE {3} {4} LIMIT {5}").format(
+            sql.Literal(".".join([schema, table])), column, source, condition, order, limit)
+
+    # The planner's estimate of how many rows a query returns; cheap, unlike count(*)
+    def estimate_rows(self, query):
+        with self.pool.transaction() as cursor:
+            cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) {0}").format(query))
+            return cursor.fetchone()[0][0]["Plan"]["Plan Rows"]
+
+    # Writes the result of a query to a file-like object as CSV, row by row, straight from the server
+    def copy_query(self, query, file):
+        with self.pool.transaction() as cursor:
+            cursor.copy_expert(sql.SQL("COPY ({0}) TO STDOUT WITH CSV").format(query).as_string(cursor), file)
+
+    # Values of several sensors as columns aligned into packets: a datetime64[us] array of timestamps
+    # and a float64 array (NaN where a sensor has no value) per "schema.table", for the same
+    # "Most recent"/"Date" retrieval modes as query_individual_table. Rows are fetched in chunks through
+    # a server-side cursor. Outside wide mode, values stored with timestamps of their own (data written
+    # before the sensor tables shared a packet's timestamp) less than align_tolerance_ms apart are merged
+    # into one packet, as the visualizer does (see shared/alignment.py); the row limit counts timestamps
+    # before they are merged
+    def query_aligned_tables(self, sensors, type, date_lower, date_upper, values):
+        names = [".".join(sensor) for sensor in sensors]
+        columns = sql.SQL(", ").join(
+            sql.SQL("max(value) FILTER (WHERE sensor = {0})").format(sql.Literal(name)) for name in names)
+        sources = sql.SQL(" UNION ALL ").join(
+            sql.SQL("SELECT {0} AS sensor, timestamp, {2}::double precision AS value FROM {1} WHERE {3}").format(
+                sql.Literal(name), *self.sensor_source(schema, table))
+            for name, (schema, table) in zip(names, sensors))
+
+        condition = sql.SQL("TRUE")
+        if type in ("Date", "Bucketed"):
+            condition = sql.SQL("timestamp > {0} AND timestamp < {1}").format(
+                sql.Literal(date_lower), sql.Literal(date_upper))
+        limit = sql.Literal(int(values)) if values else sql.SQL("ALL")
+
+        query = sql.SQL(
+            """
+            SELECT * FROM (
+                SELECT (extract(epoch FROM timestamp) * 1000000)::bigint, {0} FROM ({1}) AS sensor_values
+                WHERE {2}
+                GROUP BY timestamp
+                ORDER BY timestamp DESC
+                LIMIT {3}
+            ) AS aligned ORDER BY 1
+            """
+        ).format(columns, sources, condition, limit)
+
+        with self.pool.transaction("aligned_export") as cursor:
+            cursor.itersize = 10000
+            cursor.execute(query)
+            chunks = []
+            while True:
+                rows = cursor.fetchmany(cursor.itersize)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.float64).reshape(len(rows), len(names) + 1))
+
+        table = np.concatenate(chunks) if chunks else np.empty((0, len(names) + 1))
+        if self.context.settings["storage_mode"] != "wide":
+            starts, packets = align_rows(table[:, 0] / 1000000, table[:, 1:],
+                                         int(self.context.settings["align_tolerance_ms"]) / 1000)
+            table = np.column_stack((table[starts, 0], packets))
+        timestamps = table[:, 0].astype(np.int64).astype("datetime64[us]")
+        return timestamps, {name: np.ascontiguousarray(table[:, index + 1]) for index, name in enumerate(names)}
+
+    # "Most recent" returns the newest (id, timestamp, value) rows, newest first, and "Date" the oldest
+    # ones in the date range, oldest first. "Bucketed" splits the date range into the given number of
+    # equal buckets and returns one (bucket start, min, avg, max) row per bucket that has values, so the
+    # number of rows doesn't depend on how long the range is; it is read from the rollups whenever their
+    # buckets fit (see shared/rollups.py). Other results are cached, asking again only fetches the rows
+    # written since (see shared/querycache.py)
+    def query_individual_table(self, schema, table, type, date_lower, date_upper, values=5, buckets=1000):
+        sensor = ".".join([schema, table])
+        if type == "Bucketed" and Rollups.resolution_for((date_upper - date_lower).total_seconds() / buckets):
+            rows = self.query_rollups(schema, table, date_lower, date_upper, buckets)
+            if rows is not None:
+                return rows
 
-    def query_individual_table(self, schema, table, type, date_lower, date_upper, values=5):
-        query = None
         if type == "Most recent":
-            query = sql.SQL(
-                """
-                SELECT * FROM {0}.{1}
-                ORDER BY id DESC
-                """
-            ).format(sql.Identifier(schema), sql.Identifier(table))
-
-            try:
-                self.cursor.execute(query)
-                return self.cursor.fetchmany(int(values))
-            except psycopg2.ProgrammingError:
-                query = sql.SQL("ROLLBACK;")
-                self.cursor.execute(query)
-
+            key = (sensor, type, int(values))
         elif type == "Date":
-            query = sql.SQL(
-                """
-                SELECT * FROM {0}.{1}
-                WHERE timestamp > (%s) AND timestamp < (%s)
-                """
-            ).format(sql.Identifier(schema), sql.Identifier(table)), (date_lower, date_upper)
-            try:
-                self.cursor.execute(query[0], query[1])
-                return self.cursor.fetchmany(int(values))
-            except psycopg2.ProgrammingError:
-                query = sql.SQL("ROLLBACK;")
-                self.cursor.execute(query)
-
-        return []
+            key = (sensor, type, date_lower, date_upper, int(values))
+        elif type == "Bucketed":
+            key = (sensor, type, date_lower, date_upper, buckets)
+        else:
+            return []
+
+        cached = self.query_cache.get(key)
+        writes = self.query_cache.writes()
+        last_id = cached.last_id if cached is not None else 0
+
+        # e.g. a table that doesn't exist; the transaction is rolled back on the way out
+        try:
+            with self.pool.transaction() as cursor:
+                if type == "Bucketed":
+                    rows, last_id = self.query_buckets(cursor, self.sensor_source(schema, table), date_lower,
+                                                       date_upper, buckets, cached, last_id)
+                else:
+                    rows, last_id = self.query_rows(cursor, self.sensor_source(schema, table), type, date_lower,
+                                                    date_upper, int(values), cached, last_id)
+        except psycopg2.ProgrammingError:
+            return []
+
+        self.query_cache.put(key, CachedResult(sensor, rows, last_id), writes)
+        return [row[1:] for row in rows] if type == "Bucketed" else rows
+
+    # The "Bucketed" rows from the rollups, or None if they can't be used: the visualizer hasn't created
+    # them, or a table is missing or has another layout, in which case the raw table is read instead
+    def query_rollups(self, schema, table, date_lower, date_upper, buckets):
+        try:
+            with self.pool.transaction() as cursor:
+                if not self.rollups.available(cursor):
+                    return None
+                rows = self.rollups.query_buckets(cursor, self.rollup_source(schema, table), ".".join([schema, table]),
+                                                  date_lower, date_upper, buckets)
+        except psycopg2.ProgrammingError:
+            return None
+        return [row[1:] for row in rows]
+
+    # The "Most recent" or "Date" rows with an id above last_id, merged into the cached ones
+    @staticmethod
+    def query_rows(cursor, sensor_source, type, date_lower, date_upper, values, cached, last_id):
+        source, column, has_value = sensor_source
+        if type == "Most recent":
+            condition = has_value
+            order = sql.SQL("id DESC")
+        else:
+            condition = sql.SQL("timestamp > %(date_lower)s AND timestamp < %(date_upper)s AND {0}").format(has_value)
+            order = sql.SQL("timestamp")
+
+        cursor.execute(sql.SQL(
+            """
+            SELECT id, timestamp, {1} FROM {0}
+            WHERE id > %(last_id)s AND {2}
+            ORDER BY {3}
+            LIMIT %(values)s
+            """
+        ).format(source, column, condition, order),
+            {"date_lower": date_lower, "date_upper": date_upper, "last_id": last_id, "values": values})
+        rows = cursor.fetchall()
+
+        if rows:
+            last_id = max(last_id, max(row[0] for row in rows))
+        if cached is not None:
+            if type == "Most recent":
+                rows = (rows + cached.rows)[:values]
+            else:
+                rows = sorted(cached.rows + rows, key=lambda row: row[1])[:values]
+        return rows, last_id
+
+    # (bucket number, bucket start, min, avg, max) rows. Only the buckets from the first one holding a
+    # row with an id above last_id on are computed, the ones before it are taken from the cached rows
+    @staticmethod
+    def query_buckets(cursor, sensor_source, date_lower, date_upper, buckets, cached, last_id):
+        source, column, has_value = sensor_source
+        parameters = {"lower": date_lower.timestamp(), "upper": date_upper.timestamp(), "buckets": buckets,
+                      "date_lower": date_lower, "date_upper": date_upper, "last_id": last_id}
+
+        cursor.execute(sql.SQL(
+            """
+            SELECT width_bucket(extract(epoch FROM min(timestamp)), %(lower)s, %(upper)s, %(buckets)s), max(id)
+            FROM {0}
+            WHERE id > %(last_id)s AND timestamp >= %(date_lower)s AND timestamp < %(date_upper)s AND {1}
+            """
+        ).format(source, has_value), parameters)
+        parameters["first_bucket"], new_last_id = cursor.fetchone()
+        if new_last_id is None:
+            return (cached.rows if cached is not None else []), last_id
+
+        # The scan starts a second before the first bucket, so that rounding can't leave out a row on
+        # its edge; the rows of earlier buckets are dropped again by the bucket number
+        cursor.execute(sql.SQL(
+            """
+            SELECT bucket, to_timestamp(%(lower)s + (bucket - 1) * (%(upper)s - %(lower)s) / %(buckets)s),
+                min(value), avg(value), max(value)
+            FROM (
+                SELECT width_bucket(extract(epoch FROM timestamp), %(lower)s, %(upper)s, %(buckets)s) AS bucket,
+                    {1}::double precision AS value
+                FROM {0}
+                WHERE timestamp >= greatest(%(date_lower)s, to_timestamp(
+                        %(lower)s + (%(first_bucket)s - 1) * (%(upper)s - %(lower)s) / %(buckets)s - 1))
+                    AND timestamp < %(date_upper)s AND {2}
+            ) AS bucketed
+            WHERE bucket >= %(first_bucket)s
+            GROUP BY bucket
+            ORDER BY bucket
+            """
+        ).format(source, column, has_value), parameters)
+
+        rows = cursor.fetchall()
+        if cached is not None:
+            rows = [row for row in cached.rows if row[0] < parameters["first_bucket"]] + rows
+        return rows, max(last_id, new_last_id)
+
+
+# Optional, needed for the Parquet and Arrow IPC export formats. Without it those fall back to .npz.
+# Imported on the first columnar export rather than at startup, as it takes a while
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+# File-like object that passes everything COPY writes on to the export file and moves the progress bar
+# along as rows go by. COPY calls write() once per row
+class ExportProgress:
+    # Rows between progress bar updates
+    update_interval = 5000
+
+    def __init__(self, file, progress_bar, sensor_count):
+        self.file = file
+        self.progress_bar = progress_bar
+        self.sensor_count = max(sensor_count, 1)
+        self.sensor_index = 0
+        self.estimated_rows = 0
+        self.rows = 0
+        self.progress_bar.setValue(0)
+
+    def start_sensor(self, index, estimated_rows):
+        self.sensor_index = index
+        self.estimated_rows = estimated_rows
+        self.rows = 0
+        self.update()
+
+    def write(self, data):
+        self.file.write(data)
+        self.rows += 1
+        if self.rows % self.update_interval == 0:
+            self.update()
+
+    def update(self):
+        fraction = min(self.rows / self.estimated_rows, 1) if self.estimated_rows else 0
+        self.progress_bar.setValue(int(100 * (self.sensor_index + fraction) / self.sensor_count))
+        # The export runs on the GUI thread, so let the window repaint
+        QApplication.processEvents()
+
+    def finish(self):
+        self.progress_bar.setValue(100)
 
 
 db_tools = DBTools()
@@ -0,0 +1,29 @@
+import numpy as np
+
+"""
+Aligning values of several sensors into packets, shared by the visualizer (backfilling derived channels)
+and dbtools (columnar exports). Sensor tables written from the same packet share its timestamp, but
+data stored before that was written a value per transaction, each with a timestamp of its own, so a
+query grouping on the exact timestamp gets a sparse row per value. Rows less than a tolerance apart
+are taken as the same packet instead; the packet period (TRANSMIT_DELAY_MS in transmitter.ino) has to
+be longer than the tolerance
+"""
+
+
+# Merges rows (seconds since the epoch in order, and a row of values per timestamp, NaN where a sensor
+# has none) less than tolerance seconds apart into one packet, with the last value of each sensor in
+# it. Returns which rows start a packet, the packet taking their timestamp, and the packets' values
+def align_rows(seconds, values, tolerance):
+    if not len(seconds):
+        return np.empty(0, dtype=bool), values
+
+    starts = np.concatenate(([True], np.diff(seconds) >= tolerance))
+    packet_ids = np.cumsum(starts) - 1
+
+    packets = np.full((packet_ids[-1] + 1, values.shape[1]), np.nan)
+    for column in range(values.shape[1]):
+        valid = np.flatnonzero(~np.isnan(values[:, column]))
+        # The last valid row of each packet
+        last = valid[np.append(packet_ids[valid][1:] != packet_ids[valid][:-1], True)]
+        packets[packet_ids[last], column] = values[last, column]
+    return starts, packets
@@ -0,0 +1,181 @@
+import contextlib
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.sql as sql
+
+"""
+Connection pool shared by the visualizer and dbtools. Each thread (the ingest writer, the GUI, an
+export) checks out its own connection for the length of a transaction instead of taking turns on a
+single cursor:
+
+    with pool.transaction() as cursor:
+        cursor.execute(...)
+
+    - commits when the block ends, rolls back if it raises
+    - idle connections are checked with a SELECT 1 before being handed out again, and connections
+      that broke while in use are dropped, so a Postgres restart costs one failed transaction
+    - after a failed connection attempt further attempts are refused until a delay runs out, which
+      doubles with every failure (exponential backoff) instead of hammering a server that is down
+    - every connection keeps track of the statements prepared on it (see PooledCursor.execute_prepared)
+"""
+
+
+# A psycopg2 connection that remembers which statements were prepared on it and when it was last used
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = PooledCursor
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+
+class PooledCursor(psycopg2.extensions.cursor):
+    # Runs a statement prepared on the server under the given name, preparing it the first time it is
+    # used on this connection. The query takes $1, $2, ... parameters. Prepared statements outlive the
+    # transaction they were prepared in, so they are only planned once per connection
+    def execute_prepared(self, name, query, parameters=()):
+        if name not in self.connection.prepared:
+            self.execute(sql.SQL("PREPARE {0} AS {1}").format(sql.Identifier(name), query))
+            self.connection.prepared.add(name)
+
+        if parameters:
+            self.execute(sql.SQL("EXECUTE {0} ({1})").format(
+                sql.Identifier(name), sql.SQL(", ").join(sql.Placeholder() * len(parameters))), parameters)
+        else:
+            self.execute(sql.SQL("EXECUTE {0}").format(sql.Identifier(name)))
+
+
+class ConnectionPool:
+    # Seconds to wait for a free connection when all of them are in use
+    checkout_timeout = 30
+    # Seconds to wait after the first failed connection attempt
+    initial_backoff = 0.5
+
+    # parameters are the keyword arguments of psycopg2.connect
+    def __init__(self, parameters, size=4, health_check_interval=30, max_backoff=60):
+        self.parameters = parameters
+        self.size = size
+        # Connections idle for longer than this (seconds) are checked before being handed out
+        self.health_check_interval = health_check_interval
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Condition()
+        self.idle = []
+        self.in_use = 0
+        self.backoff = 0
+        self.next_attempt = 0
+
+    # ===== Transactions =====
+
+    # A connection of its own for the length of the block. Anything left uncommitted is rolled back
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    # A cursor in a transaction of its own, committed when the block ends. A name makes it a server-side
+    # cursor, which fetches the result in chunks
+    @contextlib.contextmanager
+    def transaction(self, name=None):
+        with self.connection() as connection:
+            cursor = connection.cursor(name) if name else connection.cursor()
+            try:
+                yield cursor
+            finally:
+                # A server-side cursor has to be closed before the transaction ends
+                if not connection.closed:
+                    cursor.close()
+            connection.commit()
+
+    # ===== Connections =====
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self.lock:
+            while True:
+                while self.idle:
+                    connection = self.idle.pop()
+                    if self.healthy(connection):
+                        self.in_use += 1
+                        return connection
+                    connection.close()
+
+                if self.in_use < self.size:
+                    break
+                if not self.lock.wait(deadline - time.monotonic()):
+                    raise psycopg2.pool.PoolError("All {0} database connections are in use".format(self.size))
+
+            if time.monotonic() < self.next_attempt:
+                raise psycopg2.OperationalError("No connection to the database, retrying in {0:.1f} s".format(
+                    self.next_attempt - time.monotonic()))
+            # Counted before connecting, so other threads don't go over the size meanwhile
+            self.in_use += 1
+
+        try:
+            connection = psycopg2.connect(connection_factory=PooledConnection, **self.parameters)
+        except psycopg2.Error:
+            with self.lock:
+                self.in_use -= 1
+                self.backoff = min(self.backoff * 2 or self.initial_backoff, self.max_backoff)
+                self.next_attempt = time.monotonic() + self.backoff
+                self.lock.notify()
+            raise
+
+        with self.lock:
+            self.backoff = 0
+            self.next_attempt = 0
+        return connection
+
+    # Returns a connection to the pool, unless it broke while in use
+    def release(self, connection):
+        if not connection.closed and connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+
+        with self.lock:
+            self.in_use -= 1
+            if not connection.closed:
+                connection.last_used = time.monotonic()
+                self.idle.append(connection)
+            self.lock.notify()
+
+    def healthy(self, connection):
+        if connection.closed:
+            return False
+        if time.monotonic() - connection.last_used < self.health_check_interval:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # Whether the last connection attempt succeeded, i.e. the database is believed to be reachable
+    def available(self):
+        return self.next_attempt == 0
+
+    # Connects right away, skipping the backoff delay; for explicit (re)connects. Raises if it fails
+    def check(self):
+        with self.lock:
+            self.next_attempt = 0
+        with self.connection():
+            pass
+
+    # Closes the idle connections, e.g. before the database is dropped
+    def close(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
@@ -0,0 +1,91 @@
+import collections
+import threading
+
+"""
+Cache of history lookups, shared by the visualizer and dbtools. Entries are keyed on what was asked
+for, e.g. (sensor, "Date", lower, upper, limit), and remember the highest row id they have seen. Rows
+only ever get appended with increasing ids (the id column is a bigserial), so asking again only has
+to fetch the rows with a higher id, the new tail, and merge them in, instead of reading the whole
+range again:
+
+    - when the process writes everything it reads (the visualizer's ingest path calls note_write
+      after every commit), entries of sensors that weren't written to since are returned without
+      asking the database at all
+    - otherwise (dbtools) every lookup fetches the tail, which with an id predicate is an index scan
+      of the newest rows
+    - rewriting rows (DatabaseConnection.replace_values) invalidates the sensor, as the ids of rows
+      that were replaced don't say anything. Other processes (backfill_derived.py, migrate_storage.py)
+      aren't noticed by a running visualizer until its ingest next writes to the sensor, which fetches
+      the tail
+
+The cache holds at most max_rows rows; the least recently used entries are evicted first. A lookup
+takes writes() before it queries and passes it to put, so rows committed while it was querying still
+mark the new entry stale
+"""
+
+
+class CachedResult:
+    def __init__(self, sensor, rows, last_id):
+        self.sensor = sensor
+        self.rows = rows
+        # Highest id among the rows the result was built from
+        self.last_id = last_id
+        # Set when rows may have been written to the sensor since the result was fetched
+        self.stale = False
+
+
+class QueryCache:
+    # notified is whether every write to the database goes through note_write (see above)
+    def __init__(self, max_rows, notified):
+        self.max_rows = max_rows
+        self.notified = notified
+
+        # Lookups come from the GUI thread, notes from the ingest writer
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.row_count = 0
+        self.write_count = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    # Number of note_write and invalidate calls so far
+    def writes(self):
+        return self.write_count
+
+    def put(self, key, entry, writes):
+        with self.lock:
+            if writes != self.write_count:
+                entry.stale = True
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.row_count -= len(previous.rows)
+
+            self.entries[key] = entry
+            self.row_count += len(entry.rows)
+            while self.row_count > self.max_rows and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.row_count -= len(evicted.rows)
+
+    # Whether the tail has to be fetched before the entry can be used
+    def needs_tail(self, entry):
+        return entry.stale or not self.notified
+
+    # Called after rows of the given sensors were committed
+    def note_write(self, sensors):
+        with self.lock:
+            self.write_count += 1
+            for entry in self.entries.values():
+                if entry.sensor in sensors:
+                    entry.stale = True
+
+    # Drops every entry of a sensor
+    def invalidate(self, sensor):
+        with self.lock:
+            self.write_count += 1
+            for key in [key for key, entry in self.entries.items() if entry.sensor == sensor]:
+                self.row_count -= len(self.entries.pop(key).rows)
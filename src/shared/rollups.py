@@ -0,0 +1,247 @@
+import math
+
+import psycopg2.sql as sql
+
+"""
+Rollups of the sensor data, shared by the visualizer and dbtools: per sensor count, sum, min and max
+of the values in every 1 second, 1 minute and 1 hour bucket (UTC aligned), in one table per resolution
+in their own schema. A graph of a whole season then reads a few thousand rows of the hourly rollup
+instead of every stored value:
+
+    rollups.sensor_1s / sensor_1min / sensor_1h:   sensor | bucket | count | sum | min | max
+    rollups.watermarks:                            source | last_id
+    rollups.invalidations:                         id | sensor | lower | upper
+
+A source is a table values are stored in: the table of a sensor, or the wide table with a column per
+sensor (see the visualizer's database.py). Rows are only ever appended with increasing ids, so each
+source has a watermark, the highest id rolled up so far, and update_chunk rolls up the next chunk_rows
+rows past it in one transaction: once per interval on the ingest writer for the new rows, and chunk
+after chunk for the rows stored before the rollups existed (see the visualizer's backfill_rollups.py).
+
+Rewriting stored values (DatabaseConnection.replace_values) records the range in invalidations, in the
+same transaction, and rebuild_invalidated recomputes the hours it touches from the rows up to the
+watermark; rows past it are added by update_chunk as usual.
+
+query_buckets answers the same (bucket, start, min, avg, max) queries as dbtools' Bucketed mode from the
+coarsest rollup whose buckets are no longer than the ones asked for, plus the rows past the watermark
+from the source itself. Each rollup bucket counts towards the bucket it starts in, so the results are
+exact when the buckets asked for line up with the rollup's (e.g. a day in 1440 buckets), and otherwise
+have their edges rounded to the rollup's resolution, which a graph with a bucket per pixel doesn't show.
+"""
+
+# Name suffix and length in seconds of each rollup, finest first
+RESOLUTIONS = (("1s", 1), ("1min", 60), ("1h", 3600))
+
+
+class Rollups:
+    def __init__(self, schema, chunk_rows=None):
+        self.schema = schema
+        # Rows of a source rolled up per transaction, only needed for update_chunk
+        self.chunk_rows = chunk_rows
+
+    def table(self, name):
+        return sql.SQL("{0}.{1}").format(sql.Identifier(self.schema), sql.Identifier(name))
+
+    def rollup_table(self, suffix):
+        return self.table("sensor_" + suffix)
+
+    # Like StorageManager's methods, runs in the caller's transaction
+    def create_tables(self, cursor):
+        cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {0}").format(sql.Identifier(self.schema)))
+        for suffix, _ in RESOLUTIONS:
+            cursor.execute(sql.SQL(
+                """
+                CREATE TABLE IF NOT EXISTS {0} (
+                    sensor text NOT NULL,
+                    bucket timestamp with time zone NOT NULL,
+                    count bigint NOT NULL,
+                    sum double precision NOT NULL,
+                    min double precision NOT NULL,
+                    max double precision NOT NULL,
+                    PRIMARY KEY (sensor, bucket)
+                )
+                """
+            ).format(self.rollup_table(suffix)))
+
+        cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {0} (source text PRIMARY KEY, last_id bigint NOT NULL)")
+                       .format(self.table("watermarks")))
+        cursor.execute(sql.SQL(
+            """
+            CREATE TABLE IF NOT EXISTS {0} (
+                id bigserial PRIMARY KEY,
+                sensor text NOT NULL,
+                lower timestamp with time zone NOT NULL,
+                upper timestamp with time zone NOT NULL
+            )
+            """
+        ).format(self.table("invalidations")))
+
+    # Empties every rollup and resets the watermarks, so that they are rebuilt from scratch
+    def reset(self, cursor):
+        cursor.execute(sql.SQL("TRUNCATE {0}").format(sql.SQL(", ").join(
+            [self.rollup_table(suffix) for suffix, _ in RESOLUTIONS] + [self.table("watermarks"),
+                                                                         self.table("invalidations")])))
+
+    # Whether create_tables has been run on the database
+    def available(self, cursor):
+        cursor.execute("SELECT to_regclass(%s)", (self.table("invalidations").as_string(cursor),))
+        return cursor.fetchone()[0] is not None
+
+    # Locks the watermark of a source until the end of the transaction, so two processes never roll up
+    # the same rows, and returns it
+    def lock_watermark(self, cursor, source_name):
+        cursor.execute(sql.SQL("INSERT INTO {0} (source, last_id) VALUES (%s, 0) ON CONFLICT DO NOTHING")
+                       .format(self.table("watermarks")), (source_name,))
+        cursor.execute(sql.SQL("SELECT last_id FROM {0} WHERE source = %s FOR UPDATE").format(self.table("watermarks")),
+                       (source_name,))
+        return cursor.fetchone()[0]
+
+    # Rolls up the next chunk_rows rows of a source, a (name, table, [(unique tag, column)]) tuple, and
+    # moves its watermark past them. Returns the number of rows rolled up, 0 once it has caught up
+    def update_chunk(self, cursor, source):
+        name, table, columns = source
+        last_id = self.lock_watermark(cursor, name)
+        cursor.execute(sql.SQL(
+            "SELECT count(*), max(id) FROM (SELECT id FROM {0} WHERE id > %s ORDER BY id LIMIT %s) AS chunk"
+        ).format(table), (last_id, self.chunk_rows))
+        rows, chunk_last_id = cursor.fetchone()
+        if not rows:
+            return 0
+
+        self.roll_up(cursor, table, columns, sql.SQL("id > %(first)s AND id <= %(last)s"),
+                     {"first": last_id, "last": chunk_last_id})
+        cursor.execute(sql.SQL("UPDATE {0} SET last_id = %s WHERE source = %s").format(self.table("watermarks")),
+                       (chunk_last_id, name))
+        return rows
+
+    # Adds the rows of the table matching the condition to every rollup, in one statement: the rows are
+    # aggregated into the finest buckets once, and those into the coarser ones
+    def roll_up(self, cursor, table, columns, condition, parameters):
+        values = sql.SQL(", ").join(sql.SQL("({0}, {1}::double precision)").format(sql.Literal(unique_tag), column)
+                                    for unique_tag, column in columns)
+        statements = [sql.SQL(
+            """
+            finest AS (
+                SELECT sensor_values.sensor, to_timestamp(floor(extract(epoch FROM timestamp) / {0}) * {0}) AS bucket,
+                    count(*) AS count, sum(sensor_values.value) AS sum, min(sensor_values.value) AS min,
+                    max(sensor_values.value) AS max
+                FROM {1} CROSS JOIN LATERAL (VALUES {2}) AS sensor_values (sensor, value)
+                WHERE {3} AND sensor_values.value IS NOT NULL
+                GROUP BY 1, 2
+            )
+            """
+        ).format(sql.Literal(RESOLUTIONS[0][1]), table, values, condition)]
+
+        for index, (suffix, seconds) in enumerate(RESOLUTIONS):
+            statement = sql.SQL(
+                """
+                INSERT INTO {0} AS existing (sensor, bucket, count, sum, min, max)
+                SELECT sensor, to_timestamp(floor(extract(epoch FROM bucket) / {1}) * {1}),
+                    sum(count), sum(sum), min(min), max(max)
+                FROM finest
+                GROUP BY 1, 2
+                ON CONFLICT (sensor, bucket) DO UPDATE SET count = existing.count + excluded.count,
+                    sum = existing.sum + excluded.sum, min = least(existing.min, excluded.min),
+                    max = greatest(existing.max, excluded.max)
+                """
+            ).format(self.rollup_table(suffix), sql.Literal(seconds))
+            # Every statement but the last one is a data-modifying WITH query of the last one
+            if index < len(RESOLUTIONS) - 1:
+                statement = sql.SQL("{0} AS ({1})").format(sql.Identifier("rollup_" + suffix), statement)
+            statements.append(statement)
+
+        cursor.execute(sql.SQL("WITH {0} {1}").format(sql.SQL(", ").join(statements[:-1]), statements[-1]),
+                       parameters)
+
+    # Records that the values of a sensor between two times were rewritten. Runs in the transaction that
+    # rewrites them, so the rollups are rebuilt from the new values only
+    def invalidate(self, cursor, sensor, date_lower, date_upper):
+        if self.available(cursor):
+            cursor.execute(sql.SQL("INSERT INTO {0} (sensor, lower, upper) VALUES (%s, %s, %s)")
+                           .format(self.table("invalidations")), (sensor, date_lower, date_upper))
+
+    # Recomputes the rollups of every invalidated range, widened to whole buckets of the coarsest rollup,
+    # from the rows up to the watermark. sources maps unique tags to the source they are stored in.
+    # Returns the number of ranges rebuilt
+    def rebuild_invalidated(self, cursor, sources):
+        cursor.execute(sql.SQL("DELETE FROM {0} RETURNING sensor, lower, upper").format(self.table("invalidations")))
+        invalidations = cursor.fetchall()
+
+        coarsest = RESOLUTIONS[-1][1]
+        for sensor, date_lower, date_upper in invalidations:
+            source = sources.get(sensor)
+            if source is None:
+                continue
+
+            name, table, columns = source
+            last_id = self.lock_watermark(cursor, name)
+            parameters = {"sensor": sensor, "last": last_id,
+                          "lower": math.floor(date_lower.timestamp() / coarsest) * coarsest,
+                          "upper": math.ceil(date_upper.timestamp() / coarsest) * coarsest}
+            for suffix, _ in RESOLUTIONS:
+                cursor.execute(sql.SQL(
+                    "DELETE FROM {0} WHERE sensor = %(sensor)s AND bucket >= to_timestamp(%(lower)s) "
+                    "AND bucket < to_timestamp(%(upper)s)"
+                ).format(self.rollup_table(suffix)), parameters)
+            self.roll_up(cursor, table, [column for column in columns if column[0] == sensor], sql.SQL(
+                "timestamp >= to_timestamp(%(lower)s) AND timestamp < to_timestamp(%(upper)s) AND id <= %(last)s"
+            ), parameters)
+        return len(invalidations)
+
+    # The coarsest rollup, as (suffix, seconds), whose buckets are no longer than the given number of
+    # seconds, or None if even the finest one is too coarse
+    @staticmethod
+    def resolution_for(seconds):
+        fitting = [resolution for resolution in RESOLUTIONS if resolution[1] <= seconds]
+        return fitting[-1] if fitting else None
+
+    # (bucket number, bucket start, min, avg, max) rows of a sensor stored in the given source, one per
+    # bucket with values when the range is split into the given number of equal buckets. Read from the
+    # coarsest rollup that fits them (see query_resolution)
+    def query_buckets(self, cursor, source, sensor, date_lower, date_upper, buckets):
+        width = (date_upper - date_lower).total_seconds() / buckets
+        return self.query_resolution(cursor, source, sensor, date_lower, date_upper, buckets,
+                                     self.resolution_for(width))
+
+    # query_buckets from the given rollup and the rows past the watermark, or from the rows of the source
+    # alone when resolution is None
+    def query_resolution(self, cursor, source, sensor, date_lower, date_upper, buckets, resolution):
+        name, table, columns = source
+        column = dict(columns)[sensor]
+        parameters = {"lower": date_lower.timestamp(), "upper": date_upper.timestamp(), "buckets": buckets,
+                      "date_lower": date_lower, "date_upper": date_upper, "sensor": sensor, "source": name}
+
+        if resolution is None:
+            rolled_up = sql.SQL("")
+            tail = sql.SQL("TRUE")
+        else:
+            rolled_up = sql.SQL(
+                """
+                SELECT width_bucket(extract(epoch FROM bucket), %(lower)s, %(upper)s, %(buckets)s) AS bucket,
+                    count, sum, min, max
+                FROM {0}
+                WHERE sensor = %(sensor)s AND bucket >= %(date_lower)s AND bucket < %(date_upper)s
+                UNION ALL
+                """
+            ).format(self.rollup_table(resolution[0]))
+            tail = sql.SQL("id > (SELECT coalesce(max(last_id), 0) FROM {0} WHERE source = %(source)s)").format(
+                self.table("watermarks"))
+
+        cursor.execute(sql.SQL(
+            """
+            SELECT bucket, to_timestamp(%(lower)s + (bucket - 1) * (%(upper)s - %(lower)s) / %(buckets)s),
+                min(min), sum(sum) / sum(count), max(max)
+            FROM (
+                {0}
+                SELECT width_bucket(extract(epoch FROM timestamp), %(lower)s, %(upper)s, %(buckets)s) AS bucket,
+                    1 AS count, value AS sum, value AS min, value AS max
+                FROM (
+                    SELECT timestamp, {1}::double precision AS value FROM {2}
+                    WHERE {3} AND timestamp >= %(date_lower)s AND timestamp < %(date_upper)s AND {1} IS NOT NULL
+                ) AS stored
+            ) AS bucketed
+            GROUP BY bucket
+            ORDER BY bucket
+            """
+        ).format(rolled_up, column, table, tail), parameters)
+        return cursor.fetchall()
@@ -0,0 +1,106 @@
+import importlib.util
+import io
+import os
+from xml.etree import ElementTree
+
+"""
+Startup cache shared by the visualizer and dbtools, so that they come up quickly on the Raspberry Pi
+in the chase car. load_ui compiles .ui files to Python with pyside2-uic, so that windows are built by
+plain calls instead of QUiLoader parsing the XML, and QtUiTools isn't imported. The compiled files are
+kept in a startup_cache directory next to the .ui files and rebuilt whenever one of those changes (by
+modification time and size), so deleting the directory is always safe. Falls back to QUiLoader when
+pyside2uic isn't installed or what it compiles doesn't work with the installed PySide2.
+"""
+
+CACHE_DIRECTORY = "startup_cache"
+
+# Appended to every compiled .ui file
+CREATE_FUNCTION = """
+
+def create():
+    widget = QtWidgets.{0}()
+    widget.ui = Ui_{1}()
+    widget.ui.setupUi(widget)
+    return widget
+"""
+
+
+# (path, modification time, size) of each file
+def source_stamps(paths):
+    stamps = []
+    for path in paths:
+        status = os.stat(path)
+        stamps.append((path, status.st_mtime_ns, status.st_size))
+    return stamps
+
+
+# The top-level widget of a .ui file, built by its compiled version (compiled first if needed)
+def load_ui(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    compiled_path = os.path.join(os.path.dirname(path), CACHE_DIRECTORY, "ui_{0}.py".format(name))
+    header = "# Compiled from {0!r}\n".format(source_stamps([path])[0])
+
+    if compiled_is_current(compiled_path, header) or compile_ui(path, compiled_path, header):
+        spec = importlib.util.spec_from_file_location("ui_" + name, compiled_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        if module.create is not None:
+            try:
+                return module.create()
+            # e.g. PySide2 5.13 on Python 3.10 and later, where combining flags (Qt.AlignLeft | Qt.AlignTop)
+            # raises. Noted in the cache, so that later starts go straight to QUiLoader
+            except Exception as error:
+                print("Could not build {0} from its compiled version, loading it at runtime instead. Error: "
+                      .format(path), error)
+                write_cache_file(compiled_path, (header + "create = None\n").encode())
+
+    from PySide2.QtUiTools import QUiLoader
+    return QUiLoader().load(path)
+
+
+def compiled_is_current(compiled_path, header):
+    try:
+        with open(compiled_path) as file:
+            return file.readline() == header
+    except OSError:
+        return False
+
+
+# Writes the Python version of a .ui file, returns whether it could
+def compile_ui(path, compiled_path, header):
+    try:
+        from pyside2uic import compileUi
+    except ImportError:
+        return False
+
+    # pyside2uic calls Element.getiterator() on <resources>, which Python 3.9 removed; the .ui files
+    # don't use any resources
+    root = ElementTree.parse(path).getroot()
+    for resources in root.findall("resources"):
+        root.remove(resources)
+
+    source = io.StringIO()
+    try:
+        compileUi(io.StringIO(ElementTree.tostring(root, encoding="unicode")), source)
+    # Whatever goes wrong, the window can still be loaded at runtime
+    except Exception as error:
+        print("Could not compile {0}, loading it at runtime instead. Error: ".format(path), error)
+        return False
+
+    create_function = CREATE_FUNCTION.format(root.find("widget").get("class"), root.find("class").text)
+    return write_cache_file(compiled_path, (header + source.getvalue() + create_function).encode())
+
+
+# Replaces a file in one step, so an interrupted write never leaves half of one behind. A read-only
+# directory only means starting up without the cache
+def write_cache_file(path, data):
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+        return True
+    except OSError as error:
+        print("Could not write {0}. Error: ".format(path), error)
+        return False
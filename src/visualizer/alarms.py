@@ -0,0 +1,105 @@
+import threading
+
+import numpy as np
+
+import common
+
+"""
+Alarms
+------
+
+Every packet is checked against the bounds in Parameters.xml on the ingest reader thread, as it is
+decoded, instead of only the latest value at each GUI refresh, so an excursion between refreshes still
+raises an alarm. A sensor's alarm level is normal (lb < value < ub), warning (lcb < value < ucb) or
+critical, and only changes when:
+
+    - hysteresis: going up a level takes crossing the bound, coming back down takes being inside it by
+      the hysteresis margin, so a value sitting on a bound doesn't flicker. The margin is the sensor's
+      hysteresis attribute, or AlarmHysteresis times the gap between the bound and its critical bound
+    - debounce: the new level has held for the sensor's debounce attribute (or AlarmDebounceSamples)
+      consecutive samples of the sensor. 1 takes every excursion, higher values ignore short spikes
+
+Each change is an event, (time received, unique tag, previous level, new level, value), which the
+ingest writer stores in the AlarmTable (indexed by sensor and time), and the levels are the status the
+module tree shows. Each packet is one pass of NumPy operations over the arrays of every sensor
+"""
+
+LEVEL_NORMAL, LEVEL_WARNING, LEVEL_CRITICAL = common.STATUS_NORMAL, common.STATUS_WARNING, common.STATUS_CRITICAL
+
+
+class AlarmEngine:
+    def __init__(self, cache):
+        self.unique_tags = [sensor.unique_tag for sensor in cache.sensor_list]
+        self.ids = {unique_tag: sensor_id for sensor_id, unique_tag in enumerate(self.unique_tags)}
+
+        # Bounds to cross to go up a level, and to be inside of to come back down
+        self.raise_bounds = np.array([cache.lower_critical_bounds, cache.lower_bounds, cache.upper_bounds,
+                                      cache.upper_critical_bounds])
+        fraction = float(common.SETTINGS["AlarmHysteresis"])
+        lower_margin = np.where(np.isnan(cache.alarm_hysteresis),
+                                fraction * (cache.lower_bounds - cache.lower_critical_bounds), cache.alarm_hysteresis)
+        upper_margin = np.where(np.isnan(cache.alarm_hysteresis),
+                                fraction * (cache.upper_critical_bounds - cache.upper_bounds), cache.alarm_hysteresis)
+        self.clear_bounds = self.raise_bounds + np.array([lower_margin, lower_margin, -upper_margin, -upper_margin])
+        self.debounce = np.where(np.isnan(cache.alarm_debounce), int(common.SETTINGS["AlarmDebounceSamples"]),
+                                 cache.alarm_debounce).astype(np.int64)
+
+        # Current level of each sensor (read by the GUI), and the level it is on its way to with the
+        # number of consecutive samples that agreed so far
+        self.levels = np.full(len(self.unique_tags), LEVEL_NORMAL, dtype=np.int8)
+        self.pending_levels = self.levels.copy()
+        self.pending_counts = np.zeros(len(self.unique_tags), dtype=np.int64)
+
+        # Events not taken by the writer yet
+        self.lock = threading.Lock()
+        self.events = []
+
+    # Checks a batch of decoded packets (dicts of unique tag -> value) received at the given times
+    # (seconds since the epoch), in order
+    def process_packets(self, timestamps, packets):
+        rows = np.full((len(packets), len(self.unique_tags)), np.nan)
+        for row, values in zip(rows, packets):
+            for unique_tag, value in values.items():
+                sensor_id = self.ids.get(unique_tag)
+                if sensor_id is not None:
+                    row[sensor_id] = value
+
+        for timestamp, row in zip(timestamps, rows):
+            self.evaluate(timestamp, row)
+
+    # One packet, as an array of the value of every sensor with NaN for the ones it doesn't hold
+    def evaluate(self, timestamp, values):
+        present = ~np.isnan(values)
+        raised = self.level(values, self.raise_bounds)
+        cleared = self.level(values, self.clear_bounds)
+        candidates = np.where(raised > self.levels, raised, np.minimum(self.levels, cleared))
+
+        # Sensors missing from the packet keep their count
+        changing = present & (candidates != self.levels)
+        counts = np.where(changing & (candidates == self.pending_levels), self.pending_counts + 1, 1)
+        self.pending_counts = np.where(present, np.where(changing, counts, 0), self.pending_counts)
+        self.pending_levels = np.where(present, candidates, self.pending_levels)
+
+        changed = np.flatnonzero(changing & (self.pending_counts >= self.debounce))
+        if not len(changed):
+            return
+
+        with self.lock:
+            for sensor_id in changed.tolist():
+                self.events.append((timestamp, self.unique_tags[sensor_id], int(self.levels[sensor_id]),
+                                    int(candidates[sensor_id]), float(values[sensor_id])))
+        self.levels[changed] = candidates[changed]
+        self.pending_counts[changed] = 0
+
+    # The level of every value against lcb, lb, ub, ucb; bounds are non-inclusive
+    @staticmethod
+    def level(values, bounds):
+        with np.errstate(invalid="ignore"):
+            return np.where((bounds[1] < values) & (values < bounds[2]), LEVEL_NORMAL,
+                            np.where((bounds[0] < values) & (values < bounds[3]), LEVEL_WARNING, LEVEL_CRITICAL))
+
+    # Returns the events since the last call
+    def take_events(self):
+        with self.lock:
+            events, self.events = self.events, []
+        return events
@@ -0,0 +1,215 @@
+import asyncio
+import datetime
+import threading
+import time
+from sys import platform
+
+import common
+from ingest import IngestEngine, SerialReader, record_commit
+
+# Optional, only needed with IngestEngine=asyncio in settings.txt
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+# Alternative to the threaded IngestPipeline, selected with IngestEngine=asyncio. A single asyncio
+# event loop on its own thread reads the serial port as a non-blocking stream, decodes frames, appends
+# them to the same write-ahead spool and replays the spool through asyncpg, overlapping reads with
+# database round trips:
+#   - inserts use prepared statements and asyncpg's executemany, which pipelines the rows of a batch
+#     instead of waiting for every statement to complete
+#   - a batch is whatever was spooled since the last write went out, so batches grow on their own
+#     when the database is slow, while the reader carries on appending to the spool
+# The serial stream only works on POSIX systems, where the port is a file descriptor
+class AsyncIngestPipeline(IngestEngine):
+    def __init__(self, db_conn, device=None, spool=None):
+        # Before the serial port and the spool are opened
+        if asyncpg is None:
+            raise ImportError("IngestEngine=asyncio needs the asyncpg package")
+        super().__init__(db_conn, device, spool)
+
+        self.async_db_conn = AsyncDatabaseConnection(db_conn)
+
+        self.loop = None
+        self.stopping = None
+        # Set whenever a packet is spooled, to wake up the writer
+        self.spooled = None
+        self.loop_thread = threading.Thread(target=lambda: asyncio.run(self.run()), name="AsyncIngest", daemon=True)
+
+    def start(self):
+        self.running = True
+        self.loop_thread.start()
+
+    # Stops reading; the writer drains the spool (if the database can be reached) before the loop exits
+    def stop(self):
+        self.running = False
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.loop_thread.is_alive():
+            self.loop_thread.join()
+        self.spool.close()
+        self.serial_reader.close()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.spooled = asyncio.Event()
+        if not self.running:
+            return
+
+        reader = asyncio.create_task(self.read_stream())
+        writer = asyncio.create_task(self.write_batches())
+        await self.stopping.wait()
+
+        reader.cancel()
+        await writer
+        await self.async_db_conn.close()
+
+    async def read_stream(self):
+        while True:
+            if not self.serial_reader.connection:
+                await asyncio.sleep(SerialReader.reconnect_interval)
+                self.serial_reader.attempt_serial_connection()
+                continue
+
+            stream = asyncio.StreamReader()
+            transport, _ = await self.loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(stream), self.serial_reader.serial)
+            try:
+                while True:
+                    if self.serial_reader.protocol == "binary":
+                        data = await stream.read(4096)
+                    else:
+                        data = await stream.readline()
+                    if not data:
+                        break
+                    await self.handle_data(data)
+            except OSError:
+                pass
+            finally:
+                transport.close()
+
+            print("Lost connection to the Arduino.")
+            self.serial_reader.serial = None
+            self.serial_reader.connection = False
+            common.arduino_connection_status = False
+
+    async def handle_data(self, data):
+        packets = self.serial_reader.decode(data, time.monotonic())
+        if not packets:
+            return
+
+        self.process_packets(packets)
+        self.spooled.set()
+
+    # Same as IngestPipeline.write_loop; the disk syncs run on a worker thread
+    async def write_batches(self):
+        position = self.spool.checkpoint
+        while True:
+            await self.maintain_storage_async()
+            # Like the storage maintenance, on the regular connection
+            await self.loop.run_in_executor(None, self.write_alarms)
+            await self.loop.run_in_executor(None, self.update_rollups)
+            await self.loop.run_in_executor(None, self.spool.sync)
+
+            packets, next_position = self.spool.read(position, self.replay_batch)
+            if not packets:
+                if self.stopping.is_set():
+                    break
+                self.spooled.clear()
+                try:
+                    await asyncio.wait_for(self.spooled.wait(), self.flush_age)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                start = time.monotonic()
+                await self.async_db_conn.insert_packets(
+                    [(self.async_db_conn.timestamp(received_time), values) for received_time, values in packets])
+                record_commit(packets, start)
+                common.database_connection_status = self.async_db_conn.connected()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as error:
+                await self.async_db_conn.close()
+                common.database_connection_status = False
+                if self.stopping.is_set():
+                    break
+                print("Failed to write spooled packets, will retry. Error: ", error)
+                await asyncio.sleep(self.retry_interval)
+                continue
+
+            await self.loop.run_in_executor(None, self.spool.commit, next_position, len(packets))
+            self.written += len(packets)
+            position = next_position
+
+    # The storage maintenance uses the regular (blocking) connection, so it runs on a worker thread
+    async def maintain_storage_async(self):
+        if time.monotonic() >= self.next_storage_maintenance:
+            await self.loop.run_in_executor(None, self.maintain_storage)
+
+
+# asyncpg counterpart of the write half of DatabaseConnection, with the same settings and table layout.
+# Inserts are prepared once per connection and reused for every batch
+class AsyncDatabaseConnection:
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+        self.connection = None
+        self.statements = {}
+
+    async def connect(self):
+        host = "/tmp" if platform == "linux" else None
+        self.connection = await asyncpg.connect(database=self.db_conn.dbname, user=self.db_conn.role,
+                                                password=self.db_conn.password, host=host)
+        self.statements = {}
+
+    def connected(self):
+        return self.connection is not None and not self.connection.is_closed()
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    @staticmethod
+    def timestamp(received_time):
+        return datetime.datetime.fromtimestamp(received_time, datetime.timezone.utc)
+
+    async def prepare(self, key, query):
+        statement = self.statements.get(key)
+        if statement is None:
+            statement = self.statements[key] = await self.connection.prepare(query)
+        return statement
+
+    # Same as DatabaseConnection.insert_packets: all packets in one transaction
+    async def insert_packets(self, packets):
+        if self.connection is None:
+            await self.connect()
+
+        async with self.connection.transaction():
+            if self.db_conn.storage_mode == "wide":
+                columns = self.db_conn.wide_columns
+                statement = await self.prepare("wide", "INSERT INTO {0}.{1} (timestamp, {2}) VALUES ($1, {3})".format(
+                    *map(quote_identifier, self.db_conn.wide_table), ", ".join(map(quote_identifier, columns)),
+                    ", ".join("${0}::double precision".format(index + 2) for index in range(len(columns)))))
+                await statement.executemany(
+                    [(timestamp, *[values.get(unique_tag) for unique_tag in columns]) for timestamp, values in packets])
+
+            else:
+                rows = {}
+                for timestamp, values in packets:
+                    for unique_tag, value in values.items():
+                        rows.setdefault(unique_tag, []).append((timestamp, value))
+
+                for unique_tag, table_rows in rows.items():
+                    statement = await self.prepare(unique_tag, "INSERT INTO {0}.{1} (timestamp, value) "
+                                                               "VALUES ($1, $2::double precision)".format(
+                                                                   *map(quote_identifier, unique_tag.split("."))))
+                    await statement.executemany(table_rows)
+
+        self.db_conn.note_written(packets)
+
+
+def quote_identifier(name):
+    return '"{0}"'.format(name.replace('"', '""'))
@@ -0,0 +1,73 @@
+import argparse
+import datetime
+
+import numpy as np
+import psycopg2
+
+import common
+from database import DatabaseConnection
+from derived import DerivedEngine
+from utility import Parser
+
+"""
+Recalculates derived channels (see the Derived section of Parameters.xml) from the stored values, e.g.
+after a channel is added or its expression changes. The range is processed in chunks, each replaced
+in its own transaction, and integrals/rolling averages carry on from one chunk into the next, so the
+result is the same as if every packet had been evaluated at once. Integrals start from zero at --start.
+
+    python3 backfill_derived.py --start 2020-06-01                           # every derived channel
+    python3 backfill_derived.py --start 2020-06-01 main_battery.power        # only the given channels
+    python3 backfill_derived.py --start 2020-06-01 --end 2020-06-08 --chunk-hours 6
+"""
+
+
+def parse_time(text):
+    return datetime.datetime.fromisoformat(text).replace(tzinfo=datetime.timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalculate derived channels from stored values")
+    parser.add_argument("sensors", nargs="*", help="Unique tags of the derived channels, defaults to all of them")
+    parser.add_argument("--start", type=parse_time, required=True, help="UTC date/time to start from")
+    parser.add_argument("--end", type=parse_time, help="UTC date/time to stop at, defaults to now")
+    parser.add_argument("--chunk-hours", type=float, default=24, help="Hours of data to process at a time")
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+
+    engine = DerivedEngine(Parser.parse_xml("Derived"), common.packet_layout.sensors)
+    channels = [channel.sensor for channel in engine.channels]
+    unknown = [sensor for sensor in args.sensors if sensor not in channels]
+    if unknown:
+        print("Not derived channels (see the Derived section of Parameters.xml): " + ", ".join(unknown))
+        return
+
+    sensors = args.sensors or channels
+    end = args.end or datetime.datetime.now(datetime.timezone.utc)
+    chunk = datetime.timedelta(hours=args.chunk_hours)
+
+    lower = args.start
+    while lower < end:
+        upper = min(lower + chunk, end)
+        try:
+            with db_conn.transaction() as cursor:
+                timestamps, columns = db_conn.query_aligned_values(cursor, engine.inputs, lower, upper)
+                seconds = [timestamp.timestamp() for timestamp in timestamps]
+                derived = engine.evaluate(np.array(seconds, dtype=np.float64), columns)
+
+                for sensor in sensors:
+                    db_conn.replace_values(cursor, sensor, lower, upper, timestamps, derived[sensor])
+            print(f"{lower} - {upper}: {len(timestamps)} packets")
+
+        except psycopg2.Error as error:
+            print(f"{lower} - {upper}: backfill failed, stopping here. Error: ", error)
+            return
+
+        lower = upper
+
+
+if __name__ == "__main__":
+    main()
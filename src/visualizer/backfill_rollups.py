@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import psycopg2
+
+from database import DatabaseConnection
+from storage import StorageManager
+
+"""
+Rolls up every stored value that isn't rolled up yet (see shared/rollups.py), e.g. the data stored
+before the rollups existed, a chunk of RollupChunkRows rows per source and transaction. The ingest
+writer does the same a chunk per RollupIntervalSeconds while the visualizer runs; this gets it done in
+one go. Stopping it midway is safe, the next run carries on from the watermarks.
+
+    python3 backfill_rollups.py
+    python3 backfill_rollups.py --chunk-rows 500000
+    python3 backfill_rollups.py --rebuild             # empty the rollups and roll everything up again
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll up the stored values that aren't rolled up yet")
+    parser.add_argument("--chunk-rows", type=int, help="Rows per transaction, defaults to RollupChunkRows")
+    parser.add_argument("--rebuild", action="store_true", help="Empty the rollups and start over")
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+    if args.chunk_rows:
+        db_conn.rollups.chunk_rows = args.chunk_rows
+
+    storage_manager = StorageManager(db_conn)
+    try:
+        # Creates the rollup tables if need be
+        storage_manager.maintain()
+        if args.rebuild:
+            with db_conn.transaction() as cursor:
+                db_conn.rollups.reset(cursor)
+
+        start = time.monotonic()
+        total_rows = 0
+        while True:
+            rows = storage_manager.update_rollups(max_chunks=1)
+            if not rows:
+                break
+            total_rows += rows
+            print(f"{total_rows} rows rolled up ({total_rows / (time.monotonic() - start):.0f} rows/s)")
+
+    except psycopg2.Error as error:
+        print("Backfill failed, stopping here; the next run carries on from where it stopped. Error: ", error)
+        return
+
+    print("Every stored value is rolled up")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import struct
+
+"""
+Serial captures
+---------------
+
+With SerialCaptureFile set in settings.txt, SerialReader appends every chunk of bytes it reads from the
+Arduino to that file along with the time it arrived, so a run can be replayed later without the car
+(see benchmarks/replay_benchmark.py). The bytes are stored exactly as read, debug messages and
+corrupted frames included, so a replay goes through the same decoding as the original run. Layout:
+
+    "TLMCAP1 <protocol>\n"      header, <protocol> being the SerialProtocol the capture was taken with
+    then per chunk:
+        float64   receive time, seconds since the epoch
+        uint32    byte count
+        bytes     the data
+
+A chunk cut short by a crash is ignored when the capture is read.
+"""
+
+MAGIC = "TLMCAP1"
+CHUNK_HEADER = struct.Struct("<dI")
+
+
+class CaptureWriter:
+    def __init__(self, path, protocol):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write("{0} {1}\n".format(MAGIC, protocol).encode())
+
+    def write(self, received_time, data):
+        self.file.write(CHUNK_HEADER.pack(received_time, len(data)))
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+# Returns the protocol a capture was taken with and its (receive time, bytes) chunks in order
+def read_capture(path):
+    with open(path, "rb") as file:
+        magic, protocol = file.readline().decode().split()
+        if magic != MAGIC:
+            raise ValueError("{0} is not a serial capture".format(path))
+
+        chunks = []
+        while True:
+            header = file.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            received_time, length = CHUNK_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                break
+            chunks.append((received_time, data))
+
+    return protocol, chunks
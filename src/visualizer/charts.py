@@ -0,0 +1,111 @@
+import numpy as np
+
+from PySide2.QtCore import Qt
+from PySide2.QtWidgets import QVBoxLayout
+from PySide2.QtCharts import QtCharts
+import PySide2.QtCore as QtCore
+
+import common
+from downsample import minmax_decimate, lttb
+
+# The charts at the bottom of the main window. Kept apart from ui.py because QtCharts is the slowest
+# import of the visualizer; UserInterface only imports this module once the window is on screen
+
+
+class LineChart:
+    def __init__(self, frame):
+        self.series = QtCharts.QLineSeries()
+        self.series.setColor(Qt.red)
+
+        self.axis_x = QtCharts.QDateTimeAxis()
+        # Number of items to display
+        self.axis_x.setTickCount(int(common.SETTINGS["ChartTickCount"]))
+        self.axis_x.setFormat("hh:mm:ss:z") # Date format
+        self.axis_x.setTitleText("Time")
+
+        self.axis_y = QtCharts.QValueAxis()
+        self.axis_y.setTitleText("Value")
+
+        self.chart = QtCharts.QChart()
+        self.chart.setTitle("")
+        self.chart.addSeries(self.series)
+        self.chart.addAxis(self.axis_x, QtCore.Qt.AlignBottom)
+        self.chart.addAxis(self.axis_y, QtCore.Qt.AlignLeft)
+
+        self.series.attachAxis(self.axis_x)
+        self.series.attachAxis(self.axis_y)
+
+        self.chart_view = QtCharts.QChartView(self.chart)
+
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.chart_view)
+
+        self.frame = frame
+        self.frame.setLayout(self.layout)
+
+        # How far back the chart reaches, and how to thin out the points when the window holds more
+        # of them than the chart is wide ("minmax" or "lttb")
+        self.history = int(common.SETTINGS["ChartHistorySeconds"]) * 1000
+        self.downsample_method = common.SETTINGS["ChartDownsampleMethod"]
+
+        # The sensor currently drawn, the newest timestamp drawn, and the value range of the window
+        self.sensor = None
+        self.last_timestamp = None
+        self.min_y = self.max_y = None
+        self.min_y_time = self.max_y_time = None
+
+    # Redraws the chart with the history of the given sensor, or clears it if there is none. The
+    # whole (downsampled) window is pushed to the series in one replace() call
+    def update(self, sensor):
+        if not sensor or not len(sensor.value_cache):
+            if self.sensor:
+                self.series.clear()
+                self.sensor = None
+            return
+
+        latest_timestamp, _ = sensor.value_cache.latest()
+        if sensor is self.sensor and latest_timestamp == self.last_timestamp:
+            return  # Nothing new has arrived since the last redraw
+
+        timestamps, values = sensor.value_cache.since(latest_timestamp - self.history)
+        self.update_value_range(sensor, timestamps, values)
+        self.sensor = sensor
+        self.last_timestamp = latest_timestamp
+
+        # No point in drawing more points than there are pixels to draw them on
+        plot_width = int(self.chart.plotArea().width()) or len(timestamps)
+        if self.downsample_method == "lttb":
+            timestamps, values = lttb(timestamps, values, plot_width)
+        else:
+            timestamps, values = minmax_decimate(timestamps, values, plot_width // 2)
+
+        self.series.replace([QtCore.QPointF(x, y) for x, y in zip(timestamps.tolist(), values.tolist())])
+
+        y_margin = (self.max_y - self.min_y) / 10 or 1
+        self.axis_x.setRange(QtCore.QDateTime.fromMSecsSinceEpoch(int(timestamps[0])),
+                             QtCore.QDateTime.fromMSecsSinceEpoch(int(timestamps[-1])))
+        self.axis_y.setRange(self.min_y - y_margin, self.max_y + y_margin)
+
+    # Keeps track of the lowest and highest values in the window. Only samples that arrived since the
+    # last redraw are looked at, unless the previous extreme has scrolled out of the window
+    def update_value_range(self, sensor, timestamps, values):
+        window_start = timestamps[0]
+        if sensor is self.sensor and self.min_y_time >= window_start and self.max_y_time >= window_start:
+            new_samples = np.searchsorted(timestamps, self.last_timestamp, side="right")
+            timestamps, values = timestamps[new_samples:], values[new_samples:]
+        else:
+            self.min_y = self.max_y = None
+
+        if not len(values):
+            return
+
+        lowest, highest = int(values.argmin()), int(values.argmax())
+        if self.min_y is None or values[lowest] <= self.min_y:
+            self.min_y, self.min_y_time = float(values[lowest]), int(timestamps[lowest])
+        if self.max_y is None or values[highest] >= self.max_y:
+            self.max_y, self.max_y_time = float(values[highest]), int(timestamps[highest])
+
+
+class GaugeChart:
+    def __init__(self):
+        pass
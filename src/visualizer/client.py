@@ -2,6 +2,8 @@ from PySide2.QtWidgets import QApplication
 
 from ui import UserInterface
 from database import DatabaseConnection
+from ingest import IngestPipeline
+import common
 
 
 class Client:
@@ -11,12 +13,35 @@ class Client:
         self.qt_app.aboutToQuit.connect(self.quit)
 
         self.database_connection = DatabaseConnection(self)
+        # Serial reading and database writes happen off the GUI thread, see ingest.py and async_ingest.py.
+        # The asyncio engine and the metrics endpoint are only imported when used, to start up faster
+        if common.SETTINGS["IngestEngine"] == "asyncio":
+            from async_ingest import AsyncIngestPipeline
+            self.ingest_pipeline = AsyncIngestPipeline(self.database_connection)
+        else:
+            self.ingest_pipeline = IngestPipeline(self.database_connection)
+        # Prometheus endpoint for other screens, see metrics.py
+        self.metrics_server = None
+        if int(common.SETTINGS["MetricsPort"]):
+            from metrics import MetricsServer
+            # The endpoint is optional, so a port that is taken doesn't stop the visualizer
+            try:
+                self.metrics_server = MetricsServer(self.ingest_pipeline)
+            except OSError as error:
+                print("Could not serve metrics on {0}:{1}, continuing without them. Error: ".format(
+                    common.SETTINGS["MetricsHost"], common.SETTINGS["MetricsPort"]), error)
         self.user_interface = UserInterface(self)
+        self.ingest_pipeline.start()
+        if self.metrics_server:
+            self.metrics_server.start()
 
         self.qt_app.exec_()
 
     # Application destructor, may be used one day if I implement file logging
     def quit(self):
+        if self.metrics_server:
+            self.metrics_server.stop()
+        self.ingest_pipeline.stop()
         quit(0)
 
 
@@ -1,8 +1,11 @@
 import datetime
+import numpy as np
 from PySide2.QtCore import Qt
-import PySide2.QtCore as QtCore
 from PySide2.QtGui import QColor
 
+from latency import LatencyMonitor
+from protocol import PacketLayout
+from ringbuffer import RingBuffer
 from utility import Parser
 
 # Common data and settings used across various files
@@ -10,8 +13,8 @@ from utility import Parser
 DEBUG = True
 SETTINGS = Parser.load_settings()
 
-seconds_since_last_packet = 0 
-arduino_uptime = 0 # Number of seconds that the Arduino has been running for 
+last_packet_time = 0  # time.monotonic() when the last packet arrived
+arduino_uptime = 0  # Number of seconds that the Arduino had been running for when it sent the last packet
 packet_received = False # Flag that tracks if a valid packet has been received since init
 database_connection_status = False
 arduino_connection_status = False
@@ -19,27 +22,41 @@ arduino_connection_status = False
 
 # Aka. the schema, groups related sensors together
 class Module:
-    def __init__(self, tag, module_parameters):
+    def __init__(self, tag, module_parameters, cache):
         self.tag = tag
         self.label = module_parameters.pop("label")
-        self.sensors = self.create_sensors(module_parameters)
+        self.sensors = self.create_sensors(module_parameters, cache)
 
-    def create_sensors(self, module_parameters):
+    def create_sensors(self, module_parameters, cache):
         sensors = []
         for sensor in module_parameters:
             sensor_parameters = module_parameters[sensor]
             sensor_parameters["parent_tag"] = self.tag
             sensor_parameters["parent_label"] = self.label
-            sensors.append(Sensor(sensor, sensor_parameters))
+            sensors.append(cache.add_sensor(sensor, sensor_parameters))
 
         return sensors
 
 
-# Aka. the table, keeps track of actual data
+# Range a sensor's value falls into, kept in Cache.status, or STATUS_ERROR before its first reading
+STATUS_NORMAL, STATUS_WARNING, STATUS_CRITICAL, STATUS_ERROR = range(4)
+# Color of the value cell in the user interface for each status; hex color is orange
+STATUS_COLORS = (QColor(Qt.white), QColor(0xFF, 0x8C, 0x00), QColor(Qt.red), QColor(Qt.darkRed))
+
+
+# Aka. the table. The numbers of a sensor (bounds, latest value, min/max, status) live in the arrays of
+# the Cache, at the sensor's id; this is a view of them along with what isn't a number
 class Sensor:
-    def __init__(self, tag, sensor_parameters):
-        # Stores the specified number of values as defined in the parameters markup file
-        self.value_cache = [[QtCore.QDateTime.currentDateTime(), -9999]] # Error value as default
+    __slots__ = ("id", "cache", "tag", "label", "parent_tag", "parent_label", "unique_tag", "unit", "value_cache",
+                 "gui_reference")
+
+    def __init__(self, sensor_id, cache, tag, sensor_parameters):
+        self.id = sensor_id
+        self.cache = cache
+
+        # Stores the most recent values (as many as the DataCacheSize setting allows) along with
+        # the time they were received, in milliseconds since the epoch
+        self.value_cache = RingBuffer(int(SETTINGS["DataCacheSize"]))
 
         # Tag = the unique identifier used in the markup file to identify the element
         # Label = the user-friendly name used in the GUI to identify the element
@@ -52,51 +69,68 @@ class Sensor:
         # used for database interfacing
         self.unique_tag = ".".join([self.parent_tag, self.tag])
 
-        # Sensor-specific "value bounds" as defined in the parameters markup file
-        # Bounds are non-inclusive (e.g. a value at the bound will not count as crossing it)
-        self.lower_critical_bound = float(sensor_parameters["lcb"])
-        self.lower_bound = float(sensor_parameters["lb"])
-        self.upper_bound = float(sensor_parameters["ub"])
-        self.upper_critical_bound = float(sensor_parameters["ucb"])
         # GUI-specific variables
         self.unit = sensor_parameters["unit"]
-        self.value_color = None
-        self.operational = False
         self.gui_reference = None
-        self.value = -9999 # Error value as default
-        self.lowest_recorded_value = 9999
-        self.highest_recorded_value = -9999
-
-    # Returns the color for the value cell in the user interface based upon the range 
-    # the value falls into
-    def determine_value_color(self):
-        normal, warning, critical, error = Qt.white, QColor(0xFF, 0x8C, 0x00), Qt.red, Qt.darkRed  # Hex color is orange
-        lcb, lb, ub, ucb = self.lower_critical_bound, self.lower_bound, self.upper_bound, self.upper_critical_bound
-        value_color = normal
-
-        # Check for the range that the value falls into 
-        if lb < self.value < ub:
-            value_color = normal
-        elif lcb < self.value < ucb:
-            value_color = warning
-        elif self.value == -9999:
-            value_color = error
-        else:
-            value_color = critical
-
-        self.value_color = value_color
-
-    def update_data_reading(self, new_value):
-        max_values_to_store = settings["PacketCacheSize"]
-        # Insert at beginning to make retrieval from the list size-agnostic
-        self.value_cache.insert(0, new_value)
-        if len(self.value_cache) > max_values_to_store:
-            self.value_cache.pop(cache_max_size - 1)
+
+    # Sensor-specific "value bounds" as defined in the parameters markup file
+    # Bounds are non-inclusive (e.g. a value at the bound will not count as crossing it)
+    @property
+    def lower_critical_bound(self):
+        return float(self.cache.lower_critical_bounds[self.id])
+
+    @property
+    def lower_bound(self):
+        return float(self.cache.lower_bounds[self.id])
+
+    @property
+    def upper_bound(self):
+        return float(self.cache.upper_bounds[self.id])
+
+    @property
+    def upper_critical_bound(self):
+        return float(self.cache.upper_critical_bounds[self.id])
+
+    # -9999 until the first reading arrives
+    @property
+    def value(self):
+        return float(self.cache.values[self.id])
+
+    # Like the status and color, only up to date as of the last Cache.refresh()
+    @property
+    def lowest_recorded_value(self):
+        return float(self.cache.lowest_values[self.id])
+
+    @property
+    def highest_recorded_value(self):
+        return float(self.cache.highest_values[self.id])
+
+    @property
+    def status(self):
+        return int(self.cache.status[self.id])
+
+    # Color for the value cell in the user interface based upon the range the value falls into
+    @property
+    def value_color(self):
+        return STATUS_COLORS[self.cache.status[self.id]]
+
+    # Incremented with every new reading, so the GUI can tell whether there is anything to redraw
+    @property
+    def version(self):
+        return int(self.cache.versions[self.id])
+
+    def update_data_reading(self, timestamp, new_value):
+        self.value_cache.append(timestamp, new_value)
+        self.cache.record(self.id, new_value)
 
 
 # Somewhat misleading name; derives its name from the fact that it contains all of
 # the process's local data as opposed to the data stored in the separate database,
-# and so doesn't require a database query to retrieve the data located in it
+# and so doesn't require a database query to retrieve the data located in it.
+#
+# Every sensor gets an integer id in the order Parameters.xml lists them, which indexes the arrays
+# below (struct of arrays), so that refresh() can check the bounds and track the min/max of every
+# sensor in a handful of NumPy operations instead of a loop over Sensor objects
 class Cache:
     def __init__(self):
         self.modules = {}
@@ -104,16 +138,70 @@ class Cache:
         # tag (simply the module tag + the sensor tag, aka. the schema name + the
         # table name
         self.sensors = {}
+        # Sensors by id
+        self.sensor_list = []
 
-        # Initialize module data
+        # Initialize module data. The numeric parameters of each sensor are collected as it is added, and
+        # made into arrays once every sensor is known
+        self.parameter_rows = []
         module_xml = Parser.parse_xml("Modules")
         for module_tag in module_xml:
-            self.modules[module_tag] = Module(module_tag, module_xml[module_tag])
-
-        # Create the reference to the sensor
-        for module in self.modules.values():
-            for sensor in module.sensors:
-                self.sensors[sensor.unique_tag] = sensor
+            self.modules[module_tag] = Module(module_tag, module_xml[module_tag], self)
+
+        # The optional alarm parameters (see alarms.py) are NaN where Parameters.xml leaves them out
+        self.lower_critical_bounds, self.lower_bounds, self.upper_bounds, self.upper_critical_bounds, \
+            self.alarm_hysteresis, self.alarm_debounce = \
+            np.array(self.parameter_rows, dtype=np.float64).reshape(-1, 6).T.copy()
+        del self.parameter_rows
+
+        count = len(self.sensor_list)
+        self.values = np.full(count, -9999.0)  # Error value as default
+        self.lowest_values = np.full(count, 9999.0)
+        self.highest_values = np.full(count, -9999.0)
+        self.status = np.full(count, STATUS_ERROR, dtype=np.int8)
+        self.versions = np.zeros(count, dtype=np.int64)
+        # Sensors that have received a reading since the GUI last refreshed the module tree
+        self.dirty = np.zeros(count, dtype=bool)
+
+        # Readings since the last refresh, for the min/max
+        self.pending_ids = []
+        self.pending_values = []
+
+    # Creates a sensor with the next id, while the modules are loaded
+    def add_sensor(self, tag, sensor_parameters):
+        sensor = Sensor(len(self.sensor_list), self, tag, sensor_parameters)
+        self.sensor_list.append(sensor)
+        self.sensors[sensor.unique_tag] = sensor
+        self.parameter_rows.append([float(sensor_parameters.get(parameter, "nan"))
+                                    for parameter in ("lcb", "lb", "ub", "ucb", "hysteresis", "debounce")])
+        return sensor
+
+    def record(self, sensor_id, value):
+        self.values[sensor_id] = value
+        self.versions[sensor_id] += 1
+        self.dirty[sensor_id] = True
+        self.pending_ids.append(sensor_id)
+        self.pending_values.append(value)
+
+    # Folds the readings since the last call into the min/max, takes the status of every sensor from
+    # the alarm levels (see alarms.py) and returns the sensors that received a reading since the last call
+    def refresh(self, alarm_levels):
+        if self.pending_ids:
+            ids = np.array(self.pending_ids, dtype=np.intp)
+            values = np.array(self.pending_values, dtype=np.float64)
+            np.minimum.at(self.lowest_values, ids, values)
+            np.maximum.at(self.highest_values, ids, values)
+            self.pending_ids = []
+            self.pending_values = []
+
+        # The alarm levels use the same numbers as the statuses
+        self.status[:] = np.where(self.values == -9999, STATUS_ERROR, alarm_levels)
+
+        dirty_ids = np.flatnonzero(self.dirty)
+        self.dirty[dirty_ids] = False
+        return [self.sensor_list[sensor_id] for sensor_id in dirty_ids]
 
 
 cache = Cache()
+packet_layout = PacketLayout(Parser.parse_xml("Packet"))
+latency_monitor = LatencyMonitor()
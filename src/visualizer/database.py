@@ -1,16 +1,25 @@
-import random
+import datetime
+import os
+import sys
 import time
 
+import numpy as np
 import psycopg2
+import psycopg2.extras
 import psycopg2.sql as sql
-import serial
-import serial.tools.list_ports
 from sys import platform
 
 from PySide2.QtCore import QTimer
 
 import common
 
+# The connection pool and query cache are shared with dbtools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from alignment import align_rows
+from pool import ConnectionPool
+from querycache import CachedResult, QueryCache
+from rollups import Rollups
+
 """
 Database Model:
 
@@ -37,6 +46,28 @@ Database Model:
     timestamp   | timestamp with time zone
     value       | numeric
     ~~~~~~~~~~~~~~~~
+
+    - Tables are partitioned by day on the timestamp, with a BRIN (or btree) index on it, and are created
+      from Parameters.xml by StorageManager (see storage.py). Tables made before that can be converted
+      with migrate_storage.py
+
+    - Alternatively, with StorageMode=wide in settings.txt, every packet is stored as one row of a single
+      wide table (WideTable), with one column per sensor named after the sensor's unique tag:
+
+        telemetry.packets: id | timestamp | "main_battery.voltage" | "main_battery.amperage" | ...
+
+      Sensors missing from a packet are NULL. Cross-sensor queries become a scan of one table instead
+      of a join on timestamp
+
+    - Connections come from a pool (see shared/pool.py), so the ingest writer and the GUI each run their
+      transactions on a connection of their own, and reconnect by themselves after Postgres restarts
+
+    - History lookups are cached (see shared/querycache.py). Ingest notes every sensor it writes to, so
+      looking a sensor up again only asks the database for rows newer than the cached ones, and not at
+      all when nothing was written to it since
+
+    - Every sensor is also rolled up into 1 s, 1 min and 1 h min/avg/max/count tables (see shared/rollups.py),
+      kept up to date by the ingest writer, which long-range queries read instead of the stored values
 """
 
 
@@ -48,8 +79,22 @@ class DatabaseConnection:
         # Storing password locally isn't a security concern because it shouldn't be open to outside connections
         self.password = common.SETTINGS["DatabasePassword"]
 
-        self.connection = None
-        self.cursor = None
+        self.pool = ConnectionPool(self.connection_parameters(), int(common.SETTINGS["DatabasePoolSize"]),
+                                   int(common.SETTINGS["DatabaseHealthCheckSeconds"]),
+                                   int(common.SETTINGS["DatabaseMaxBackoffSeconds"]))
+        # Every write of this process goes through insert_packets or the asyncio engine, which note it
+        self.query_cache = QueryCache(int(common.SETTINGS["QueryCacheRows"]), notified=True)
+
+        # "per_sensor" (one table per sensor) or "wide" (one row per packet, see above)
+        self.storage_mode = common.SETTINGS["StorageMode"]
+        self.wide_table = tuple(common.SETTINGS["WideTable"].split("."))
+        self.wide_columns = list(common.cache.sensors.keys())
+        # Seconds, see query_aligned_values
+        self.align_tolerance = int(common.SETTINGS["DerivedAlignToleranceMS"]) / 1000
+        # Where alarm events go, see alarms.py
+        self.alarm_table = tuple(common.SETTINGS["AlarmTable"].split("."))
+        self.rollups = Rollups(common.SETTINGS["RollupSchema"], int(common.SETTINGS["RollupChunkRows"]))
+        self.plan_inserts()
 
         # Attempt to connect the number of times specified in the parameters/SETTINGS file
         for attempt in range(0, int(common.SETTINGS["DatabaseConnectionAttempts"])):
@@ -57,47 +102,169 @@ class DatabaseConnection:
                 self.attempt_connection()
                 common.database_connection_status = True
                 break
-            except psycopg2.DatabaseError as error:
-                if attempt == int(common.SETTINGS["DatabaseConnectionAttempts"]):
+            except psycopg2.Error as error:
+                if attempt == int(common.SETTINGS["DatabaseConnectionAttempts"]) - 1:
                     print("Database connection failed. Application will proceed to open but functionality will be limited.")
                     break
 
                 print(f"Connection failed, {int(common.SETTINGS['DatabaseConnectionAttempts']) - attempt - 1}"
                       f" attempts left. Error: ", error)
 
-        self.serial_reader = SerialReader(self)
-
-    # Attempt to make a connection to the locally-hosted Postgres database process
-    def attempt_connection(self):
+    # Keyword arguments of psycopg2.connect for the locally-hosted Postgres database process
+    def connection_parameters(self):
         # Linux specific
         if platform == "linux":
-            self.connection = psycopg2.connect(dbname=self.dbname, user=self.role, host="/tmp")
+            return {"dbname": self.dbname, "user": self.role, "host": "/tmp"}
 
-        # Windows specific 
+        # Windows specific
         elif platform == "win32" or platform == "cygwin":
-            self.connection = psycopg2.connect(dbname=self.dbname, user=self.role)
-            self.cursor = self.connection.cursor()
+            return {"dbname": self.dbname, "user": self.role}
 
-        else:
-            print("Operating system not supported.")
+        print("Operating system not supported.")
+        return {"dbname": self.dbname, "user": self.role}
+
+    # Attempt to make a connection right away, regardless of when the pool would next retry
+    def attempt_connection(self):
+        self.pool.check()
+
+    # Whether the database could be reached the last time a connection was made
+    def connected(self):
+        return self.pool.available()
+
+    # A cursor in a transaction of its own, see ConnectionPool.transaction
+    def transaction(self, name=None):
+        return self.pool.transaction(name)
 
-    # Retrieve the specified number of rows from a single table
+    # Retrieve the specified number of most recent (id, timestamp, value) rows of a single sensor, newest
+    # first. Cached, so only rows with an id past the cached ones are fetched. Prepared once per
+    # connection and sensor, since it is run over and over with different limits
     def query_individual_table(self, schema, table, values=5):
-        query = sql.SQL(
-            """
-            SELECT * FROM {0}.{1}
-            ORDER BY id DESC
-            """
-        ).format(sql.Identifier(schema), sql.Identifier(table))
-        if self.cursor:
-            self.cursor.execute(query)
-            try:
-                return self.cursor.fetchmany(values)
-            except:
-                return []
+        unique_tag = ".".join([schema, table])
+        key = (unique_tag, "Most recent", values)
+        cached = self.query_cache.get(key)
+        if cached is not None and not self.query_cache.needs_tail(cached):
+            return cached.rows
+
+        if self.storage_mode == "wide":
+            query = sql.SQL(
+                """
+                SELECT id, timestamp, {0} FROM {1}.{2}
+                WHERE {0} IS NOT NULL AND id > $2
+                ORDER BY id DESC
+                LIMIT $1
+                """
+            ).format(sql.Identifier(unique_tag), *map(sql.Identifier, self.wide_table))
         else:
+            query = sql.SQL(
+                """
+                SELECT * FROM {0}.{1}
+                WHERE id > $2
+                ORDER BY id DESC
+                LIMIT $1
+                """
+            ).format(sql.Identifier(schema), sql.Identifier(table))
+
+        writes = self.query_cache.writes()
+        last_id = cached.last_id if cached is not None else 0
+        try:
+            with self.transaction() as cursor:
+                cursor.execute_prepared("recent_{0}.{1}".format(schema, table), query, (values, last_id))
+                rows = cursor.fetchall()
+        except psycopg2.Error:
             return []
 
+        if cached is not None:
+            rows = (rows + cached.rows)[:values]
+        self.query_cache.put(key, CachedResult(unique_tag, rows, rows[0][0] if rows else last_id), writes)
+        return rows
+
+    # The (seconds since the epoch, value) stored last for a sensor, or None if there is none or the
+    # database can't be reached
+    def query_latest(self, unique_tag):
+        rows = self.query_individual_table(*unique_tag.split("."), values=1)
+        if not rows or rows[0][2] is None:
+            return None
+        return rows[0][1].timestamp(), float(rows[0][2])
+
+    # Values of several sensors between two times, aligned into packets: a list of packet timestamps in
+    # order and a dict of unique tag -> float64 array with NaN where a packet has no value of a sensor.
+    # In wide mode every row is a packet. Sensor tables written from the same packet share its timestamp,
+    # but older data was written a value per transaction, each with a timestamp of its own, so values
+    # less than DerivedAlignToleranceMS after the previous one are taken as the same packet there (see
+    # align_packets)
+    def query_aligned_values(self, cursor, unique_tags, date_lower, date_upper):
+        if self.storage_mode == "wide":
+            query = sql.SQL(
+                """
+                SELECT timestamp, {0} FROM {1}.{2}
+                WHERE timestamp >= %s AND timestamp < %s
+                ORDER BY timestamp
+                """
+            ).format(sql.SQL(", ").join(sql.SQL("{0}::double precision").format(sql.Identifier(unique_tag))
+                                        for unique_tag in unique_tags), *map(sql.Identifier, self.wide_table))
+            parameters = (date_lower, date_upper)
+        else:
+            columns = sql.SQL(", ").join(sql.SQL("max(value) FILTER (WHERE sensor = {0})").format(
+                sql.Literal(unique_tag)) for unique_tag in unique_tags)
+            sources = sql.SQL(" UNION ALL ").join(sql.SQL(
+                "SELECT {0} AS sensor, timestamp, value::double precision FROM {1}.{2} "
+                "WHERE timestamp >= %(lower)s AND timestamp < %(upper)s"
+            ).format(sql.Literal(unique_tag), *map(sql.Identifier, unique_tag.split("."))) for unique_tag in unique_tags)
+            query = sql.SQL("SELECT timestamp, {0} FROM ({1}) AS sensor_values GROUP BY timestamp ORDER BY timestamp")\
+                .format(columns, sources)
+            parameters = {"lower": date_lower, "upper": date_upper}
+
+        cursor.execute(query, parameters)
+        rows = cursor.fetchall()
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(unique_tags))
+        timestamps = [row[0] for row in rows]
+        if self.storage_mode != "wide":
+            timestamps, values = self.align_packets(timestamps, values)
+        return timestamps, {unique_tag: values[:, index] for index, unique_tag in enumerate(unique_tags)}
+
+    # Merges rows (timestamps in order, and a row of values per timestamp) less than the alignment
+    # tolerance apart into one packet, see shared/alignment.py
+    def align_packets(self, timestamps, values):
+        starts, packets = align_rows(np.array([timestamp.timestamp() for timestamp in timestamps]), values,
+                                     self.align_tolerance)
+        return [timestamp for timestamp, start in zip(timestamps, starts) if start], packets
+
+    # Replaces the values a sensor has between two times with the given ones (NaN values are left out).
+    # Timestamps are those returned by query_aligned_values. Runs in the caller's transaction
+    def replace_values(self, cursor, unique_tag, date_lower, date_upper, timestamps, values):
+        rows = [(timestamp, value) for timestamp, value in zip(timestamps, values.tolist()) if value == value]
+        # Nothing to replace them with, e.g. none of the inputs were stored; the stored values are kept
+        if not rows:
+            return
+
+        self.query_cache.invalidate(unique_tag)
+        self.rollups.invalidate(cursor, unique_tag, date_lower, date_upper)
+
+        if self.storage_mode == "wide":
+            column = sql.Identifier(unique_tag)
+            cursor.execute(sql.SQL("UPDATE {0}.{1} SET {2} = NULL WHERE timestamp >= %s AND timestamp < %s")
+                                .format(*map(sql.Identifier, self.wide_table), column), (date_lower, date_upper))
+            psycopg2.extras.execute_values(cursor, sql.SQL(
+                "UPDATE {0}.{1} AS packets SET {2} = new.value FROM (VALUES %s) AS new (timestamp, value) "
+                "WHERE packets.timestamp = new.timestamp"
+            ).format(*map(sql.Identifier, self.wide_table), column), rows, page_size=1000)
+        else:
+            schema, table = unique_tag.split(".")
+            cursor.execute(sql.SQL("DELETE FROM {0}.{1} WHERE timestamp >= %s AND timestamp < %s")
+                                .format(sql.Identifier(schema), sql.Identifier(table)), (date_lower, date_upper))
+            psycopg2.extras.execute_values(cursor, self.sensor_insert_query(unique_tag), rows, page_size=1000)
+
+    # The source of the rollups each sensor is stored in (see shared/rollups.py), by unique tag. In wide
+    # mode every sensor shares the source of the wide table
+    def rollup_sources(self):
+        if self.storage_mode == "wide":
+            source = (".".join(self.wide_table), sql.SQL("{0}.{1}").format(*map(sql.Identifier, self.wide_table)),
+                      [(unique_tag, sql.Identifier(unique_tag)) for unique_tag in self.wide_columns])
+            return {unique_tag: source for unique_tag in self.wide_columns}
+
+        return {unique_tag: (unique_tag, sql.SQL("{0}.{1}").format(*map(sql.Identifier, unique_tag.split("."))),
+                             [(unique_tag, sql.Identifier("value"))]) for unique_tag in common.cache.sensors}
+
     # Return the specified number of rows from all tables
     def query_all_tables(self, values=5):
         data = []
@@ -107,90 +274,65 @@ class DatabaseConnection:
 
         return data
 
-    # Add a row to the specified table
-    def append_value(self, schema, table, data):
-        insert_query = sql.SQL(
-            "INSERT INTO {0}.{1} (timestamp, value) VALUES (current_timestamp, %s)"
-        ).format(
+    # Composes the INSERT statements used by insert_packets once, rather than for every flush: one per
+    # sensor, or the one for the wide table. Has to be called again if the wide table settings change
+    def plan_inserts(self):
+        self.sensor_insert_queries = {unique_tag: self.sensor_insert_query(unique_tag)
+                                      for unique_tag in common.cache.sensors}
+        self.wide_insert_query = sql.SQL("INSERT INTO {0}.{1} (timestamp, {2}) VALUES %s").format(
+            *map(sql.Identifier, self.wide_table), sql.SQL(", ").join(map(sql.Identifier, self.wide_columns)))
+
+    @staticmethod
+    def sensor_insert_query(unique_tag):
+        schema, table = unique_tag.split(".")
+        return sql.SQL("INSERT INTO {0}.{1} (timestamp, value) VALUES %s").format(
             sql.Identifier(schema), sql.Identifier(table))
 
-        self.cursor.execute(insert_query, (data,))  # You have to add comma to make a tuple so don't remove it
-        self.connection.commit()
-
-    # Debug function to simulate incoming packets
-    def insert_debug_records(self):
-        for unique_tag in common.sensor_unique_tags:
-            schema, table = unique_tag.split(".")
-            rand_val = random.randrange(0, 50)
-            self.append_value(schema, table, rand_val)
-
-
-class SerialReader:
-    def __init__(self, db_conn):
-        self.unique_data_values = 6
-        self.db_conn = db_conn
-        self.client = self.db_conn.client
-        self.connection = False
-        self.serial = None
-        self.port = None
-        
-        self.attempt_serial_connection()
-
-    # Searches for and makes connection with Arduino over USB    
-    def attempt_serial_connection(self):
-        try:
-            self.port = [port for port in serial.tools.list_ports.comports() if port.serial_number ==
-                         common.SETTINGS["ArduinoUSBUID"]][0]
-            self.serial = serial.Serial(self.port.device, 9600, timeout=1)
-            common.arduino_connection_status = True
-
-        except IndexError:
-            print("Arduino not detected. Double check to see if it is connected to the USB port on the PC.")
-
-        if self.serial:
-            self.connection = True
-
-    # Check if there is any new data to be read over USB
-    def read(self):
-        packet = self.serial.readline()
-        if packet:
-            if not common.packet_received:
-                common.packet_received = True
-            self.parse_incoming_packet(packet)
-            print(packet)
-
-    # Read and parse incoming data 
-    def parse_incoming_packet(self, packet):
-        packet_str = packet.decode()
-        packet_str.replace(" ", "")
-        data = packet_str.split(",")
-
-        # Checks for corrupt (invalid length) and extraneous (debug message) packets
-        if len(data) != self.unique_data_values:
-            return
-
-        main_battery_voltage = data[0]
-        main_battery_amperage = data[1]
-        aux_battery_voltage = data[2]
-        dht11_temperature = data[3]
-        uptime = data[4]
-        rssi = data[5]
-
-        state_of_charge_main = ((float(main_battery_voltage) - 46.04) / 4.88) * 100
-        state_of_charge_aux = ((float(aux_battery_voltage) - 11.51) / 1.22) * 100
-
-        # Truncate
-        state_of_charge_main = float(int(state_of_charge_main*100)/100)
-        state_of_charge_aux = float(int(state_of_charge_aux*100)/100)
-
-        self.db_conn.append_value("main_battery", "voltage", main_battery_voltage)
-        self.db_conn.append_value("main_battery", "amperage", main_battery_amperage)
-        self.db_conn.append_value("main_battery", "amp_hours", str(state_of_charge_main))
-        #self.db_conn.append_value("aux_battery", "state_of_charge", str(state_of_charge_aux))
-        self.db_conn.append_value("aux_battery", "voltage", aux_battery_voltage)
-        self.db_conn.append_value("dht11", "temperature", dht11_temperature)
-        self.db_conn.append_value("rfm95", "rssi", rssi)
-
-        common.time_since_last_packet = 0
-        common.uptime = uptime
-
+    # Add a row to the specified table
+    def append_value(self, schema, table, data):
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        self.insert_packets([(timestamp, {".".join([schema, table]): data})])
+
+    # Write many packets as a single transaction; packets is a list of (timestamp, values) tuples, where
+    # values maps unique tags (schema.table) to readings. Each table gets one multi-row INSERT
+    def insert_packets(self, packets):
+        with self.transaction() as cursor:
+            if self.storage_mode == "wide":
+                self.insert_wide_rows(cursor, packets)
+            else:
+                self.insert_sensor_rows(cursor, packets)
+        self.note_written(packets)
+
+    # Marks the cached lookups of every sensor in the packets as needing their new rows
+    def note_written(self, packets):
+        self.query_cache.note_write({unique_tag for _, values in packets for unique_tag in values})
+
+    # One row per value, in the table of the value's sensor
+    def insert_sensor_rows(self, cursor, packets):
+        rows = {}
+        for timestamp, values in packets:
+            for unique_tag, value in values.items():
+                rows.setdefault(unique_tag, []).append((timestamp, value))
+
+        for unique_tag, table_rows in rows.items():
+            insert_query = self.sensor_insert_queries.get(unique_tag)
+            if insert_query is None:
+                insert_query = self.sensor_insert_queries[unique_tag] = self.sensor_insert_query(unique_tag)
+
+            psycopg2.extras.execute_values(cursor, insert_query, table_rows, page_size=len(table_rows))
+
+    # Alarm events (see alarms.py), as (receive time in seconds since the epoch, unique tag, previous
+    # level, level, value) tuples, in one transaction
+    def insert_alarms(self, events):
+        rows = [(datetime.datetime.fromtimestamp(received_time, datetime.timezone.utc), *event)
+                for received_time, *event in events]
+        with self.transaction() as cursor:
+            psycopg2.extras.execute_values(cursor, sql.SQL(
+                "INSERT INTO {0}.{1} (timestamp, sensor, previous_level, level, value) VALUES %s"
+            ).format(*map(sql.Identifier, self.alarm_table)), rows, page_size=len(rows))
+
+    # One row per packet in the wide table
+    def insert_wide_rows(self, cursor, packets):
+        rows = [(timestamp, *[values.get(unique_tag) for unique_tag in self.wide_columns])
+                for timestamp, values in packets]
+        psycopg2.extras.execute_values(cursor, self.wide_insert_query, rows, page_size=len(rows))
@@ -0,0 +1,197 @@
+import re
+
+import numpy as np
+
+"""
+Derived channels are values calculated from the received ones rather than sent by the car, declared in
+the Derived section of Parameters.xml. They are evaluated with NumPy over a batch of packets at a time:
+every packet read from the serial port in one go while live, or a long stretch of stored history when
+backfilling (see backfill_derived.py). Channels that depend on earlier values (integrals and rolling
+averages) carry their state over from one batch to the next, so the result doesn't depend on how the
+packets were split into batches.
+
+Every channel takes the timestamps of the batch (seconds, float64) and a dict of unique tag -> float64
+array with NaN where a packet has no value, and returns its own array.
+"""
+
+
+# Arithmetic on other sensors, e.g. "main_battery.voltage * main_battery.amperage"
+class ExpressionChannel:
+    def __init__(self, parameters, known_sensors):
+        self.sensor = parameters["sensor"]
+        self.digits = int(parameters["digits"]) if "digits" in parameters else None
+
+        # Unique tags contain a dot, so they are swapped for lookups in the columns dict before compiling.
+        # Longest first, so that a tag is never replaced inside a longer one
+        tags = sorted(known_sensors, key=len, reverse=True)
+        pattern = re.compile(r"(?<![\w.])(" + "|".join(map(re.escape, tags)) + r")(?![\w])")
+        self.sources = sorted(set(pattern.findall(parameters["expression"])))
+        self.code = compile(pattern.sub(lambda match: "columns[{0!r}]".format(match.group(1)),
+                                        parameters["expression"]), self.sensor, "eval")
+
+    def evaluate(self, timestamps, columns):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.broadcast_to(eval(self.code, {"np": np, "columns": columns}), timestamps.shape)
+
+        if self.digits is not None:
+            # Truncates rather than rounds
+            factor = 10 ** self.digits
+            values = np.trunc(values * factor) / factor
+        return np.asarray(values, dtype=np.float64)
+
+    def reset(self):
+        pass
+
+    def resume(self, stored):
+        pass
+
+
+# Running trapezoidal integral of a sensor over time since the first packet, times scale. Packets
+# without a value of the source are skipped, and so are intervals longer than max_gap seconds (if
+# given), e.g. while the car was switched off. The time of each packet is its receive time, spaced out
+# by the Arduino's uptime when several arrive in one read (see IngestEngine.packet_times)
+class IntegralChannel:
+    def __init__(self, parameters, known_sensors):
+        self.sensor = parameters["sensor"]
+        self.sources = [parameters["source"]]
+        self.scale = float(parameters.get("scale", 1))
+        self.max_gap = float(parameters["max_gap"]) if "max_gap" in parameters else None
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+        self.last_time = None
+        self.last_value = None
+
+    # Carries on from the last stored value of the channel, so that a restart doesn't set it back to 0.
+    # The interval since then is counted if the source's last value was stored from the same packet
+    def resume(self, stored):
+        last = stored(self.sensor)
+        if last is None:
+            return
+
+        self.reset()
+        self.total = last[1]
+        source = stored(self.sources[0])
+        if source is not None and source[0] == last[0]:
+            self.last_time, self.last_value = source
+
+    def evaluate(self, timestamps, columns):
+        values = columns[self.sources[0]]
+        valid = ~np.isnan(values)
+        times, samples = timestamps[valid], values[valid]
+        result = np.full(len(values), np.nan)
+        if not len(samples):
+            return result
+
+        # Prepend the last sample of the previous batch so the first interval is counted
+        if self.last_time is not None:
+            times = np.concatenate(([self.last_time], times))
+            samples = np.concatenate(([self.last_value], samples))
+            areas = np.cumsum((samples[1:] + samples[:-1]) * self.widths(times) / 2)
+        else:
+            areas = np.concatenate(([0.0], np.cumsum((samples[1:] + samples[:-1]) * self.widths(times) / 2)))
+
+        result[valid] = self.total + areas * self.scale
+        self.total = result[valid][-1]
+        self.last_time, self.last_value = times[-1], samples[-1]
+        return result
+
+    # Length of each interval between samples, 0 for the ones longer than max_gap
+    def widths(self, times):
+        widths = np.diff(times)
+        if self.max_gap is not None:
+            widths[widths > self.max_gap] = 0
+        return widths
+
+
+# Mean of a sensor over the trailing window (seconds) up to and including each packet
+class RollingAverageChannel:
+    def __init__(self, parameters, known_sensors):
+        self.sensor = parameters["sensor"]
+        self.sources = [parameters["source"]]
+        self.window = float(parameters["window"])
+        self.reset()
+
+    def reset(self):
+        # Samples of previous batches that can still fall in the window
+        self.tail_times = np.empty(0)
+        self.tail_values = np.empty(0)
+
+    def resume(self, stored):
+        pass
+
+    def evaluate(self, timestamps, columns):
+        values = columns[self.sources[0]]
+        valid = ~np.isnan(values)
+        times = np.concatenate((self.tail_times, timestamps[valid]))
+        samples = np.concatenate((self.tail_values, values[valid]))
+
+        # Window sums from a cumulative sum; the window of sample i starts at the first sample newer
+        # than times[i] - window
+        sums = np.concatenate(([0.0], np.cumsum(samples)))
+        ends = np.arange(len(self.tail_times), len(samples)) + 1
+        starts = np.searchsorted(times, times[ends - 1] - self.window, side="right")
+
+        result = np.full(len(values), np.nan)
+        result[valid] = (sums[ends] - sums[starts]) / (ends - starts)
+
+        keep = np.searchsorted(times, times[-1] - self.window, side="right") if len(times) else 0
+        self.tail_times, self.tail_values = times[keep:], samples[keep:]
+        return result
+
+
+CHANNEL_TYPES = {
+    "expression": ExpressionChannel,
+    "integral": IntegralChannel,
+    "rolling_average": RollingAverageChannel,
+}
+
+
+# Evaluates every derived channel declared in Parameters.xml, in order, so that a channel can use the
+# channels before it
+class DerivedEngine:
+    def __init__(self, derived_xml, received_sensors):
+        self.channels = []
+        known_sensors = list(received_sensors)
+        for kind, parameters in derived_xml:
+            self.channels.append(CHANNEL_TYPES[kind](parameters, known_sensors))
+            known_sensors.append(parameters["sensor"])
+
+        # Received sensors that some channel needs
+        produced = {channel.sensor for channel in self.channels}
+        self.inputs = sorted({source for channel in self.channels for source in channel.sources} - produced)
+
+    # Evaluates every channel over one batch; columns has to hold every sensor in inputs. The derived
+    # arrays are added to columns and also returned as a dict of unique tag -> array
+    def evaluate(self, timestamps, columns):
+        derived = {}
+        for channel in self.channels:
+            derived[channel.sensor] = columns[channel.sensor] = channel.evaluate(timestamps, columns)
+        return derived
+
+    # Adds the derived values to a batch of decoded packets (dicts of unique tag -> value), in place
+    def process_packets(self, timestamps, packets):
+        if not self.channels or not packets:
+            return packets
+
+        columns = {tag: np.array([packet.get(tag, np.nan) for packet in packets], dtype=np.float64)
+                   for tag in self.inputs}
+        derived = self.evaluate(np.asarray(timestamps, dtype=np.float64), columns)
+
+        for sensor, values in derived.items():
+            for packet, value in zip(packets, values.tolist()):
+                if value == value:  # Not NaN
+                    packet[sensor] = value
+        return packets
+
+    # Picks up the state of channels that carry on from their stored values (integrals) where they left
+    # off. stored(unique_tag) returns the (seconds since the epoch, value) stored last, or None
+    def resume(self, stored):
+        for channel in self.channels:
+            channel.resume(stored)
+
+    # Forgets the state carried between batches, e.g. before backfilling from the start of a range
+    def reset(self):
+        for channel in self.channels:
+            channel.reset()
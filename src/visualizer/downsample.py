@@ -0,0 +1,53 @@
+import numpy as np
+
+
+# Reduces a series to at most 2 * buckets points by keeping the lowest and highest value of each
+# bucket, in the order they occurred. Spikes survive (unlike averaging), and the extremes of the
+# output are exactly the extremes of the input
+def minmax_decimate(x, y, buckets):
+    count = len(y)
+    if buckets <= 0 or count <= 2 * buckets:
+        return x, y
+
+    # Pad with the final value so the series reshapes into equal-width buckets
+    width = -(-count // buckets)
+    padded = np.empty(buckets * width, dtype=y.dtype)
+    padded[:count] = y
+    padded[count:] = y[-1]
+    padded = padded.reshape(buckets, width)
+
+    offsets = np.arange(buckets) * width
+    lowest = np.minimum(padded.argmin(axis=1) + offsets, count - 1)
+    highest = np.minimum(padded.argmax(axis=1) + offsets, count - 1)
+
+    indices = np.sort(np.stack((lowest, highest), axis=1), axis=1).ravel()
+    return x[indices], y[indices]
+
+
+# Largest-Triangle-Three-Buckets: keeps the point in each bucket that forms the largest triangle
+# with the point kept from the previous bucket and the average of the next one. Preserves the
+# visual shape of the line with threshold points, but not necessarily its exact extremes
+def lttb(x, y, threshold):
+    count = len(y)
+    if threshold < 3 or count <= threshold:
+        return x, y
+
+    x_float = x.astype(np.float64)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = count - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x = x_float[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+
+        areas = np.abs((x_float[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x_float[previous] - x_float[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        indices[bucket + 1] = previous
+
+    return x[indices], y[indices]
@@ -0,0 +1,345 @@
+import datetime
+import threading
+import time
+
+import psycopg2
+import serial
+import serial.tools.list_ports
+
+from PySide2.QtCore import QObject, Signal
+
+import common
+from alarms import AlarmEngine
+from capture import CaptureWriter
+from derived import DerivedEngine
+from protocol import FrameDecoder
+from rollingstats import StatisticsEngine
+from spool import Spool
+from storage import StorageManager
+from utility import Parser
+
+
+# What the threaded IngestPipeline and the asyncio AsyncIngestPipeline (async_ingest.py) have in common,
+# selected with IngestEngine in settings.txt: the serial reader, the engines evaluating every packet,
+# the write-ahead spool (see spool.py) and the housekeeping the database writer does between batches
+class IngestEngine:
+    # device is the path of a serial port to use instead of looking for the Arduino, e.g. a pty. spool
+    # replaces the one configured in settings.txt
+    def __init__(self, db_conn, device=None, spool=None):
+        self.db_conn = db_conn
+        self.serial_reader = SerialReader(device)
+        self.derived_engine = DerivedEngine(Parser.parse_xml("Derived"), common.packet_layout.sensors)
+        # Integrals carry on from their stored values, like the spool from its checkpoint
+        self.derived_engine.resume(db_conn.query_latest)
+        self.alarm_engine = AlarmEngine(common.cache)
+        self.statistics_engine = StatisticsEngine(common.cache)
+        # Alarm events taken from the alarm engine that haven't been written yet
+        self.pending_alarms = []
+        self.storage_manager = StorageManager(db_conn)
+        self.next_storage_maintenance = 0
+        # Seconds between rollup updates (see shared/rollups.py), each rolling up a chunk per source at most
+        self.rollup_interval = int(common.SETTINGS["RollupIntervalSeconds"])
+        self.next_rollup_update = 0
+        self.signals = IngestSignals()
+
+        self.spool = spool or Spool(common.SETTINGS["SpoolPath"], int(common.SETTINGS["SpoolSegmentMB"]) * 1024 * 1024,
+                                    int(common.SETTINGS["SpoolMaxMB"]) * 1024 * 1024)
+        # Longest wait for a packet once the spool has been drained, packets per replayed transaction, and
+        # seconds to wait after a failed write
+        self.flush_age = int(common.SETTINGS["IngestFlushAgeMS"]) / 1000
+        self.replay_batch = int(common.SETTINGS["SpoolReplayBatch"])
+        self.retry_interval = int(common.SETTINGS["SpoolRetrySeconds"])
+        self.packets_read = 0
+        self.written = 0
+        # Receive time given to the last packet, see packet_times
+        self.last_received_time = None
+        self.running = False
+
+    # Packets waiting in the spool to be written
+    def queue_depth(self):
+        return self.spool.backlog()
+
+    def packets_written(self):
+        return self.written
+
+    # Packets dropped because the spool reached SpoolMaxMB
+    def packets_dropped(self):
+        return self.spool.dropped
+
+    # Evaluates the packets finished by one read as one batch, hands them to the GUI and appends them to
+    # the spool
+    def process_packets(self, packets):
+        received_times = self.packet_times(time.time(), self.serial_reader.packet_uptimes)
+        self.derived_engine.process_packets(received_times, packets)
+        self.alarm_engine.process_packets(received_times, packets)
+        self.statistics_engine.process_packets(received_times, packets)
+
+        for received_time, values in zip(received_times, packets):
+            self.packets_read += 1
+            self.signals.packet_parsed.emit(int(received_time * 1000), values, self.serial_reader.read_time)
+            self.spool.append(received_time, values)
+
+    # Receive times of the packets finished by a read at received_time, which all arrive at once when the
+    # reads fall behind. They are spaced out by the Arduino's uptime in each packet, counting back from the
+    # last one, so that time-weighted channels (integrals) don't depend on how the reads were chunked.
+    # The uptime is in whole seconds, so packets sent faster than that (or without one) are spread evenly
+    # since the previous read instead. Never earlier than the packets before them
+    def packet_times(self, received_time, uptimes):
+        count = len(uptimes)
+        previous = self.last_received_time
+        if None not in uptimes and all(earlier < later for earlier, later in zip(uptimes, uptimes[1:])):
+            received_times = [received_time - (uptimes[-1] - uptime) for uptime in uptimes]
+        elif previous is not None:
+            step = (received_time - previous) / count
+            received_times = [received_time - step * (count - 1 - index) for index in range(count)]
+        else:
+            received_times = [received_time] * count
+
+        if previous is not None:
+            received_times = [max(packet_time, previous) for packet_time in received_times]
+        self.last_received_time = received_times[-1]
+        return received_times
+
+    # Writes the alarm events raised since the last call. The ones that couldn't be written are kept
+    # for the next call, so they are stored late rather than lost
+    def write_alarms(self):
+        self.pending_alarms += self.alarm_engine.take_events()
+        if not self.pending_alarms:
+            return
+
+        try:
+            self.db_conn.insert_alarms(self.pending_alarms)
+            self.pending_alarms = []
+        except psycopg2.Error as error:
+            print("Failed to write alarm events, will retry. Error: ", error)
+
+    # Rolls up the rows written since the last update. Older rows that were never rolled up are taken
+    # a chunk at a time, so catching up on them doesn't hold up the writer
+    def update_rollups(self):
+        if time.monotonic() < self.next_rollup_update:
+            return
+
+        self.next_rollup_update = time.monotonic() + self.rollup_interval
+        try:
+            self.storage_manager.update_rollups(max_chunks=1)
+        except psycopg2.Error as error:
+            print("Rollup update failed, will retry. Error: ", error)
+
+    # Creates missing tables and upcoming partitions when the writer starts, and hourly after that.
+    # Runs on the writer thread so the DDL never interleaves with a flush
+    def maintain_storage(self):
+        if time.monotonic() < self.next_storage_maintenance:
+            return
+
+        try:
+            self.storage_manager.maintain()
+            self.next_storage_maintenance = time.monotonic() + StorageManager.maintenance_interval
+        except psycopg2.Error as error:
+            print("Storage maintenance failed, will retry in a minute. Error: ", error)
+            self.next_storage_maintenance = time.monotonic() + 60
+
+
+# Reads packets from the serial port on one thread and appends them to the write-ahead spool, from
+# which a second thread replays them into the database in bulk. Neither a slow serial read nor an
+# unreachable database can block the Qt event loop, and packets that can't be written yet wait in the
+# spool, across restarts if need be. Parsed values reach the GUI through a queued Qt signal
+class IngestPipeline(IngestEngine):
+    def __init__(self, db_conn, device=None, spool=None):
+        super().__init__(db_conn, device, spool)
+        self.reader_thread = threading.Thread(target=self.read_loop, name="SerialReader", daemon=True)
+        self.writer_thread = threading.Thread(target=self.write_loop, name="SpoolReplayer", daemon=True)
+
+    def start(self):
+        self.running = True
+        self.reader_thread.start()
+        self.writer_thread.start()
+
+    # Stops both threads. The replayer writes what is left in the spool first, unless the database
+    # can't be reached, in which case it is written on the next start
+    def stop(self):
+        self.running = False
+        for thread in (self.reader_thread, self.writer_thread):
+            if thread.is_alive():
+                thread.join()
+        self.spool.close()
+        self.serial_reader.close()
+
+    def read_loop(self):
+        while self.running:
+            if not self.serial_reader.connection:
+                time.sleep(SerialReader.reconnect_interval)
+                self.serial_reader.attempt_serial_connection()
+                continue
+
+            packets = self.serial_reader.read()
+            if packets:
+                self.process_packets(packets)
+
+    # Replays the spool into the database from the last checkpoint on, up to replay_batch packets per
+    # transaction, and moves the checkpoint past every batch that was committed
+    def write_loop(self):
+        position = self.spool.checkpoint
+        while True:
+            self.maintain_storage()
+            self.write_alarms()
+            self.update_rollups()
+            self.spool.sync()
+
+            packets, next_position = self.spool.read(position, self.replay_batch)
+            if not packets:
+                if not self.running:
+                    break
+                self.spool.wait(self.flush_age)
+                continue
+
+            if not self.write_packets(packets):
+                if not self.running:
+                    break
+                time.sleep(self.retry_interval)
+                continue
+
+            self.spool.commit(next_position, len(packets))
+            self.written += len(packets)
+            position = next_position
+
+            # A partial batch means the spool is drained, wait for the next packet to be appended
+            if len(packets) < self.replay_batch and self.running:
+                self.spool.wait(self.flush_age)
+
+    # A connection that broke is replaced by the pool on the next attempt
+    def write_packets(self, packets):
+        try:
+            start = time.monotonic()
+            self.db_conn.insert_packets([(datetime.datetime.fromtimestamp(received_time, datetime.timezone.utc), values)
+                                         for received_time, values in packets])
+            record_commit(packets, start)
+            return True
+
+        except psycopg2.Error as error:
+            print("Failed to write spooled packets, will retry. Error: ", error)
+            return False
+
+        finally:
+            common.database_connection_status = self.db_conn.connected()
+
+# Records how long the transaction writing packets (started at time.monotonic() start) took, and how
+# long after their receive times the packets were committed
+def record_commit(packets, start):
+    committed_time = time.time()
+    common.latency_monitor.record("insert", time.monotonic() - start)
+    common.latency_monitor.record_many("commit", [committed_time - received_time for received_time, _ in packets])
+
+
+# Signals have to belong to a QObject; emitted from the reader thread and delivered to the GUI thread
+class IngestSignals(QObject):
+    # Receive time in milliseconds since the epoch, dict of unique tag -> value, time.monotonic() of the
+    # serial read that completed the packet (see latency.py)
+    packet_parsed = Signal(object, object, object)
+
+
+class SerialReader:
+    # Seconds to wait between attempts to find the Arduino
+    reconnect_interval = 5
+
+    def __init__(self, device=None):
+        self.device = device
+        # "binary" for the framed format described in protocol.py, "ascii" for the old comma-separated lines
+        self.protocol = common.SETTINGS["SerialProtocol"]
+        self.baud_rate = int(common.SETTINGS["SerialBaudRate"])
+        self.frame_decoder = FrameDecoder(common.packet_layout)
+        # time.monotonic() of the read that completed the latest packets, and the Arduino's uptime in each
+        # of them (None if it didn't send one)
+        self.read_time = None
+        self.packet_uptimes = []
+        # ASCII lines that couldn't be parsed; the binary decoder keeps its own counts
+        self.lines_rejected = 0
+        # Records the raw bytes read for replaying later, see capture.py
+        self.capture = None
+        if common.SETTINGS["SerialCaptureFile"]:
+            self.capture = CaptureWriter(common.SETTINGS["SerialCaptureFile"], self.protocol)
+        self.connection = False
+        self.serial = None
+        self.port = None
+
+        self.attempt_serial_connection()
+
+    # Searches for and makes connection with Arduino over USB
+    def attempt_serial_connection(self):
+        try:
+            if self.device:
+                self.serial = serial.Serial(self.device, self.baud_rate, timeout=1)
+            else:
+                self.port = [port for port in serial.tools.list_ports.comports() if port.serial_number ==
+                             common.SETTINGS["ArduinoUSBUID"]][0]
+                self.serial = serial.Serial(self.port.device, self.baud_rate, timeout=1)
+            common.arduino_connection_status = True
+
+        except (IndexError, serial.SerialException):
+            print("Arduino not detected. Double check to see if it is connected to the USB port on the PC.")
+
+        if self.serial:
+            self.connection = True
+
+    # Check if there is any new data to be read over USB, returns a list with the values of every
+    # packet that was completed by it
+    def read(self):
+        try:
+            if self.protocol == "binary":
+                data = self.serial.read(self.serial.in_waiting or 1)
+            else:
+                data = self.serial.readline()
+        except serial.SerialException:
+            print("Lost connection to the Arduino.")
+            self.serial = None
+            self.connection = False
+            common.arduino_connection_status = False
+            return []
+
+        if not data:
+            return []
+        return self.decode(data, time.monotonic())
+
+    # The values of every packet completed by newly read bytes, read_time being time.monotonic() when
+    # they were read
+    def decode(self, data, read_time):
+        if not common.packet_received:
+            common.packet_received = True
+        if self.capture:
+            self.capture.write(time.time(), data)
+
+        if self.protocol == "binary":
+            packets = self.frame_decoder.feed(data)
+        else:
+            packets = [common.packet_layout.decode_ascii(data)]
+            if packets[0] is None:
+                self.lines_rejected += 1
+        packets = [values for values in packets if values is not None]
+        self.packet_uptimes = [values.get("uptime") for values in packets]
+        packets = [self.finish_packet(values) for values in packets]
+
+        if packets:
+            decoded_time = time.monotonic()
+            common.latency_monitor.record_many("decode", [decoded_time - read_time] * len(packets))
+            if common.last_packet_time:
+                # Packets completed by the same read arrived together
+                common.latency_monitor.record_many("arrival", [read_time - common.last_packet_time] +
+                                                   [0] * (len(packets) - 1))
+            common.last_packet_time = self.read_time = read_time
+        return packets
+
+    # Takes the Arduino's uptime out of a decoded packet, leaving only the values to be stored
+    def finish_packet(self, values):
+        uptime = values.pop("uptime", None)
+        if uptime is not None:
+            common.arduino_uptime = int(uptime)
+
+        return values
+
+    def close(self):
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+            self.connection = False
+        if self.capture:
+            self.capture.close()
+            self.capture = None
@@ -0,0 +1,118 @@
+import json
+import math
+import threading
+
+"""
+Latency instrumentation
+-----------------------
+
+Every packet is timed (time.monotonic()) from the moment its bytes come out of the serial port, and
+each stage it goes through records how long after that it got there:
+
+    arrival   time between consecutive packets at the serial port, i.e. what the radio delivers
+    decode    serial read -> packet decoded
+    cache     serial read -> values stored in the GUI's cache (after the hop to the GUI thread)
+    paint     serial read -> first repaint of the tree or chart after the values were shown
+    commit    serial read -> committed to the database. Packets reach the writer through the spool,
+              which only keeps their receive time, so this one is measured on the wall clock
+    insert    duration of each database transaction (one per batch, not per packet)
+    refresh   duration of each GUI refresh, i.e. how long the GUI thread is busy per refresh
+
+Durations go into log-spaced histograms (20 buckets per decade, 10 µs to 100 s), so recording is cheap
+and memory stays fixed; percentiles are accurate to about 12%. The debug panel shows p50/p95/p99 and
+the whole set can be written out as JSON (the "Dump latency" button)
+"""
+
+STAGES = ("arrival", "decode", "cache", "paint", "commit", "insert", "refresh")
+
+
+class LatencyHistogram:
+    buckets_per_decade = 20
+    lowest = 1e-5
+    decades = 7
+
+    def __init__(self):
+        self.counts = [0] * (self.buckets_per_decade * self.decades)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= self.lowest:
+            index = 0
+        else:
+            index = min(int(math.log10(seconds / self.lowest) * self.buckets_per_decade), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Upper edge of a bucket, in seconds
+    def bucket_limit(self, index):
+        return self.lowest * 10 ** ((index + 1) / self.buckets_per_decade)
+
+    # The upper edge of the bucket holding the given fraction (0-1) of the recorded durations
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_limit(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+# One histogram per stage, shared by the reader, writer and GUI threads
+class LatencyMonitor:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.histograms[stage].record(seconds)
+
+    def record_many(self, stage, durations):
+        with self.lock:
+            histogram = self.histograms[stage]
+            for seconds in durations:
+                histogram.record(seconds)
+
+    # One "stage  p50 / p95 / p99" line per stage, in milliseconds, for the debug panel
+    def report(self):
+        lines = []
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                if histogram.count:
+                    lines.append("{0:<8} {1:>8.1f} / {2:>8.1f} / {3:>8.1f}".format(
+                        stage, *(histogram.percentile(fraction) * 1000 for fraction in (0.5, 0.95, 0.99))))
+                else:
+                    lines.append("{0:<8} {1:>30}".format(stage, "-"))
+        return "\n".join(lines)
+
+    # Stage -> count, mean, p50, p95, p99 and max, in seconds
+    def summaries(self):
+        with self.lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    # Writes the summary and the raw bucket counts of every stage (durations in seconds)
+    def dump(self, path):
+        with self.lock:
+            stages = {stage: dict(histogram.summary(), buckets=[
+                [histogram.bucket_limit(index), count] for index, count in enumerate(histogram.counts) if count])
+                for stage, histogram in self.histograms.items()}
+        with open(path, "w") as file:
+            json.dump(stages, file, indent=2)
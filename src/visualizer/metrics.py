@@ -0,0 +1,184 @@
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import common
+
+"""
+Metrics endpoint
+----------------
+
+Serves the health of the ingest pipeline in the Prometheus text format on http://<MetricsHost>:<MetricsPort>/metrics,
+for dashboards on other screens than the visualizer's. The page is rendered on a thread of its own
+every MetricsRenderMS and kept as bytes, so a scrape only copies out the last rendering: it never waits
+on the Qt event loop, the database or the serial port, however often it comes. MetricsPort=0 turns the
+endpoint off. There is no authentication, so MetricsHost is the loopback interface unless set to
+0.0.0.0 (or another address) to serve other machines.
+
+    telemetry_packets_read_total, telemetry_packets_written_total     counters
+    telemetry_packets_per_second                                      packets read, over the last interval
+    telemetry_parse_failures_total, telemetry_bytes_skipped_total     rejected frames/lines, resync bytes
+    telemetry_spool_depth                                             packets waiting to be written
+    telemetry_packets_dropped_total                                   packets that didn't fit in the spool
+    telemetry_last_packet_age_seconds, telemetry_arduino_uptime_seconds
+    telemetry_rssi_dbm                                                signal strength of the last packet
+    telemetry_database_connected, telemetry_arduino_connected         1 or 0
+    telemetry_latency_seconds{stage, quantile}                        the histograms of latency.py, the
+                                                                      "insert" stage being the DB insert time
+    telemetry_sensor_value{sensor, unit}                              latest value of every sensor that has one
+    telemetry_sensor_{min, max, mean, stddev}{sensor, window}         rolling statistics (see rollingstats.py),
+                                                                      window="all" for all time
+    telemetry_sensor_rate_per_second{sensor, window}                  rate of change over each window
+    telemetry_sensor_ewma{sensor}
+"""
+
+RSSI_SENSOR = "rfm95.rssi"
+
+
+class MetricsServer:
+    def __init__(self, ingest_pipeline):
+        self.ingest_pipeline = ingest_pipeline
+        self.interval = int(common.SETTINGS["MetricsRenderMS"]) / 1000
+        self.output = b""
+
+        # For packets per second
+        self.last_render_time = None
+        self.last_packets_read = 0
+
+        self.stopping = threading.Event()
+        self.http_server = ThreadingHTTPServer((common.SETTINGS["MetricsHost"], int(common.SETTINGS["MetricsPort"])),
+                                               MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.metrics_server = self
+        self.server_thread = threading.Thread(target=self.http_server.serve_forever, name="MetricsServer", daemon=True)
+        self.render_thread = threading.Thread(target=self.render_loop, name="MetricsRenderer", daemon=True)
+
+    def start(self):
+        self.output = self.render()
+        self.server_thread.start()
+        self.render_thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def render_loop(self):
+        while not self.stopping.wait(self.interval):
+            self.output = self.render()
+
+    def render(self):
+        pipeline = self.ingest_pipeline
+        serial_reader = pipeline.serial_reader
+        now = time.monotonic()
+
+        packets_read = pipeline.packets_read
+        packets_per_second = 0.0
+        if self.last_render_time is not None and now > self.last_render_time:
+            packets_per_second = (packets_read - self.last_packets_read) / (now - self.last_render_time)
+        self.last_render_time, self.last_packets_read = now, packets_read
+
+        lines = []
+        metric(lines, "telemetry_packets_read_total", "counter", "Packets decoded from the serial port", packets_read)
+        metric(lines, "telemetry_packets_written_total", "counter", "Packets committed to the database",
+               pipeline.packets_written())
+        metric(lines, "telemetry_packets_per_second", "gauge", "Packets decoded per second", packets_per_second)
+        metric(lines, "telemetry_parse_failures_total", "counter", "Frames failing their CRC and unparseable lines",
+               serial_reader.frame_decoder.frames_rejected + serial_reader.lines_rejected)
+        metric(lines, "telemetry_bytes_skipped_total", "counter", "Bytes skipped while looking for a frame",
+               serial_reader.frame_decoder.bytes_skipped)
+        metric(lines, "telemetry_spool_depth", "gauge", "Packets waiting to be written to the database",
+               pipeline.queue_depth())
+        metric(lines, "telemetry_packets_dropped_total", "counter", "Packets dropped because the spool was full",
+               pipeline.packets_dropped())
+
+        if common.last_packet_time:
+            metric(lines, "telemetry_last_packet_age_seconds", "gauge", "Seconds since the last packet arrived",
+                   now - common.last_packet_time)
+            metric(lines, "telemetry_arduino_uptime_seconds", "gauge", "Uptime of the Arduino",
+                   common.arduino_uptime + now - common.last_packet_time)
+
+        rssi = common.cache.sensors.get(RSSI_SENSOR)
+        if rssi is not None and rssi.value != -9999:
+            metric(lines, "telemetry_rssi_dbm", "gauge", "Signal strength of the last packet", rssi.value)
+
+        metric(lines, "telemetry_database_connected", "gauge", "Whether the database can be reached",
+               int(common.database_connection_status))
+        metric(lines, "telemetry_arduino_connected", "gauge", "Whether the Arduino is connected",
+               int(common.arduino_connection_status))
+
+        lines.append("# HELP telemetry_latency_seconds Packet latency by stage, see latency.py")
+        lines.append("# TYPE telemetry_latency_seconds summary")
+        for stage, summary in common.latency_monitor.summaries().items():
+            if summary["count"]:
+                for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                    sample(lines, "telemetry_latency_seconds", summary[key], stage=stage, quantile=quantile)
+            sample(lines, "telemetry_latency_seconds_sum", summary["sum"], stage=stage)
+            sample(lines, "telemetry_latency_seconds_count", summary["count"], stage=stage)
+
+        lines.append("# HELP telemetry_sensor_value Latest value of each sensor")
+        lines.append("# TYPE telemetry_sensor_value gauge")
+        for sensor in list(common.cache.sensors.values()):
+            # -9999 means no (valid) value yet
+            if sensor.value != -9999:
+                sample(lines, "telemetry_sensor_value", sensor.value, sensor=sensor.unique_tag, unit=sensor.unit)
+
+        statistics(lines, pipeline.statistics_engine)
+        return ("\n".join(lines) + "\n").encode()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        output = self.server.metrics_server.output
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    # Scrapes come every few seconds, don't print each one
+    def log_message(self, format, *args):
+        pass
+
+
+# The rolling statistics of every sensor that has had a sample, one metric per statistic
+def statistics(lines, statistics_engine):
+    summaries = statistics_engine.summaries()
+    for name, key, description in (("min", "minimum", "Lowest value"), ("max", "maximum", "Highest value"),
+                                   ("mean", "mean", "Mean value"), ("stddev", "stddev", "Standard deviation"),
+                                   ("rate_per_second", "rate", "Rate of change")):
+        name = "telemetry_sensor_" + name
+        lines.append("# HELP {0} {1} of each sensor, over each window".format(name, description))
+        lines.append("# TYPE {0} gauge".format(name))
+        for unique_tag, summary in summaries.items():
+            if key in summary and not math.isnan(summary[key]):
+                sample(lines, name, summary[key], sensor=unique_tag, window="all")
+            for seconds, window in summary["windows"].items():
+                if window is not None and not math.isnan(window[key]):
+                    sample(lines, name, window[key], sensor=unique_tag, window="{0:g}s".format(seconds))
+
+    lines.append("# HELP telemetry_sensor_ewma Exponentially weighted moving average of each sensor")
+    lines.append("# TYPE telemetry_sensor_ewma gauge")
+    for unique_tag, summary in summaries.items():
+        sample(lines, "telemetry_sensor_ewma", summary["ewma"], sensor=unique_tag)
+
+
+def metric(lines, name, metric_type, description, value):
+    lines.append("# HELP {0} {1}".format(name, description))
+    lines.append("# TYPE {0} {1}".format(name, metric_type))
+    sample(lines, name, value)
+
+
+def sample(lines, name, value, **labels):
+    if labels:
+        name += "{" + ",".join('{0}="{1}"'.format(key, escape_label(str(label))) for key, label in labels.items()) + "}"
+    lines.append("{0} {1}".format(name, float(value)))
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,48 @@
+import argparse
+
+import psycopg2
+
+import common
+from database import DatabaseConnection
+from storage import StorageManager
+
+"""
+Converts sensor tables created with the old layout (a single heap table per sensor) into the
+partitioned layout managed by StorageManager. Each table is migrated in its own transaction, and
+tables that are already partitioned are skipped, so the tool can safely be run more than once.
+
+    python3 migrate_storage.py                        # every sensor in Parameters.xml
+    python3 migrate_storage.py main_battery.voltage   # only the given sensors
+    python3 migrate_storage.py --keep-legacy          # keep the old tables as <table>_legacy
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate sensor tables to the partitioned storage layout")
+    parser.add_argument("sensors", nargs="*", help="Unique tags (schema.table) to migrate, defaults to all sensors")
+    parser.add_argument("--keep-legacy", action="store_true", help="Keep the old tables instead of dropping them")
+    args = parser.parse_args()
+
+    db_conn = DatabaseConnection(None)
+    if not db_conn.connected():
+        print("Could not connect to the database, is Postgres running?")
+        return
+
+    storage_manager = StorageManager(db_conn)
+    for unique_tag in args.sensors or common.cache.sensors.keys():
+        schema, table = unique_tag.split(".")
+        try:
+            migrated_rows = storage_manager.migrate_table(schema, table, args.keep_legacy)
+            if migrated_rows is None:
+                print(f"{unique_tag}: already partitioned")
+            else:
+                print(f"{unique_tag}: {migrated_rows} rows migrated")
+        except psycopg2.Error as error:
+            print(f"{unique_tag}: migration failed, the table was left as it was. Error: ", error)
+
+    # Partitions for the days ahead
+    storage_manager.maintain()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import binascii
+import struct
+
+"""
+Binary serial packet format
+---------------------------
+
+The receiver forwards each radio packet over USB as one frame. All multi-byte fields are little-endian:
+
+    offset  size  field
+    0       2     sync bytes 0xAA 0x55
+    2       1     protocol version (PROTOCOL_VERSION)
+    3       1     payload length in bytes
+    4       n     records, each a 1 byte field id followed by the value, in the field's type
+    4 + n   2     CRC-16/CCITT-FALSE of the version, length and payload bytes
+
+The fields, their ids and types are declared in the Packet section of Parameters.xml (see PacketLayout).
+Bytes that are not part of a valid frame, like the debug messages the Arduino prints, are skipped until
+the next sync bytes.
+"""
+
+SYNC = b"\xaa\x55"
+PROTOCOL_VERSION = 1
+
+HEADER = struct.Struct("<2sBB")
+CRC = struct.Struct("<H")
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+# The packet layout declared in Parameters.xml, compiled once at startup. The payload the transmitter
+# normally sends (every field, in order) is unpacked with a single cached struct.Struct, and the raw
+# values are turned into a dict of unique tag -> value by a function generated for the layout, which
+# also applies each field's scale/offset. Channels calculated from the fields are left to DerivedEngine
+class PacketLayout:
+    def __init__(self, fields):
+        self.fields = fields
+
+        self.ids = tuple(int(field["id"]) for field in self.fields)
+        self.field_indices = {sensor_id: index for index, sensor_id in enumerate(self.ids)}
+        self.record_structs = {int(field["id"]): struct.Struct("<B" + field["type"]) for field in self.fields}
+        self.payload_struct = struct.Struct("<" + "".join("B" + field["type"] for field in self.fields))
+        # Unique tags of every value a packet carries
+        self.sensors = [field["sensor"] for field in self.fields]
+
+        self.convert = self.compile_converter()
+
+    # Generates convert(raw), which takes the raw values of every field in layout order and returns the
+    # packet's values, e.g. for a voltage field with a scale and a temperature field without:
+    #     def convert(raw):
+    #         return {"main_battery.voltage": raw[0] * 0.1, "dht11.temperature": raw[1]}
+    def compile_converter(self):
+        values = ["{0!r}: {1}".format(field["sensor"], self.scaled("raw[{0}]".format(index), field))
+                  for index, field in enumerate(self.fields)]
+        lines = ["def convert(raw):", "    return {" + ", ".join(values) + "}"]
+
+        namespace = {}
+        exec("\n".join(lines), namespace)
+        return namespace["convert"]
+
+    @staticmethod
+    def scaled(expression, parameters):
+        scale = float(parameters.get("scale", 1))
+        offset = float(parameters.get("offset", 0))
+        if scale != 1:
+            expression = "{0} * {1!r}".format(expression, scale)
+        if offset != 0:
+            expression = "{0} + {1!r}".format(expression, offset)
+        return expression
+
+    # Values of a binary payload, or None if it doesn't hold every field
+    def decode_payload(self, payload):
+        if len(payload) == self.payload_struct.size:
+            raw = self.payload_struct.unpack(payload)
+            if raw[0::2] == self.ids:
+                return self.convert(raw[1::2])
+
+        # Slow path for payloads with the fields in another order
+        raw = [None] * len(self.ids)
+        offset = 0
+        while offset < len(payload):
+            record_struct = self.record_structs.get(payload[offset])
+            if record_struct is None or offset + record_struct.size > len(payload):
+                return None
+            sensor_id, value = record_struct.unpack_from(payload, offset)
+            raw[self.field_indices[sensor_id]] = value
+            offset += record_struct.size
+
+        if None in raw:
+            return None
+        return self.convert(raw)
+
+    # Values of an ASCII packet (the fields as comma-separated text, in layout order), or None if it
+    # isn't one
+    def decode_ascii(self, line):
+        data = line.decode(errors="replace").split(",")
+        if len(data) != len(self.fields):
+            return None
+
+        try:
+            return self.convert([float(value) for value in data])
+        except ValueError:
+            return None
+
+    # Builds the frame for a dict of unique tag -> raw value, the same way receiver.ino does
+    def encode_frame(self, values):
+        payload = b"".join(self.record_structs[int(field["id"])].pack(int(field["id"]), values[field["sensor"]])
+                           for field in self.fields if field["sensor"] in values)
+        body = bytes([PROTOCOL_VERSION, len(payload)]) + payload
+        return SYNC + body + CRC.pack(crc16(body))
+
+
+# Incremental decoder for a stream of frames. Incoming bytes are appended to one bytearray and the
+# frames are unpacked in place with struct.unpack_from on a memoryview, without copying them out first
+class FrameDecoder:
+    def __init__(self, layout):
+        self.layout = layout
+        self.buffer = bytearray()
+        self.frames_decoded = 0
+        self.frames_rejected = 0
+        self.bytes_skipped = 0
+
+    # Adds bytes read from the serial port, and returns a dict of unique tag -> value for every
+    # complete frame they finish
+    def feed(self, data):
+        self.buffer += data
+        packets = []
+        offset = 0
+        end = len(self.buffer)
+
+        with memoryview(self.buffer) as view:
+            while True:
+                start = self.buffer.find(SYNC, offset)
+                if start == -1:
+                    # Keep a trailing first sync byte, the second one may be in the next read
+                    start = end - 1 if end > offset and self.buffer[-1] == SYNC[0] else end
+                    self.bytes_skipped += start - offset
+                    offset = start
+                    break
+                self.bytes_skipped += start - offset
+
+                if end - start < HEADER.size:
+                    offset = start
+                    break
+                _, version, length = HEADER.unpack_from(view, start)
+                frame_end = start + HEADER.size + length + CRC.size
+                if version != PROTOCOL_VERSION:
+                    self.reject(start)
+                    offset = start + 1
+                    continue
+                if end < frame_end:
+                    offset = start
+                    break
+
+                payload_end = frame_end - CRC.size
+                packet = None
+                if crc16(view[start + 2:payload_end]) == CRC.unpack_from(view, payload_end)[0]:
+                    packet = self.layout.decode_payload(view[start + HEADER.size:payload_end])
+                if packet is None:
+                    self.reject(start)
+                    offset = start + 1
+                    continue
+
+                packets.append(packet)
+                self.frames_decoded += 1
+                offset = frame_end
+
+        del self.buffer[:offset]
+        return packets
+
+    # A sync sequence that didn't start a valid frame; scanning resumes at the next byte
+    def reject(self, start):
+        self.frames_rejected += 1
+        self.bytes_skipped += 1
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# Fixed-capacity history of (timestamp, value) samples for a single sensor, preallocated as
+# NumPy arrays: int64 milliseconds since the epoch and float64 values.
+#
+# Every sample is written twice, at index i and at index i + capacity, so that the most recent
+# samples always form one contiguous slice of the arrays. That keeps appending O(1) and lets
+# last() and since() return views instead of copies. The views share memory with the buffer,
+# so copy them if they need to survive further appends
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.values = np.zeros(2 * capacity, dtype=np.float64)
+
+        # Index that the next sample will be written to, and the number of samples stored
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, value):
+        head = self.head
+        mirror = head + self.capacity
+        self.timestamps[head] = self.timestamps[mirror] = timestamp
+        self.values[head] = self.values[mirror] = value
+
+        self.head = head + 1 if head + 1 < self.capacity else 0
+        if self.size < self.capacity:
+            self.size += 1
+
+    # Most recent (timestamp, value), or None if nothing has been stored yet
+    def latest(self):
+        if not self.size:
+            return None
+
+        index = self.head - 1 + self.capacity
+        return int(self.timestamps[index]), float(self.values[index])
+
+    # Views of the n most recent timestamps and values, oldest first
+    def last(self, n=None):
+        if n is None or n > self.size:
+            n = self.size
+
+        end = self.head + self.capacity
+        return self.timestamps[end - n:end], self.values[end - n:end]
+
+    # Views of every sample with a timestamp at or after the given one, oldest first. Relies on
+    # samples being appended in time order
+    def since(self, timestamp):
+        timestamps, values = self.last()
+        start = np.searchsorted(timestamps, timestamp, side="left")
+        return timestamps[start:], values[start:]
@@ -0,0 +1,197 @@
+import collections
+import math
+import threading
+import time
+
+import common
+
+"""
+Rolling statistics
+------------------
+
+Statistics of every sensor, kept up to date as packets are decoded on the ingest reader thread, so the
+sidebar and the metrics endpoint never have to aggregate history in the database:
+
+    - all time: count, min, max, mean and standard deviation (Welford's algorithm) and an EWMA with
+      weight StatisticsEWMAAlpha on each new sample
+    - over each of the StatisticsWindows (seconds, e.g. 10,60,600): min and max (monotonic deques),
+      mean and standard deviation (Welford's algorithm, with samples taken back out as they leave the
+      window) and rate of change, from the oldest to the newest sample in the window, per second
+
+Every sample costs O(1) amortized per window: it is pushed onto the window's deques once and popped off
+at most once. -9999 (no valid reading) is left out. A window only moves on with new samples and when its
+statistics are read, so a sensor that stopped reporting shows an empty window rather than stale values.
+"""
+
+
+# Mean and sum of squared differences from it, of a set of samples that can be added to and removed from
+class Welford:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        self.count -= 1
+        if self.count == 0:
+            # Also drops the rounding error that removing samples accumulates
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    # Sample standard deviation, NaN under two samples
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+# The samples of the last `seconds` seconds
+class WindowStatistics:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = collections.deque()
+        self.welford = Welford()
+        # (time, value) with decreasing values for the maximum and increasing ones for the minimum; the
+        # first one is the extreme of the window
+        self.maxima = collections.deque()
+        self.minima = collections.deque()
+
+    def add(self, timestamp, value):
+        self.samples.append((timestamp, value))
+        self.welford.add(value)
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((timestamp, value))
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((timestamp, value))
+        self.expire(timestamp)
+
+    # Drops the samples that are out of the window at the given time
+    def expire(self, now):
+        cutoff = now - self.seconds
+        while self.samples and self.samples[0][0] <= cutoff:
+            self.welford.remove(self.samples.popleft()[1])
+        while self.maxima and self.maxima[0][0] <= cutoff:
+            self.maxima.popleft()
+        while self.minima and self.minima[0][0] <= cutoff:
+            self.minima.popleft()
+
+    def summary(self):
+        if not self.samples:
+            return None
+
+        (first_time, first_value), (last_time, last_value) = self.samples[0], self.samples[-1]
+        return {
+            "count": self.welford.count,
+            "minimum": self.minima[0][1],
+            "maximum": self.maxima[0][1],
+            "mean": self.welford.mean,
+            "stddev": self.welford.stddev(),
+            "rate": (last_value - first_value) / (last_time - first_time) if last_time > first_time else math.nan,
+        }
+
+
+class SensorStatistics:
+    def __init__(self, windows, ewma_alpha):
+        self.welford = Welford()
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.ewma_alpha = ewma_alpha
+        self.ewma = None
+        self.windows = [WindowStatistics(seconds) for seconds in windows]
+
+    def add(self, timestamp, value):
+        self.welford.add(value)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.ewma = value if self.ewma is None else self.ewma + self.ewma_alpha * (value - self.ewma)
+        for window in self.windows:
+            window.add(timestamp, value)
+
+    # None until the first sample
+    def summary(self, now):
+        if self.ewma is None:
+            return None
+
+        windows = {}
+        for window in self.windows:
+            window.expire(now)
+            windows[window.seconds] = window.summary()
+        return {
+            "count": self.welford.count,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "mean": self.welford.mean,
+            "stddev": self.welford.stddev(),
+            "ewma": self.ewma,
+            "windows": windows,
+        }
+
+
+class StatisticsEngine:
+    def __init__(self, cache):
+        self.windows = [float(seconds) for seconds in common.SETTINGS["StatisticsWindows"].split(",")]
+        ewma_alpha = float(common.SETTINGS["StatisticsEWMAAlpha"])
+        self.statistics = {sensor.unique_tag: SensorStatistics(self.windows, ewma_alpha)
+                           for sensor in cache.sensor_list}
+
+        # Updated from the ingest reader thread, read from the GUI and the metrics renderer
+        self.lock = threading.Lock()
+
+    # Adds a batch of decoded packets (dicts of unique tag -> value) received at the given times
+    # (seconds since the epoch), in order
+    def process_packets(self, timestamps, packets):
+        with self.lock:
+            for timestamp, values in zip(timestamps, packets):
+                for unique_tag, value in values.items():
+                    statistics = self.statistics.get(unique_tag)
+                    if statistics is not None and value != -9999 and not math.isnan(value):
+                        statistics.add(timestamp, value)
+
+    # The statistics of a sensor (see SensorStatistics.summary), windows keyed by their length in seconds
+    def summary(self, unique_tag):
+        with self.lock:
+            return self.statistics[unique_tag].summary(time.time())
+
+    # The statistics of a sensor as text for the sidebar, one line per window and one for all time
+    def report(self, unique_tag):
+        summary = self.summary(unique_tag)
+        if summary is None:
+            return "N/A"
+
+        lines = ["{0:<7} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9}".format("", "min", "mean", "max", "stddev", "rate/s")]
+        for seconds, window in summary["windows"].items():
+            if window is None:
+                lines.append("{0:<7} {1:>49}".format(window_label(seconds), "-"))
+            else:
+                lines.append("{0:<7} {1:>9.4g} {2:>9.4g} {3:>9.4g} {4:>9.4g} {5:>9.4g}".format(
+                    window_label(seconds), window["minimum"], window["mean"], window["maximum"], window["stddev"],
+                    window["rate"]))
+        lines.append("{0:<7} {1:>9.4g} {2:>9.4g} {3:>9.4g} {4:>9.4g}".format(
+            "all", summary["minimum"], summary["mean"], summary["maximum"], summary["stddev"]))
+        lines.append("{0:<7} {1:>9.4g}".format("EWMA", summary["ewma"]))
+        return "\n".join(lines)
+
+    # The statistics of every sensor that has had a sample, by unique tag
+    def summaries(self):
+        now = time.time()
+        with self.lock:
+            summaries = {unique_tag: statistics.summary(now) for unique_tag, statistics in self.statistics.items()}
+        return {unique_tag: summary for unique_tag, summary in summaries.items() if summary is not None}
+
+
+# "10 s", "1 min", "10 min" or "1 h"
+def window_label(seconds):
+    if seconds >= 3600 and seconds % 3600 == 0:
+        return "{0:g} h".format(seconds / 3600)
+    if seconds >= 60 and seconds % 60 == 0:
+        return "{0:g} min".format(seconds / 60)
+    return "{0:g} s".format(seconds)
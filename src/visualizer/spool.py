@@ -0,0 +1,221 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+"""
+Write-ahead spool
+-----------------
+
+Every packet is appended to the spool before anything is sent to the database, and a replayer writes
+it from there into Postgres in bulk, so an unreachable database only makes the spool grow instead of
+losing data or stalling the serial reader. The spool is a directory of fixed-size, memory-mapped
+segment files (segment_00000001.spool, ...), each holding a sequence of records:
+
+    offset  size  field
+    0       4     payload length, 0 marks the end of the written part of the segment
+    4       4     CRC-32 of the payload
+    8       n     payload: receive time (float64), value count (uint16), then per value the unique
+                  tag (uint8 length + UTF-8) and the value (float64)
+
+The file "checkpoint" holds the position (segment, offset) up to which everything has been committed
+to the database. It is replaced atomically after every commit, and segments before it are deleted. On
+startup, writing resumes after the last record with a valid CRC, and replaying resumes at the
+checkpoint, so packets that weren't committed before a crash or restart are written on the next run.
+Appending only copies into the mapped pages; the replayer has them flushed to disk (msync) every time
+it wakes up.
+
+The spool can be capped at a number of bytes (SpoolMaxMB), for when the database stays unreachable
+long enough to fill the disk. Once the segments not yet committed reach the cap, new packets are
+dropped and counted rather than appended, so what was spooled first still gets written.
+"""
+
+RECORD_HEADER = struct.Struct("<II")
+PACKET_HEADER = struct.Struct("<dH")
+VALUE = struct.Struct("<d")
+
+
+class Spool:
+    # max_size is in bytes, 0 for no limit
+    def __init__(self, path, segment_size, max_size=0):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max(max_size // segment_size, 1) if max_size else 0
+        os.makedirs(path, exist_ok=True)
+
+        # Guards the write position and counters, which the reader and replayer threads share
+        self.lock = threading.Condition()
+        self.tag_prefixes = {}
+        self.segments = {}
+
+        self.checkpoint = self.load_checkpoint()
+        self.backlog_count = 0
+        # Packets that didn't fit under max_size
+        self.dropped = 0
+        self.write_segment, self.write_offset = self.checkpoint
+        self.recover()
+
+    # ===== Writing =====
+
+    # Returns False if the packet was dropped because the spool is full
+    def append(self, timestamp, values):
+        payload = [PACKET_HEADER.pack(timestamp, len(values))]
+        for unique_tag, value in values.items():
+            payload.append(self.tag_prefix(unique_tag))
+            payload.append(VALUE.pack(value))
+        payload = b"".join(payload)
+
+        with self.lock:
+            size = RECORD_HEADER.size + len(payload)
+            if self.write_offset + size > self.segment_size:
+                if self.max_segments and self.write_segment + 1 - self.checkpoint[0] >= self.max_segments:
+                    self.dropped += 1
+                    return False
+                self.write_segment += 1
+                self.write_offset = 0
+            segment = self.segment(self.write_segment)
+
+            # The payload goes in before the header, so a record is never seen with a valid length and
+            # a missing payload
+            segment[self.write_offset + RECORD_HEADER.size:self.write_offset + size] = payload
+            RECORD_HEADER.pack_into(segment, self.write_offset, len(payload), zlib.crc32(payload))
+            self.write_offset += size
+            self.backlog_count += 1
+            self.lock.notify_all()
+        return True
+
+    def tag_prefix(self, unique_tag):
+        prefix = self.tag_prefixes.get(unique_tag)
+        if prefix is None:
+            encoded = unique_tag.encode()
+            prefix = self.tag_prefixes[unique_tag] = bytes([len(encoded)]) + encoded
+        return prefix
+
+    # ===== Replaying =====
+
+    # Returns up to max_packets (timestamp, values) packets starting at position, and the position
+    # after the last one. Positions are (segment, offset) tuples; start at self.checkpoint
+    def read(self, position, max_packets):
+        with self.lock:
+            end = (self.write_segment, self.write_offset)
+
+        packets = []
+        segment_number, offset = position
+        while len(packets) < max_packets and (segment_number, offset) < end:
+            segment = self.segment(segment_number)
+            record = self.read_record(segment, offset)
+            if record is None:
+                # Nothing more in this segment, the writer moved on to the next one
+                segment_number, offset = segment_number + 1, 0
+                continue
+
+            packet, offset = record
+            packets.append(packet)
+
+        return packets, (segment_number, offset)
+
+    # Decodes the record at offset, returning (packet, next offset), or None at the end of the written
+    # part of the segment or at a record that was torn by a crash
+    def read_record(self, segment, offset):
+        if offset + RECORD_HEADER.size > len(segment):
+            return None
+        length, crc = RECORD_HEADER.unpack_from(segment, offset)
+        start, end = offset + RECORD_HEADER.size, offset + RECORD_HEADER.size + length
+        if length == 0 or end > len(segment) or zlib.crc32(segment[start:end]) != crc:
+            return None
+
+        timestamp, count = PACKET_HEADER.unpack_from(segment, start)
+        values = {}
+        cursor = start + PACKET_HEADER.size
+        for _ in range(count):
+            tag_length = segment[cursor]
+            unique_tag = segment[cursor + 1:cursor + 1 + tag_length].decode()
+            cursor += 1 + tag_length
+            values[unique_tag] = VALUE.unpack_from(segment, cursor)[0]
+            cursor += VALUE.size
+
+        return (timestamp, values), end
+
+    # Records that everything before position, count packets, is in the database
+    def commit(self, position, count):
+        checkpoint_path = os.path.join(self.path, "checkpoint")
+        with open(checkpoint_path + ".tmp", "w") as file:
+            file.write("{0} {1}\n".format(*position))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+        with self.lock:
+            self.checkpoint = position
+            self.backlog_count -= count
+            for segment_number in [number for number in self.segments if number < position[0]]:
+                self.segments.pop(segment_number).close()
+                os.remove(self.segment_path(segment_number))
+
+    # Packets appended but not committed yet
+    def backlog(self):
+        return self.backlog_count
+
+    # Blocks until a packet is appended or the timeout (seconds) runs out
+    def wait(self, timeout):
+        with self.lock:
+            self.lock.wait(timeout)
+
+    # Flushes the mapped segments to disk
+    def sync(self):
+        with self.lock:
+            segments = list(self.segments.values())
+        for segment in segments:
+            segment.flush()
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+
+    # ===== Files =====
+
+    def segment_path(self, segment_number):
+        return os.path.join(self.path, "segment_{0:08d}.spool".format(segment_number))
+
+    # The memory map of a segment, creating the (zero-filled) file if it doesn't exist yet
+    def segment(self, segment_number):
+        with self.lock:
+            segment = self.segments.get(segment_number)
+            if segment is None:
+                with open(self.segment_path(segment_number), "a+b") as file:
+                    if os.fstat(file.fileno()).st_size < self.segment_size:
+                        file.truncate(self.segment_size)
+                    segment = self.segments[segment_number] = mmap.mmap(file.fileno(), self.segment_size)
+            return segment
+
+    def load_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, "checkpoint")) as file:
+                segment_number, offset = file.read().split()
+                return int(segment_number), int(offset)
+        except FileNotFoundError:
+            segments = sorted(int(name[8:16]) for name in os.listdir(self.path) if name.startswith("segment_"))
+            return (segments[0] if segments else 1), 0
+
+    # Finds where writing left off: after the last valid record from the checkpoint on. Anything after
+    # it (a record torn by a crash) is zeroed, so it can't be mistaken for a record later
+    def recover(self):
+        segment_number, offset = self.checkpoint
+        last_segment = max([int(name[8:16]) for name in os.listdir(self.path) if name.startswith("segment_")] +
+                           [segment_number])
+        while True:
+            record = self.read_record(self.segment(segment_number), offset)
+            if record is not None:
+                offset = record[1]
+                self.backlog_count += 1
+            elif segment_number < last_segment:
+                segment_number, offset = segment_number + 1, 0
+            else:
+                break
+
+        self.write_segment, self.write_offset = segment_number, offset
+        self.segment(segment_number)[offset:] = bytes(self.segment_size - offset)
@@ -0,0 +1,205 @@
+import datetime
+
+import psycopg2.sql as sql
+
+import common
+
+
+# Creates and maintains the tables that sensor data is stored in. Every sensor table is partitioned
+# by day on its timestamp, so that a query over a time range only has to scan the partitions
+# covering that range, and each partition has a (by default BRIN) index on the timestamp. Rows
+# falling outside every daily partition end up in a default partition until their day is created.
+# In wide mode the same applies to the single packet table instead of the sensor tables. The table
+# of alarm events (see alarms.py) and the rollups (see shared/rollups.py) are created here as well
+class StorageManager:
+    # Seconds between runs of maintain() by the ingest writer
+    maintenance_interval = 3600
+
+    def __init__(self, db_conn):
+        self.db_conn = db_conn
+        # Number of days of partitions to keep created in advance
+        self.partitions_ahead = int(common.SETTINGS["StoragePartitionsAhead"])
+        # "brin" is a fraction of the size of "btree" and suits rows that arrive in time order
+        self.index_method = common.SETTINGS["StorageTimestampIndex"]
+
+    # Makes sure that the table of every sensor in Parameters.xml exists, and that partitions exist
+    # from today up to the configured number of days ahead
+    def maintain(self):
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        last_day = today + datetime.timedelta(days=self.partitions_ahead)
+        with self.db_conn.transaction() as cursor:
+            self.create_alarm_table(cursor, *self.db_conn.alarm_table)
+            self.db_conn.rollups.create_tables(cursor)
+
+            if self.db_conn.storage_mode == "wide":
+                schema, table = self.db_conn.wide_table
+                self.create_table(cursor, schema, table,
+                                  [(column, "double precision") for column in self.db_conn.wide_columns])
+                self.create_partitions(cursor, schema, table, today, last_day)
+
+            else:
+                for sensor in common.cache.sensors.values():
+                    self.create_table(cursor, sensor.parent_tag, sensor.tag)
+
+                    if self.is_partitioned(cursor, sensor.parent_tag, sensor.tag):
+                        self.create_partitions(cursor, sensor.parent_tag, sensor.tag, today, last_day)
+                    else:
+                        print(f"{sensor.unique_tag} uses the old unpartitioned layout, "
+                              f"run migrate_storage.py to convert it.")
+
+    # Rebuilds the invalidated rollups, then rolls up the rows written since the last call, in chunks of
+    # their own transaction, at most max_chunks chunks per source (no limit if None). Returns the number
+    # of rows rolled up, 0 once every source has caught up
+    def update_rollups(self, max_chunks=None):
+        rollups = self.db_conn.rollups
+        sources = self.db_conn.rollup_sources()
+        with self.db_conn.transaction() as cursor:
+            rollups.rebuild_invalidated(cursor, sources)
+
+        rows = 0
+        # In wide mode every sensor has the same source
+        for source in {source[0]: source for source in sources.values()}.values():
+            chunks = 0
+            while max_chunks is None or chunks < max_chunks:
+                with self.db_conn.transaction() as cursor:
+                    chunk_rows = rollups.update_chunk(cursor, source)
+                if not chunk_rows:
+                    break
+                rows += chunk_rows
+                chunks += 1
+        return rows
+
+    # Creates a partitioned table with an id, a timestamp and the given (name, type) value columns,
+    # which default to the single "value" column of a sensor table. Columns missing from an existing
+    # table are added, e.g. when a sensor is added to Parameters.xml in wide mode. Like the other
+    # methods taking a cursor, runs in the caller's transaction
+    def create_table(self, cursor, schema, table, columns=(("value", "numeric"),)):
+        cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {0}").format(sql.Identifier(schema)))
+        cursor.execute(sql.SQL(
+            """
+            CREATE TABLE IF NOT EXISTS {0}.{1} (
+                id bigserial,
+                timestamp timestamp with time zone NOT NULL,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+            """
+        ).format(sql.Identifier(schema), sql.Identifier(table)))
+
+        # Nothing else happens for tables that still use the old layout
+        if not self.is_partitioned(cursor, schema, table):
+            return
+
+        for column, column_type in columns:
+            cursor.execute(sql.SQL("ALTER TABLE {0}.{1} ADD COLUMN IF NOT EXISTS {2} {3}").format(
+                sql.Identifier(schema), sql.Identifier(table), sql.Identifier(column), sql.SQL(column_type)))
+
+        cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {0}.{1} PARTITION OF {0}.{2} DEFAULT").format(
+            sql.Identifier(schema), sql.Identifier(table + "_default"), sql.Identifier(table)))
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {0} ON {1}.{2} USING {3} (timestamp)").format(
+            sql.Identifier(table + "_timestamp_idx"), sql.Identifier(schema), sql.Identifier(table),
+            sql.SQL(self.index_method)))
+
+    # Alarm events are few, so their table isn't partitioned. Looked up by sensor and time range, or
+    # just by time range
+    def create_alarm_table(self, cursor, schema, table):
+        cursor.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {0}").format(sql.Identifier(schema)))
+        cursor.execute(sql.SQL(
+            """
+            CREATE TABLE IF NOT EXISTS {0}.{1} (
+                id bigserial PRIMARY KEY,
+                timestamp timestamp with time zone NOT NULL,
+                sensor text NOT NULL,
+                previous_level smallint NOT NULL,
+                level smallint NOT NULL,
+                value double precision
+            )
+            """
+        ).format(sql.Identifier(schema), sql.Identifier(table)))
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {0} ON {1}.{2} (sensor, timestamp)").format(
+            sql.Identifier(table + "_sensor_timestamp_idx"), sql.Identifier(schema), sql.Identifier(table)))
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {0} ON {1}.{2} (timestamp)").format(
+            sql.Identifier(table + "_timestamp_idx"), sql.Identifier(schema), sql.Identifier(table)))
+
+    def is_partitioned(self, cursor, schema, table):
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                       (self.qualified_name(cursor, schema, table),))
+        result = cursor.fetchone()
+        return result is not None and result[0] == "p"
+
+    # Creates the daily partitions from first_day to last_day (inclusive) that do not exist yet.
+    # Any rows for those days that had landed in the default partition are moved into the new one
+    def create_partitions(self, cursor, schema, table, first_day, last_day):
+        day = first_day
+        while day <= last_day:
+            partition = "{0}_p{1}".format(table, day.strftime("%Y%m%d"))
+            cursor.execute("SELECT to_regclass(%s)", (self.qualified_name(cursor, schema, partition),))
+
+            if cursor.fetchone()[0] is None:
+                lower = datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc)
+                upper = lower + datetime.timedelta(days=1)
+                identifiers = {"schema": sql.Identifier(schema), "table": sql.Identifier(table),
+                               "partition": sql.Identifier(partition),
+                               "default": sql.Identifier(table + "_default")}
+
+                cursor.execute(sql.SQL(
+                    "CREATE TABLE {schema}.{partition} (LIKE {schema}.{table} INCLUDING DEFAULTS)"
+                ).format(**identifiers))
+                cursor.execute(sql.SQL(
+                    """
+                    WITH moved AS (
+                        DELETE FROM {schema}.{default} WHERE timestamp >= %s AND timestamp < %s RETURNING *
+                    )
+                    INSERT INTO {schema}.{partition} SELECT * FROM moved
+                    """
+                ).format(**identifiers), (lower, upper))
+                cursor.execute(sql.SQL(
+                    "ALTER TABLE {schema}.{table} ATTACH PARTITION {schema}.{partition} FOR VALUES FROM (%s) TO (%s)"
+                ).format(**identifiers), (lower, upper))
+
+            day += datetime.timedelta(days=1)
+
+    # Converts a table using the old single-heap layout into a partitioned one, copying every row
+    # (ids included) across. Runs as one transaction, so a failure leaves the old table untouched.
+    # Returns the number of rows copied, or None if the table was already partitioned
+    def migrate_table(self, schema, table, keep_legacy=False):
+        legacy = table + "_legacy"
+        with self.db_conn.transaction() as cursor:
+            if self.is_partitioned(cursor, schema, table):
+                return None
+
+            cursor.execute(sql.SQL("ALTER TABLE {0}.{1} RENAME TO {2}").format(
+                sql.Identifier(schema), sql.Identifier(table), sql.Identifier(legacy)))
+            # Index names are unique per schema, so the old primary key would clash with the new one
+            cursor.execute(sql.SQL("ALTER INDEX IF EXISTS {0}.{1} RENAME TO {2}").format(
+                sql.Identifier(schema), sql.Identifier(table + "_pkey"), sql.Identifier(legacy + "_pkey")))
+
+            self.create_table(cursor, schema, table)
+
+            cursor.execute(sql.SQL("SELECT min(timestamp), max(timestamp), max(id) FROM {0}.{1}").format(
+                sql.Identifier(schema), sql.Identifier(legacy)))
+            first_timestamp, last_timestamp, last_id = cursor.fetchone()
+            if first_timestamp is not None:
+                self.create_partitions(cursor, schema, table,
+                                       first_timestamp.astimezone(datetime.timezone.utc).date(),
+                                       last_timestamp.astimezone(datetime.timezone.utc).date())
+
+            # Rows without a timestamp can't be placed in a partition
+            cursor.execute(sql.SQL(
+                "INSERT INTO {0}.{1} (id, timestamp, value) SELECT id, timestamp, value FROM {0}.{2} "
+                "WHERE timestamp IS NOT NULL"
+            ).format(sql.Identifier(schema), sql.Identifier(table), sql.Identifier(legacy)))
+            migrated_rows = cursor.rowcount
+
+            if last_id is not None:
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)",
+                               (self.qualified_name(cursor, schema, table), last_id))
+
+            if not keep_legacy:
+                cursor.execute(sql.SQL("DROP TABLE {0}.{1}").format(sql.Identifier(schema), sql.Identifier(legacy)))
+
+        return migrated_rows
+
+    # Quoted schema.table name, as accepted by to_regclass and friends
+    @staticmethod
+    def qualified_name(cursor, schema, table):
+        return sql.SQL("{0}.{1}").format(sql.Identifier(schema), sql.Identifier(table)).as_string(cursor)
@@ -1,15 +1,19 @@
+import os
+import sys
 import time
-import random
 
-from PySide2.QtUiTools import QUiLoader
-from PySide2.QtCore import Qt, QTimer
-from PySide2.QtWidgets import QTreeWidget, QTreeWidgetItem, QLabel, QWidget, QVBoxLayout,\
-    QGraphicsView, QVBoxLayout, QFrame
-from PySide2.QtCharts import QtCharts
-import PySide2.QtCore as QtCore
+from PySide2.QtCore import Qt, QTimer, QObject, QEvent
+from PySide2.QtWidgets import QTreeWidget, QTreeWidgetItem, QLabel, QWidget, QVBoxLayout, QFrame, QPushButton
 
 import common
 
+# The startup caches are shared with dbtools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from startup import load_ui
+
+# Text of the status column for each of the statuses in common.py
+STATUS_LABELS = ("Operational", "Warning", "Critical", "Error")
+
 
 class UserInterface:
     def __init__(self, client):
@@ -19,14 +23,22 @@ class UserInterface:
         self.refresh_timer = QTimer()
         self.refresh_timer_interval = 1000
 
+        # Serial read times (see latency.py) of the packets received since the last refresh, and of the
+        # packets refreshed but not painted yet
+        self.unrefreshed_read_times = []
+        self.unpainted_read_times = []
+
         self.find_gui_elements()
         self.connect_signal_methods()
         self.initialize_module_tree(common.cache.modules.values())
  
+        self.paint_watcher = PaintWatcher(self)
+        self.module_tree_widget.viewport().installEventFilter(self.paint_watcher)
+
         # The QChart that will allow for data visualization at the bottom of the window
-        # (previously Matplotlib)
+        # (previously Matplotlib). Created once the window is on screen, see charts.py
         self.active_chart = None
-        self.create_chart()
+        QTimer.singleShot(0, self.create_chart)
 
         self.refresh_timer.start(self.refresh_timer_interval)
         self.main_window.show()
@@ -37,13 +49,16 @@ class UserInterface:
 
     # Gets reference to GUI items from main_window.ui so that they can be manipulated programmatically
     def find_gui_elements(self):
-        loader = QUiLoader()
-        self.main_window = loader.load("main_window.ui")
+        # Built by the compiled version of main_window.ui, see shared/startup.py
+        self.main_window = load_ui("main_window.ui")
         self.uptime_widget = self.main_window.findChild(QLabel, "uptime")
         self.database_status_widget = self.main_window.findChild(QLabel, "database_status")
         self.arduino_status_widget = self.main_window.findChild(QLabel, "arduino_status")
         self.uptime_widget = self.main_window.findChild(QLabel, "uptime")
         self.packet_time_widget = self.main_window.findChild(QLabel, "packet_time")
+        self.ingest_queue_widget = self.main_window.findChild(QLabel, "ingest_queue")
+        self.latency_widget = self.main_window.findChild(QLabel, "latency_stats")
+        self.dump_latency_button = self.main_window.findChild(QPushButton, "dump_latency")
         self.module_tree_widget = self.main_window.findChild(QTreeWidget, "module_tree")
         self.chart_frame = self.main_window.findChild(QFrame, "chart_frame")
         self.sensor_detail_label = self.main_window.findChild(QLabel, "sensor_label")
@@ -55,11 +70,15 @@ class UserInterface:
         self.sensor_detail_upper_critical_bound = self.main_window.findChild(QLabel, "sensor_ucb")
         self.sensor_detail_max = self.main_window.findChild(QLabel, "sensor_max")
         self.sensor_detail_min = self.main_window.findChild(QLabel, "sensor_min")
+        self.sensor_detail_statistics = self.main_window.findChild(QLabel, "sensor_statistics")
 
     # Connect Qt signals to relevant application methods
     def connect_signal_methods(self):
         self.refresh_timer.timeout.connect(self.refresh_gui)
         self.module_tree_widget.itemSelectionChanged.connect(self.update_sidebar)
+        self.dump_latency_button.clicked.connect(self.dump_latency)
+        # Emitted from the serial reader thread, so the connection has to be queued
+        self.client.ingest_pipeline.signals.packet_parsed.connect(self.receive_packet, Qt.QueuedConnection)
 
     # Sets up the initial data and dimensions of the QTreeWidget for displaying module and sensor data
     def initialize_module_tree(self, module_data):
@@ -71,7 +90,7 @@ class UserInterface:
         # Create a new blank root tree item for each module that acts as a container for sensor sub-items
         for module in module_data:
             self.create_tree_item(module)
-        self.update_module_tree(module_data)
+        self.update_module_tree(common.cache.sensors.values())
 
     def create_tree_item(self, module):
         tree_item = QTreeWidgetItemWrapper([module.label, "", "", "", ""])
@@ -88,8 +107,11 @@ class UserInterface:
         parent_item.addChild(sub_tree_item)
 
     def create_chart(self, chart_type="line"):
+        from charts import LineChart, GaugeChart
+
         if chart_type == "line":
             self.active_chart = LineChart(self.chart_frame)
+            self.active_chart.chart_view.viewport().installEventFilter(self.paint_watcher)
 
         elif chart_type == "gauge":
             self.active_chart = GaugeChart(self.chart_frame)
@@ -98,42 +120,74 @@ class UserInterface:
     # ~~~ Methods for updating GUI ~~~
     # ================================
 
+    # Stores the values of a newly parsed packet in the cache, to be shown on the next refresh
+    def receive_packet(self, received_time, values, read_time):
+        for unique_tag, value in values.items():
+            sensor = common.cache.sensors.get(unique_tag)
+            if sensor:
+                sensor.update_data_reading(received_time, value)
+
+        common.latency_monitor.record("cache", time.monotonic() - read_time)
+        self.unrefreshed_read_times.append(read_time)
+
     # Updates each of the individual active gui elements
     def refresh_gui(self):
-        self.update_module_tree(common.cache.modules.values())
+        start = time.monotonic()
+        self.update_module_tree(common.cache.refresh(self.client.ingest_pipeline.alarm_engine.levels))
         self.update_sidebar()
-        self.active_chart.update(None)
+        if self.active_chart:
+            self.active_chart.update(self.selected_sensor())
+
+        # Shown on the next paint; if nothing gets painted for a while only the oldest are kept
+        self.unpainted_read_times = (self.unpainted_read_times + self.unrefreshed_read_times)[:100000]
+        self.unrefreshed_read_times = []
+        common.latency_monitor.record("refresh", time.monotonic() - start)
+
+    # Called by the PaintWatcher when the tree or the chart is repainted
+    def painted(self):
+        if self.unpainted_read_times:
+            painted_time = time.monotonic()
+            common.latency_monitor.record_many("paint", [painted_time - read_time
+                                                         for read_time in self.unpainted_read_times])
+            self.unpainted_read_times = []
+
+    def dump_latency(self):
+        common.latency_monitor.dump(common.SETTINGS["LatencyDumpPath"])
+        print("Latency histograms written to", common.SETTINGS["LatencyDumpPath"])
+
+    # Only sensors that received a new reading since the last refresh are looked at, and only the cells
+    # whose text or color actually changed are handed to Qt
+    def update_module_tree(self, sensors):
+        # Hold off repainting until every changed cell has been set, so the tree redraws once per refresh
+        self.module_tree_widget.setUpdatesEnabled(False)
+
+        for sensor in sensors:
+            tree_item = sensor.gui_reference
+            if tree_item.rendered_version == sensor.version:
+                continue
+            tree_item.rendered_version = sensor.version
 
-    def update_module_tree(self, module_data):
-        for module in module_data:
             # Update each column (except the label column) for each sensor(row) with relevant data
-            # -9999 signifies an error
-            for sensor in module.sensors:
-                str_value = "{0} {1}".format(sensor.value, sensor.unit)
-                sensor.determine_value_color()
-                str_color = sensor.value_color
-
-                # Most recent value column
-                if sensor.value == -9999:
-                    sensor.gui_reference.setData(1, Qt.ItemDataRole.DisplayRole, str_value)
-                    sensor.gui_reference.setBackground(1, Qt.white)
-                else:
-                    sensor.gui_reference.setData(1, Qt.ItemDataRole.DisplayRole, str_value)
-                    sensor.gui_reference.setBackground(1, str_color)
-
-                # Lowest recorded value column
-                if sensor.value <= sensor.lowest_recorded_value and sensor.value != -9999:
-                    sensor.gui_reference.setData(2, Qt.ItemDataRole.DisplayRole, str_value)
-
-                # Highest recorded value column
-                if sensor.value >= sensor.highest_recorded_value:
-                    sensor.gui_reference.setData(3, Qt.ItemDataRole.DisplayRole, str_value)
-
-                # Status column
-                if sensor.value != -9999:
-                    sensor.gui_reference.setData(4, Qt.ItemDataRole.DisplayRole, "Operational")
-                else:
-                    sensor.gui_reference.setData(4, Qt.ItemDataRole.DisplayRole, "Error")
+            # -9999 signifies an error. The colors were worked out for every sensor at once by
+            # Cache.refresh()
+            value = sensor.value
+
+            # Most recent value column
+            str_value = "{0} {1}".format(value, sensor.unit)
+            if value == -9999:
+                tree_item.set_cell(1, str_value, Qt.white)
+            else:
+                tree_item.set_cell(1, str_value, sensor.value_color)
+
+            # Lowest and highest recorded value columns
+            if value != -9999:
+                tree_item.set_cell(2, "{0} {1}".format(sensor.lowest_recorded_value, sensor.unit))
+                tree_item.set_cell(3, "{0} {1}".format(sensor.highest_recorded_value, sensor.unit))
+
+            # Status column, the sensor's alarm level (see alarms.py)
+            tree_item.set_cell(4, STATUS_LABELS[sensor.status])
+
+        self.module_tree_widget.setUpdatesEnabled(True)
 
     def update_sidebar(self):
         if common.database_connection_status:
@@ -150,21 +204,21 @@ class UserInterface:
             self.arduino_status_widget.setText("Not connected")
             self.arduino_status_widget.setStyleSheet("color:red")
 
-        if common.packet_received:
-            self.packet_time_widget.setText(str(common.time_since_last_packet) + " seconds")
-            self.uptime_widget.setText(str(common.uptime) + " seconds")
+        if common.packet_received and common.last_packet_time:
+            seconds_since_last_packet = time.monotonic() - common.last_packet_time
+            self.packet_time_widget.setText(str(int(seconds_since_last_packet)) + " seconds")
+            self.uptime_widget.setText(str(int(common.arduino_uptime + seconds_since_last_packet)) + " seconds")
         else:
             self.packet_time_widget.setText("N/A")
             self.uptime_widget.setText("N/A")
 
-        # Get the current item highlighted
-        selected_tree_item = self.module_tree_widget.currentItem()
-
-        # Each treeview item is actually a wrapper around the base class & a reference to the
-        # sensor it represents; this retrieves the sensor
-        if selected_tree_item.sensor:
-            sensor = selected_tree_item.sensor
+        ingest_pipeline = self.client.ingest_pipeline
+        self.ingest_queue_widget.setText("{0} spooled, {1} dropped".format(ingest_pipeline.queue_depth(),
+                                                                         ingest_pipeline.packets_dropped()))
+        self.latency_widget.setText(common.latency_monitor.report())
 
+        sensor = self.selected_sensor()
+        if sensor:
             self.sensor_detail_label.setText(sensor.label)
             self.sensor_detail_unit.setText(sensor.unit)
             self.sensor_detail_parent_label.setText(sensor.parent_label)
@@ -174,6 +228,9 @@ class UserInterface:
             self.sensor_detail_upper_critical_bound.setText(str(sensor.upper_critical_bound))
             self.sensor_detail_max.setText(str(sensor.highest_recorded_value))
             self.sensor_detail_min.setText(str(sensor.lowest_recorded_value))
+            # Kept up to date by the ingest pipeline, see rollingstats.py
+            self.sensor_detail_statistics.setText(
+                self.client.ingest_pipeline.statistics_engine.report(sensor.unique_tag))
 
         # Do not display any values for modules (it wouldn't make sense)
         else:
@@ -186,9 +243,20 @@ class UserInterface:
             self.sensor_detail_upper_critical_bound.setText("")
             self.sensor_detail_max.setText("")
             self.sensor_detail_min.setText("")
+            self.sensor_detail_statistics.setText("")
 
         self.module_tree_widget.clearSelection()  # Prevents "ghosting" effect with selected items
 
+    # The sensor of the currently highlighted tree item, or None if a module (or nothing) is highlighted
+    def selected_sensor(self):
+        selected_tree_item = self.module_tree_widget.currentItem()
+
+        # Each treeview item is actually a wrapper around the base class & a reference to the
+        # sensor it represents; this retrieves the sensor
+        if selected_tree_item:
+            return selected_tree_item.sensor
+        return None
+
 """
     def update_chart(self):
         sensor = self.module_tree_widget.currentItem().sensor
@@ -213,6 +281,19 @@ class UserInterface:
 """
 
 
+# Event filter on the tree and chart viewports that tells the interface when they get repainted, for
+# the paint latency (see latency.py). Lets every event through
+class PaintWatcher(QObject):
+    def __init__(self, user_interface):
+        super().__init__()
+        self.user_interface = user_interface
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            self.user_interface.painted()
+        return False
+
+
 # Wrapper that keeps a reference to the sensor object that the tree item represents
 class QTreeWidgetItemWrapper(QTreeWidgetItem):
     # Has to be done this way to allow passing the sensor to the constructor
@@ -223,71 +304,21 @@ class QTreeWidgetItemWrapper(QTreeWidgetItem):
             self.sensor = None
         QTreeWidgetItem.__init__(self, *args, **kwargs)
 
+        # What each column currently shows, and the sensor version it was last refreshed from
+        self.cells = {}
+        self.rendered_version = None
 
-class LineChart:
-    def __init__(self, frame):
-        self.series = QtCharts.QLineSeries()
-        self.series.setColor(Qt.red)
-
-        self.axis_x = QtCharts.QDateTimeAxis()
-        # Number of items to display
-        self.axis_x.setTickCount(int(common.SETTINGS["DataCacheSize"]))
-        self.axis_x.setFormat("hh:mm:ss:z") # Date format
-        self.axis_x.setTitleText("Time")
-
-        self.axis_y = QtCharts.QValueAxis()
-        self.axis_y.setTitleText("Value")
-
-        self.chart = QtCharts.QChart()
-        self.chart.setTitle("")
-        self.chart.addSeries(self.series)
-        self.chart.addAxis(self.axis_x, QtCore.Qt.AlignBottom)
-        self.chart.addAxis(self.axis_y, QtCore.Qt.AlignLeft)
-
-        self.series.attachAxis(self.axis_x)
-        self.series.attachAxis(self.axis_y)
-
-        self.chart_view = QtCharts.QChartView(self.chart)
-
-        self.layout = QVBoxLayout()
-        self.layout.addWidget(self.chart_view)
-
-        self.frame = frame
-        self.frame.setLayout(self.layout)
-
-    def update(self, sensor):
-        # Remove all previous values; list will be updated with relevant values
-        self.series.removePoints(0, len(self.series.points()))
-
-        if sensor:
-            for entry in sensor.value_cache:
-                # Time/value, respectively
-                self.series.append(entry[0].toMSecsSinceEpoch(), entry[1])
-
-        # Insert debug values for testing
-        else:
-            for x in range(10):
-                # Float to avoid int overflow problems on Windows
-                self.series.append(float(QtCore.QDateTime.currentMSecsSinceEpoch()), 10*random.random())
-                time.sleep(.001)
-
-        raw_x_list = [value.x() for value in self.series.points()]
-        raw_y_list = [value.y() for value in self.series.points()]
- 
-        min_x = min(raw_x_list)
-        max_x = max(raw_x_list)
-
-        min_y = min(raw_y_list)
-        max_y = max(raw_y_list)
-        y_margin = (max_y - min_y) / 10
+    # Hands the text (and background color) of a cell to Qt, unless the cell already shows exactly that
+    def set_cell(self, column, text, color=None):
+        if self.cells.get(column) == (text, color):
+            return
+        self.cells[column] = (text, color)
 
-        self.axis_x.setRange(QtCore.QDateTime().fromMSecsSinceEpoch(min_x), QtCore.QDateTime().fromMSecsSinceEpoch(max_x))
-        self.axis_y.setRange(min_y - y_margin, max_y + y_margin)
+        self.setData(column, Qt.ItemDataRole.DisplayRole, text)
+        if color is not None:
+            self.setBackground(column, color)
 
 
-class GaugeChart:
-    def __init__(self):
-        pass 
 """
 class SensorGraph(QWidget):
     def __init__(self, parent=None):
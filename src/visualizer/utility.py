@@ -1,21 +1,35 @@
+import copy
 import datetime
 from xml.etree import ElementTree
 
 
 class Parser:
-    # Returns the XML file in DOM/tree form
+    # Parameters.xml and settings.txt, parsed once per process
+    config = None
+
+    @staticmethod
+    def load_config():
+        if Parser.config is None:
+            Parser.config = Parser.parse_config()
+        return Parser.config
+
+    @staticmethod
+    def parse_config():
+        root = ElementTree.parse("Parameters.xml").getroot()
+        return {
+            "Modules": Parser.parse_modules(root.find("Modules")),
+            "Packet": Parser.parse_packet(root.find("Packet")),
+            "Derived": Parser.parse_derived(root.find("Derived")),
+            "settings": Parser.parse_settings(),
+        }
+
+    # Returns a section of the XML file in the form of dicts and lists. Callers modify what they get
+    # (e.g. Module pops the label), so each call gets a copy of its own
     @staticmethod
     def parse_xml(section):
-        path = "Parameters.xml"
-        xml_tree = ElementTree.parse(path)
-        root = xml_tree.getroot()
-
-        if section == "Modules":
-            return Parser.parse_modules(root.find(section))
-        elif section == "Settings":
-            return Parser.parse_SETTINGS(root.find(section))
-        else:
+        if section not in ("Modules", "Packet", "Derived"):
             raise ValueError("Section key not supported")
+        return copy.deepcopy(Parser.load_config()[section])
 
     # Extracts useful information from the tree 
     @staticmethod
@@ -29,9 +43,23 @@ class Parser:
             all_module_data[module.tag] = individual_module_data
         return all_module_data
 
-    # Extracts key/value pairs from the separate "settings.txt" file
+    # Extracts the attributes of the packet's fields, in the order they are declared
+    @staticmethod
+    def parse_packet(tree):
+        return [field.attrib for field in tree.iter("field")]
+
+    # Extracts the kind (element name) and attributes of each derived channel, in the order they are declared
+    @staticmethod
+    def parse_derived(tree):
+        return [(channel.tag, channel.attrib) for channel in tree]
+
     @staticmethod
     def load_settings():
+        return dict(Parser.load_config()["settings"])
+
+    # Extracts key/value pairs from the separate "settings.txt" file
+    @staticmethod
+    def parse_settings():
         settings = {}
         with open("./settings.txt") as file:
             for line in file: